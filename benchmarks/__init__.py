@@ -0,0 +1,7 @@
+'''Benchmarks of the stages of checking data, on synthetic data of any size.
+
+    python -m benchmarks run --size 1000 --size 100000 --output results.json
+    python -m benchmarks compare deployed.json results.json
+
+See docs/deployment.md.
+'''
@@ -0,0 +1,61 @@
+import argparse
+import os
+import tempfile
+
+from benchmarks import compare, run
+from benchmarks.generators import ERROR_INTERVAL, KINDS, write_data
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks of the stages of Cove')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--app', '-a', action='append', choices=list(run.APPS),
+                            help='App whose benchmarks are run, can be repeated, defaults to all of them')
+    run_parser.add_argument('--benchmark', '-k', action='append',
+                            help='Only run the benchmarks whose name contains this, e.g. schema_validation')
+    run_parser.add_argument('--size', '-n', action='append', type=int,
+                            help='Number of items (releases, grants, activities...) of the data, can be repeated, '
+                                 'defaults to 1000')
+    run_parser.add_argument('--repeat', '-r', type=int, default=3, help='Number of runs of each benchmark')
+    run_parser.add_argument('--memory', '-m', action='store_true',
+                            help='Measure the peak memory allocated by Python, in a run of its own')
+    run_parser.add_argument('--output', '-o', help='JSON file where the results are written')
+    run_parser.add_argument('--settings', help='Django settings module, instead of the settings of the app')
+    add_data_arguments(run_parser)
+    run_parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'cove-benchmarks'),
+                            help='Directory where the data files are kept between runs')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two results files')
+    compare_parser.add_argument('base', help='Results of the reference version, e.g. the deployed release')
+    compare_parser.add_argument('new', help='Results of the version compared to it')
+    compare_parser.add_argument('--threshold', '-t', type=float, default=0.1,
+                                help='Slowdown reported as a regression, 0.1 (the default) for 10%%')
+
+    generate_parser = subparsers.add_parser('generate', help='Write a data file used by the benchmarks')
+    generate_parser.add_argument('kind', choices=list(KINDS))
+    generate_parser.add_argument('size', type=int, help='Number of items')
+    generate_parser.add_argument('path', help='File written')
+    add_data_arguments(generate_parser)
+
+    options = vars(parser.parse_args())
+    if options['command'] == 'run':
+        options['size'] = options['size'] or [1000]
+        run.main(options)
+    elif options['command'] == 'compare':
+        compare.main(options)
+    else:
+        write_data(options['kind'], options['path'], options['size'], seed=options['seed'],
+                   error_interval=options['error_interval'])
+
+
+def add_data_arguments(parser):
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random values of the data')
+    parser.add_argument('--error-interval', type=int, default=ERROR_INTERVAL,
+                        help='One item in this many has errors, 0 for none')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''Compare two results files of the benchmarks, e.g. of the deployed release and of the next one.
+
+The benchmarks are compared on their fastest run, the least noisy of the
+timings. Those that got slower by more than ``threshold`` (0.1 for 10%), or
+that only work in the base results, are regressions.
+'''
+import json
+import sys
+from collections import OrderedDict
+
+
+def load_results(path):
+    '''Return the results of a results file, by (benchmark, kind, size)'''
+    with open(path) as fp:
+        document = json.load(fp, object_pairs_hook=OrderedDict)
+    return document, OrderedDict(((row['benchmark'], row['kind'], row['size']), row) for row in document['results'])
+
+
+def compare_results(base, new, threshold=0.1):
+    '''Return a row for each benchmark of ``base`` or ``new`` (results by key), with ``regression`` set if it is one'''
+    rows = []
+    for key in list(base) + [key for key in new if key not in base]:
+        base_row, new_row = base.get(key), new.get(key)
+        row = OrderedDict([
+            ('benchmark', key[0]), ('kind', key[1]), ('size', key[2]),
+            ('base', base_row['min'] if base_row else None), ('new', new_row['min'] if new_row else None),
+            ('change', None), ('regression', False),
+        ])
+        if row['base'] and row['new']:
+            row['change'] = row['new'] / row['base'] - 1
+            row['regression'] = row['change'] > threshold
+        elif base_row and base_row['status'] == 'ok' and new_row and new_row['status'] != 'ok':
+            row['regression'] = True
+        rows.append(row)
+    return rows
+
+
+def format_comparison(rows):
+    lines = ['{:<26} {:<14} {:>8} {:>11} {:>11} {:>8}'.format('Benchmark', 'Kind', 'Size', 'Base', 'New', 'Change')]
+    for row in rows:
+        times = ['-' if seconds is None else '{:.3f}s'.format(seconds) for seconds in (row['base'], row['new'])]
+        change = '-' if row['change'] is None else '{:+.1%}'.format(row['change'])
+        lines.append('{:<26} {:<14} {:>8} {:>11} {:>11} {:>8}{}'.format(
+            row['benchmark'], row['kind'], row['size'], times[0], times[1], change,
+            '  slower' if row['regression'] else ''))
+    return '\n'.join(lines)
+
+
+def main(options):
+    base_document, base = load_results(options['base'])
+    new_document, new = load_results(options['new'])
+    for name, document in (('base', base_document), ('new', new_document)):
+        environment = document['environment']
+        sys.stdout.write('{:<5} {} Python {} on {} ({} CPUs)\n'.format(
+            name, environment['revision'], environment['python'], environment['platform'], environment['cpu_count']))
+    if base_document['environment']['platform'] != new_document['environment']['platform']:
+        sys.stdout.write('The results were measured on different platforms\n')
+
+    rows = compare_results(base, new, threshold=options['threshold'])
+    sys.stdout.write(format_comparison(rows) + '\n')
+    regressions = sum(1 for row in rows if row['regression'])
+    if regressions:
+        sys.stdout.write('{} benchmarks slower by more than {:.0%}\n'.format(regressions, options['threshold']))
+        sys.exit(1)
@@ -0,0 +1,408 @@
+'''Deterministic synthetic data for the benchmarks.
+
+The same kind, size and seed always give the same data (spreadsheets only
+differ in the timestamps of their zip entries), so timings of different
+releases are measured on identical files. One item in every
+``error_interval`` (0 for none) has problems the checks report: values that
+don't match the schema, fields that aren't in it, values missing from the
+codelists, failing 360Giving additional checks or IATI rules. The files are
+written one item at a time, so that a million of them don't have to fit in
+memory (except the strings of spreadsheets, which openpyxl keeps until the
+end).
+'''
+import csv
+import datetime
+import json
+import random
+from collections import OrderedDict
+
+from lxml import etree
+
+
+ERROR_INTERVAL = 20
+START_DATE = datetime.date(2015, 1, 1)
+
+OCDS_EXTENSIONS = [
+    'https://raw.githubusercontent.com/open-contracting/ocds_metrics_extension/master/extension.json',
+    'https://raw.githubusercontent.com/open-contracting/ocds_extension_parties/master/extension.json',
+    'https://raw.githubusercontent.com/open-contracting/ocds_partyDetails_scale_extension/master/extension.json',
+]
+CURRENCIES = ('GBP', 'USD', 'EUR')
+WORDS = ('road', 'school', 'water', 'repair', 'supply', 'health', 'training', 'bridge', 'software', 'community',
+         'services', 'equipment', 'maintenance', 'youth', 'housing', 'energy', 'library', 'transport')
+
+# The spreadsheet columns of the 360Giving grants, with their titles as in the files people supply
+GRANT_COLUMNS = (
+    ('Identifier', ('id',)),
+    ('Title', ('title',)),
+    ('Description', ('description',)),
+    ('Currency', ('currency',)),
+    ('Amount Awarded', ('amountAwarded',)),
+    ('Award Date', ('awardDate',)),
+    ('Planned Dates:Duration (months)', ('plannedDates', 0, 'duration')),
+    ('Recipient Org:Identifier', ('recipientOrganization', 0, 'id')),
+    ('Recipient Org:Name', ('recipientOrganization', 0, 'name')),
+    ('Recipient Org:Charity Number', ('recipientOrganization', 0, 'charityNumber')),
+    ('Recipient Org:Company Number', ('recipientOrganization', 0, 'companyNumber')),
+    ('Recipient Org:Postal Code', ('recipientOrganization', 0, 'postalCode')),
+    ('Funding Org:Identifier', ('fundingOrganization', 0, 'id')),
+    ('Funding Org:Name', ('fundingOrganization', 0, 'name')),
+    ('Grant Programme:Code', ('grantProgramme', 0, 'code')),
+    ('Grant Programme:Title', ('grantProgramme', 0, 'title')),
+    ('Beneficiary Location:Name', ('beneficiaryLocation', 0, 'name')),
+    ('Beneficiary Location:Geographical Code', ('beneficiaryLocation', 0, 'geoCode')),
+    ('Beneficiary Location:Geographical Code Type', ('beneficiaryLocation', 0, 'geoCodeType')),
+    ('Last modified', ('dateModified',)),
+    ('Data source', ('dataSource',)),
+)
+
+# The spreadsheet columns of the IATI activities, with flattentool's XML paths
+ACTIVITY_COLUMNS = (
+    ('iati-identifier', 'iati-identifier'),
+    ('reporting-org/@ref', 'reporting-org/@ref'),
+    ('reporting-org/@type', 'reporting-org/@type'),
+    ('reporting-org/narrative', 'reporting-org/narrative'),
+    ('title/narrative', 'title/narrative'),
+    ('description/narrative', 'description/narrative'),
+    ('participating-org/@role', 'participating-org/@role'),
+    ('participating-org/@ref', 'participating-org/@ref'),
+    ('activity-status/@code', 'activity-status/@code'),
+    ('activity-date/0/@type', 'activity-date[1]/@type'),
+    ('activity-date/0/@iso-date', 'activity-date[1]/@iso-date'),
+    ('activity-date/1/@type', 'activity-date[2]/@type'),
+    ('activity-date/1/@iso-date', 'activity-date[2]/@iso-date'),
+    ('recipient-country/@code', 'recipient-country/@code'),
+    ('recipient-country/@percentage', 'recipient-country/@percentage'),
+    ('sector/@code', 'sector/@code'),
+    ('sector/@percentage', 'sector/@percentage'),
+    ('transaction/0/transaction-type/@code', 'transaction[1]/transaction-type/@code'),
+    ('transaction/0/transaction-date/@iso-date', 'transaction[1]/transaction-date/@iso-date'),
+    ('transaction/0/value/@value-date', 'transaction[1]/value/@value-date'),
+    ('transaction/0/value', 'transaction[1]/value'),
+    ('transaction/1/transaction-type/@code', 'transaction[2]/transaction-type/@code'),
+    ('transaction/1/transaction-date/@iso-date', 'transaction[2]/transaction-date/@iso-date'),
+    ('transaction/1/value/@value-date', 'transaction[2]/value/@value-date'),
+    ('transaction/1/value', 'transaction[2]/value'),
+)
+
+
+def _has_errors(num, error_interval):
+    return bool(error_interval) and num % error_interval == error_interval - 1
+
+
+def _date(num, days=0):
+    return (START_DATE + datetime.timedelta(days=(num + days) % 3650)).isoformat()
+
+
+def _text(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def generate_ocds_release(num, rng, error_interval=ERROR_INTERVAL):
+    '''Return the release ``num`` of an OCDS release package'''
+    ocid = 'ocds-213czf-{:08d}'.format(num // 2)
+    buyer = OrderedDict([('id', 'GB-LAE-{:04d}'.format(rng.randrange(400))), ('name', 'Council {}'.format(num % 400))])
+    supplier = OrderedDict([('id', 'GB-COH-{:08d}'.format(rng.randrange(10 ** 8))),
+                            ('name', '{} Ltd'.format(_text(rng, 2).title()))])
+    amount = rng.randrange(1000, 10 ** 7)
+    currency = rng.choice(CURRENCIES)
+    items = [OrderedDict([
+        ('id', str(item_num + 1)),
+        ('description', _text(rng, 4)),
+        ('classification', OrderedDict([('scheme', 'CPV'), ('id', '{:08d}'.format(rng.randrange(10 ** 8)))])),
+        ('quantity', rng.randrange(1, 100)),
+        ('unit', OrderedDict([('name', 'Unit'), ('value', OrderedDict([('amount', rng.randrange(1, 1000)),
+                                                                      ('currency', currency)]))])),
+    ]) for item_num in range(rng.randrange(1, 4))]
+
+    release = OrderedDict([
+        ('ocid', ocid),
+        ('id', '{}-{}'.format(ocid, 'award' if num % 2 else 'tender')),
+        ('date', '{}T00:00:00Z'.format(_date(num))),
+        ('tag', ['award' if num % 2 else 'tender']),
+        ('initiationType', 'tender'),
+        ('language', 'en'),
+        ('parties', [
+            OrderedDict([('id', buyer['id']), ('name', buyer['name']), ('roles', ['buyer'])]),
+            OrderedDict([('id', supplier['id']), ('name', supplier['name']), ('roles', ['supplier']),
+                         ('details', {'scale': rng.choice(('sme', 'large'))})]),
+        ]),
+        ('buyer', buyer),
+        ('tender', OrderedDict([
+            ('id', '{}-tender'.format(ocid)),
+            ('title', _text(rng, 3).capitalize()),
+            ('description', _text(rng, 12).capitalize()),
+            ('status', 'complete' if num % 2 else 'active'),
+            ('items', items),
+            ('value', OrderedDict([('amount', amount), ('currency', currency)])),
+            ('procurementMethod', rng.choice(('open', 'selective', 'limited'))),
+            ('mainProcurementCategory', rng.choice(('goods', 'works', 'services'))),
+            ('tenderPeriod', OrderedDict([('startDate', '{}T00:00:00Z'.format(_date(num))),
+                                          ('endDate', '{}T00:00:00Z'.format(_date(num, 30)))])),
+            ('documents', [OrderedDict([('id', '{}-doc'.format(ocid)), ('documentType', 'tenderNotice'),
+                                        ('url', 'https://example.com/{}.pdf'.format(ocid))])]),
+        ])),
+    ])
+    if num % 2:
+        release['awards'] = [OrderedDict([
+            ('id', '{}-award'.format(ocid)),
+            ('status', 'active'),
+            ('date', '{}T00:00:00Z'.format(_date(num, 60))),
+            ('value', OrderedDict([('amount', amount), ('currency', currency)])),
+            ('suppliers', [supplier]),
+        ])]
+
+    if _has_errors(num, error_interval):
+        _add_release_errors(release, rng)
+    return release
+
+
+def _add_release_errors(release, rng):
+    release['date'] = 'not a date'
+    release['tender']['status'] = 'notACodelistValue'
+    release['tender']['items'][0].pop('id')
+    release['tender']['value']['amount'] = str(release['tender']['value']['amount'])
+    release['tender']['benchmarkNote'] = _text(rng, 3)
+    release['tender']['documents'][0]['documentType'] = 'notACodelistValue'
+
+
+def generate_ocds_record(num, rng, error_interval=ERROR_INTERVAL):
+    '''Return the record ``num`` of an OCDS record package, with its compiled release'''
+    # The award release, the last one of the record
+    release = generate_ocds_release(num * 2 + 1, rng, error_interval=0)
+    if _has_errors(num, error_interval):
+        _add_release_errors(release, rng)
+    ocid = release['ocid']
+    return OrderedDict([
+        ('ocid', ocid),
+        ('releases', [OrderedDict([
+            ('url', 'https://example.com/releases/{}.json#{}'.format(num, release_id)),
+            ('date', '{}T00:00:00Z'.format(_date(num, days))),
+            ('tag', [tag]),
+        ]) for release_id, days, tag in (('{}-tender'.format(ocid), 0, 'tender'),
+                                         ('{}-award'.format(ocid), 60, 'award'))]),
+        ('compiledRelease', release),
+    ])
+
+
+def generate_360_grant(num, rng, error_interval=ERROR_INTERVAL):
+    '''Return the grant ``num`` of a 360Giving file'''
+    amount = rng.randrange(500, 500000)
+    charity_number = str(rng.randrange(200000, 1200000))
+    grant = OrderedDict([
+        ('id', '360G-bench-{:08d}'.format(num)),
+        ('title', 'Grant for {}'.format(_text(rng, 3))),
+        ('description', 'Funding to support {} in the local area.'.format(_text(rng, 8))),
+        ('currency', 'GBP'),
+        ('amountAwarded', amount),
+        ('awardDate', _date(num)),
+        ('plannedDates', [OrderedDict([('duration', rng.randrange(1, 48))])]),
+        ('recipientOrganization', [OrderedDict([
+            ('id', 'GB-CHC-{}'.format(charity_number)),
+            ('name', '{} Trust'.format(_text(rng, 2).title())),
+            ('charityNumber', charity_number),
+            ('postalCode', 'AB{} {}CD'.format(rng.randrange(1, 99), rng.randrange(1, 9))),
+        ])]),
+        ('fundingOrganization', [OrderedDict([('id', 'GB-CHC-1000000'), ('name', 'Benchmark Foundation')])]),
+        ('grantProgramme', [OrderedDict([('code', 'P{}'.format(num % 10)),
+                                         ('title', 'Programme {}'.format(num % 10))])]),
+        ('beneficiaryLocation', [OrderedDict([('name', 'District {}'.format(num % 300)),
+                                              ('geoCode', 'E0{:07d}'.format(num % 300)),
+                                              ('geoCodeType', 'LAD')])]),
+        ('dateModified', '{}T00:00:00Z'.format(_date(num, 90))),
+        ('dataSource', 'https://example.com/grants'),
+    ])
+    if _has_errors(num, error_interval):
+        grant['amountAwarded'] = 0
+        grant['awardDate'] = 'not a date'
+        grant['description'] = 'Contact grants@example.com'
+        organization = grant['recipientOrganization'][0]
+        organization['id'] = 'XX-BENCH-{}'.format(num)
+        organization.pop('charityNumber')
+        organization['benchmarkNote'] = _text(rng, 2)
+    return grant
+
+
+def generate_iati_activity(num, rng, error_interval=ERROR_INTERVAL):
+    '''Return the lxml element of the activity ``num`` of an IATI file, with OpenAg tags and locations'''
+    errors = _has_errors(num, error_interval)
+    reporting_ref = 'XX-BENCH-{}'.format(num) if errors else 'GB-COH-{:08d}'.format(num % 1000)
+    start, end = (_date(num, 365), _date(num)) if errors else (_date(num), _date(num, 365))
+    activity = etree.Element('iati-activity')
+
+    def sub(parent, tag, text=None, **attrib):
+        element = etree.SubElement(parent, tag, OrderedDict((key.replace('_', '-'), value)
+                                                            for key, value in sorted(attrib.items())))
+        if text is not None:
+            element.text = text
+        return element
+
+    sub(activity, 'iati-identifier', '{}-{:08d}'.format(reporting_ref, num))
+    sub(sub(activity, 'reporting-org', ref=reporting_ref, type='40'), 'narrative', 'Organisation {}'.format(num % 1000))
+    sub(sub(activity, 'title'), 'narrative', _text(rng, 4).capitalize())
+    sub(sub(activity, 'description'), 'narrative', _text(rng, 16).capitalize())
+    sub(activity, 'participating-org', role='1', ref='GB-GOV-{}'.format(num % 20))
+    sub(activity, 'activity-status', code='2')
+    sub(activity, 'activity-date', type='1', iso_date=start)
+    sub(activity, 'activity-date', type='3', iso_date=end)
+    sub(activity, 'recipient-country', code=rng.choice(('AF', 'KE', 'TZ', 'UG')), percentage='100')
+    location = sub(activity, 'location')
+    if not errors:
+        sub(location, 'location-id', vocabulary='G1', code=str(rng.randrange(10 ** 6)))
+    sub(sub(location, 'name'), 'narrative', 'District {}'.format(num % 300))
+    sub(activity, 'sector', code=str(rng.choice((11110, 12220, 31161))), percentage='100' if not errors else '60')
+    if not errors:
+        sub(sub(activity, 'tag', vocabulary='98', vocabulary_uri='http://aims.fao.org/aos/agrovoc/',
+                code='c_{}'.format(rng.randrange(10000))), 'narrative', 'Agriculture')
+    for transaction_num, type_code in enumerate(('2', '3')):
+        transaction = sub(activity, 'transaction')
+        sub(transaction, 'transaction-type', code=type_code)
+        sub(transaction, 'transaction-date', iso_date=_date(num, 30 * (transaction_num + 1)))
+        value = rng.randrange(1000, 10 ** 6)
+        sub(transaction, 'value', 'not a number' if errors and transaction_num else str(value),
+            value_date=_date(num, 30 * (transaction_num + 1)))
+    return activity
+
+
+def _iter_items(generate, count, seed, error_interval):
+    rng = random.Random(seed)
+    for num in range(count):
+        yield generate(num, rng, error_interval=error_interval)
+
+
+def write_json_package(path, package, items_key, items):
+    '''Write the JSON object ``package`` to ``path`` with ``items`` as its ``items_key`` array'''
+    with open(path, 'w', encoding='utf-8') as fp:
+        # The other fields of the package, without the closing brace
+        fp.write(json.dumps(package, indent=2)[:-2] + ',\n' if package else '{\n')
+        fp.write('  "{}": [\n'.format(items_key))
+        for num, item in enumerate(items):
+            if num:
+                fp.write(',\n')
+            fp.write(json.dumps(item))
+        fp.write('\n  ]\n}\n')
+
+
+def write_ocds_releases(path, count, seed=0, error_interval=ERROR_INTERVAL, extensions=True):
+    '''Write an OCDS 1.1 release package of ``count`` releases'''
+    package = OrderedDict([
+        ('uri', 'https://example.com/releases.json'),
+        ('version', '1.1'),
+        ('publishedDate', '{}T00:00:00Z'.format(START_DATE.isoformat())),
+        ('publisher', {'name': 'Benchmark publisher'}),
+    ])
+    if extensions:
+        package['extensions'] = OCDS_EXTENSIONS
+    write_json_package(path, package, 'releases', _iter_items(generate_ocds_release, count, seed, error_interval))
+
+
+def write_ocds_records(path, count, seed=0, error_interval=ERROR_INTERVAL, extensions=True):
+    '''Write an OCDS 1.1 record package of ``count`` records'''
+    package = OrderedDict([
+        ('uri', 'https://example.com/records.json'),
+        ('version', '1.1'),
+        ('publishedDate', '{}T00:00:00Z'.format(START_DATE.isoformat())),
+        ('publisher', {'name': 'Benchmark publisher'}),
+        ('packages', ['https://example.com/releases.json']),
+    ])
+    if extensions:
+        package['extensions'] = OCDS_EXTENSIONS
+    write_json_package(path, package, 'records', _iter_items(generate_ocds_record, count, seed, error_interval))
+
+
+def write_360_json(path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write a 360Giving JSON file of ``count`` grants'''
+    write_json_package(path, {}, 'grants', _iter_items(generate_360_grant, count, seed, error_interval))
+
+
+def _grant_rows(count, seed, error_interval):
+    yield [title for title, path in GRANT_COLUMNS]
+    for grant in _iter_items(generate_360_grant, count, seed, error_interval):
+        row = []
+        for title, path in GRANT_COLUMNS:
+            value = grant
+            for key in path:
+                try:
+                    value = value[key]
+                except (KeyError, IndexError):
+                    value = ''
+                    break
+            row.append(value)
+        yield row
+
+
+def _activity_rows(count, seed, error_interval):
+    yield [header for header, xpath in ACTIVITY_COLUMNS]
+    for activity in _iter_items(generate_iati_activity, count, seed, error_interval):
+        row = []
+        for header, xpath in ACTIVITY_COLUMNS:
+            values = activity.xpath(xpath)
+            row.append(str(values[0]) if values and isinstance(values[0], str) else
+                       values[0].text if values else '')
+        yield row
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as fp:
+        csv.writer(fp).writerows(rows)
+
+
+def write_xlsx(path, sheet_name, rows):
+    '''Write ``rows`` to the only sheet of a new spreadsheet, without keeping them in memory'''
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_360_csv(path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write a 360Giving CSV file of ``count`` grants, with column titles'''
+    write_csv(path, _grant_rows(count, seed, error_interval))
+
+
+def write_360_xlsx(path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write a 360Giving spreadsheet of ``count`` grants, with column titles'''
+    write_xlsx(path, 'grants', _grant_rows(count, seed, error_interval))
+
+
+def write_iati_xml(path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write an IATI 2.03 activities file of ``count`` activities'''
+    with open(path, 'wb') as fp:
+        fp.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        fp.write('<iati-activities version="2.03" generated-datetime="{}T00:00:00Z">\n'.format(
+            START_DATE.isoformat()).encode('utf-8'))
+        for activity in _iter_items(generate_iati_activity, count, seed, error_interval):
+            fp.write(etree.tostring(activity, pretty_print=True, encoding='utf-8'))
+        fp.write(b'</iati-activities>\n')
+
+
+def write_iati_xlsx(path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write an IATI spreadsheet of ``count`` activities, as flattentool reads them'''
+    write_xlsx(path, 'iati-activity', _activity_rows(count, seed, error_interval))
+
+
+def write_iati_csv(path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write an IATI CSV file of ``count`` activities, as flattentool reads them'''
+    write_csv(path, _activity_rows(count, seed, error_interval))
+
+
+# The kinds of data: name -> (write function, file extension)
+KINDS = OrderedDict([
+    ('ocds-releases', (write_ocds_releases, 'json')),
+    ('ocds-records', (write_ocds_records, 'json')),
+    ('360-json', (write_360_json, 'json')),
+    ('360-csv', (write_360_csv, 'csv')),
+    ('360-xlsx', (write_360_xlsx, 'xlsx')),
+    ('iati-xml', (write_iati_xml, 'xml')),
+    ('iati-csv', (write_iati_csv, 'csv')),
+    ('iati-xlsx', (write_iati_xlsx, 'xlsx')),
+])
+
+
+def write_data(kind, path, count, seed=0, error_interval=ERROR_INTERVAL):
+    '''Write a file of ``count`` items of ``kind`` (see KINDS) to ``path``'''
+    write, extension = KINDS[kind]
+    write(path, count, seed=seed, error_interval=error_interval)
@@ -0,0 +1,196 @@
+'''Run the benchmarks and write their results as JSON.
+
+The benchmarks of each app run in their own process, with the settings of
+the app. Each benchmark runs ``repeat`` times on each size of each kind of
+data it takes, in a new empty directory each time.
+'''
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+from benchmarks.generators import ERROR_INTERVAL, KINDS, write_data
+
+
+APPS = OrderedDict([
+    ('ocds', 'cove_ocds.settings'),
+    ('360', 'cove_360.settings'),
+    ('iati', 'cove_iati.settings'),
+])
+# Change this when the results change in a way that makes older ones impossible to compare
+RESULTS_FORMAT_VERSION = 1
+PACKAGES = ('Django', 'flattentool', 'jsonref', 'jsonschema', 'lxml', 'openpyxl')
+
+
+def get_data_file(kind, size, data_dir, seed=0, error_interval=ERROR_INTERVAL):
+    '''Return the path of the data file of ``kind`` with ``size`` items in ``data_dir``, written if needed'''
+    path = os.path.join(data_dir, '{}-{}-{}-{}.{}'.format(kind, size, seed, error_interval, KINDS[kind][1]))
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        # Other runs may be using the data dir, they must only see a complete file
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            write_data(kind, tmp_path, size, seed=seed, error_interval=error_interval)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return path
+
+
+def get_environment():
+    '''Return what the timings depend on besides the code: the machine, the packages, the settings'''
+    import pkg_resources
+    from dealer.contrib.django.settings import BACKEND
+    from django.conf import settings
+
+    packages = OrderedDict()
+    for name in PACKAGES:
+        try:
+            packages[name] = pkg_resources.get_distribution(name).version
+        except pkg_resources.DistributionNotFound:
+            packages[name] = None
+    return OrderedDict([
+        ('revision', BACKEND.revision),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+        ('packages', packages),
+        ('settings', OrderedDict((name, getattr(settings, name, None)) for name in (
+            'STREAM_JSON_THRESHOLD', 'STREAM_XML_THRESHOLD', 'VALIDATION_WORKERS', 'VALIDATION_ERROR_SAMPLES'))),
+    ])
+
+
+def run_benchmark(function, path, work_dir, repeat, memory=False):
+    '''Return the times of ``repeat`` runs of the benchmark ``function`` on ``path``, and its peak memory'''
+    run = function(path, work_dir)
+    times = []
+    for num in range(repeat):
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        start = time.perf_counter()
+        run(output_dir)
+        times.append(time.perf_counter() - start)
+        shutil.rmtree(output_dir)
+
+    peak_memory = None
+    if memory:
+        # In a run of its own, as tracing the memory slows everything down
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        tracemalloc.start()
+        try:
+            run(output_dir)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            shutil.rmtree(output_dir)
+    return times, peak_memory
+
+
+def run_app(app, options, stdout=sys.stdout):
+    '''Run the benchmarks of ``app`` in this process, return the results document'''
+    import django
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = options.get('settings') or APPS[app]
+    django.setup()
+    from benchmarks.stages import get_benchmarks
+
+    stdout.write('{:<26} {:<14} {:>8} {:>11} {:>11}\n'.format('Benchmark', 'Kind', 'Size', 'Min', 'Median'))
+    results = []
+    for name, kinds, function in get_benchmarks(app, options.get('benchmark')):
+        for kind in kinds:
+            for size in options['size']:
+                row = OrderedDict([
+                    ('benchmark', name), ('app', app), ('kind', kind), ('size', size), ('status', 'ok'),
+                    ('times', []), ('min', None), ('median', None), ('items_per_second', None),
+                    ('peak_memory', None), ('message', ''),
+                ])
+                work_dir = tempfile.mkdtemp(prefix='cove-benchmark-')
+                try:
+                    path = get_data_file(kind, size, options['data_dir'], seed=options['seed'],
+                                         error_interval=options['error_interval'])
+                    times, peak_memory = run_benchmark(function, path, work_dir, options['repeat'],
+                                                       memory=options.get('memory'))
+                    row.update([
+                        ('times', [round(seconds, 6) for seconds in times]),
+                        ('min', round(min(times), 6)),
+                        ('median', round(statistics.median(times), 6)),
+                        ('items_per_second', round(size / min(times), 1) if min(times) else None),
+                        ('peak_memory', peak_memory),
+                    ])
+                except Exception as e:
+                    row['status'] = 'error'
+                    row['message'] = str(e) or e.__class__.__name__
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                results.append(row)
+                stdout.write(format_row(row) + '\n')
+                stdout.flush()
+
+    return OrderedDict([
+        ('format_version', RESULTS_FORMAT_VERSION),
+        ('created', datetime.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'),
+        ('environment', get_environment()),
+        ('options', OrderedDict((key, options.get(key)) for key in ('size', 'repeat', 'seed', 'error_interval'))),
+        ('results', results),
+    ])
+
+
+def run_apps(apps, options):
+    '''Run the benchmarks of each of ``apps`` in a new process, return the results document of all of them'''
+    document = None
+    for app in apps:
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            args = [sys.executable, '-m', 'benchmarks', 'run', '--app', app, '--output', output.name,
+                    '--repeat', str(options['repeat']), '--seed', str(options['seed']),
+                    '--error-interval', str(options['error_interval']), '--data-dir', options['data_dir']]
+            for size in options['size']:
+                args.extend(['--size', str(size)])
+            for name in options.get('benchmark') or ():
+                args.extend(['--benchmark', name])
+            if options.get('memory'):
+                args.append('--memory')
+            # It exits with an error if some benchmarks failed, they are in its results
+            subprocess.call(args)
+            try:
+                with open(output.name) as fp:
+                    app_document = json.load(fp, object_pairs_hook=OrderedDict)
+            except ValueError:
+                raise SystemExit('The {} benchmarks did not complete'.format(app))
+        if document is None:
+            document = app_document
+        else:
+            document['results'].extend(app_document['results'])
+    return document
+
+
+def format_row(row):
+    if row['status'] != 'ok':
+        return '{:<26} {:<14} {:>8}  error: {}'.format(row['benchmark'], row['kind'], row['size'], row['message'])
+    return '{:<26} {:<14} {:>8} {:>10.3f}s {:>10.3f}s {:>12} items/s'.format(
+        row['benchmark'], row['kind'], row['size'], row['min'], row['median'],
+        '-' if row['items_per_second'] is None else '{:.0f}'.format(row['items_per_second']))
+
+
+def main(options):
+    apps = options.get('app') or list(APPS)
+    if options.get('settings') and len(apps) > 1:
+        raise SystemExit('--settings can only be used with a single --app')
+    if len(apps) == 1:
+        document = run_app(apps[0], options)
+    else:
+        document = run_apps(apps, options)
+
+    if options.get('output'):
+        with open(options['output'], 'w') as fp:
+            json.dump(document, fp, indent=2)
+            fp.write('\n')
+    if any(row['status'] != 'ok' for row in document['results']):
+        sys.exit(1)
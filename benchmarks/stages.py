@@ -0,0 +1,280 @@
+'''The benchmarks of each stage of checking data.
+
+Each benchmark is a function ``(path, work_dir)`` registered with
+``@benchmark(name, app, kinds)``. It prepares what the stage needs from the
+data file ``path`` (parsed data, schemas, compiled rulesets, downloads...),
+which isn't timed, and returns the function timed, which runs the stage
+once, writing any file to the empty directory it is given. Like in the app,
+flattentool downloads the schemas it is given by URL in each conversion. ``kinds`` are the
+kinds of data files of benchmarks.generators it runs on.
+
+The libraries checking the data are imported in the benchmarks, as they can
+only be imported with the settings of their app.
+'''
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, app, kinds):
+    def register(function):
+        BENCHMARKS[name] = (app, kinds, function)
+        return function
+    return register
+
+
+def get_benchmarks(app, names=None):
+    '''Return the (name, kinds, function) of the benchmarks of ``app``, the ones containing one of ``names``'''
+    return [(name, kinds, function) for name, (benchmark_app, kinds, function) in BENCHMARKS.items()
+            if benchmark_app == app and (not names or any(part in name for part in names))]
+
+
+def _load_ocds_data(path):
+    from cove.lib.stream import load_json
+
+    return load_json(path, ('releases', 'records'), settings.STREAM_JSON_THRESHOLD, parse_float=float)
+
+
+def _load_ocds(path):
+    from cove_ocds.lib.schema import SchemaOCDS
+
+    json_data = _load_ocds_data(path)
+    schema_obj = SchemaOCDS(release_data=json_data, cache_schema=True)
+    if 'records' in json_data:
+        schema_name = schema_obj.record_pkg_schema_name
+        schema_obj.get_record_pkg_schema_fields()
+    else:
+        schema_name = schema_obj.release_pkg_schema_name
+        schema_obj.get_release_pkg_schema_fields()
+    schema_obj.process_codelists()
+    return json_data, schema_obj, schema_name
+
+
+def _check_conversion(context):
+    '''Raise the error of a conversion, which convert_json returns instead'''
+    if context.get('conversion_error'):
+        raise ValueError(context['conversion_error'])
+    return context
+
+
+def _ocds_schema_urls(schema_obj, work_dir):
+    if schema_obj.extensions:
+        schema_obj.create_extended_release_schema_file(work_dir, '', link=False)
+    return schema_obj.extended_schema_file or schema_obj.release_schema_url, schema_obj.release_pkg_schema_url
+
+
+@benchmark('ocds.load', 'ocds', ('ocds-releases', 'ocds-records'))
+def ocds_load(path, work_dir):
+    return lambda output_dir: _load_ocds_data(path)
+
+
+@benchmark('ocds.flatten', 'ocds', ('ocds-releases',))
+def ocds_flatten(path, work_dir):
+    from cove.lib.converters import convert_json
+
+    json_data, schema_obj, schema_name = _load_ocds(path)
+    schema_url, pkg_schema_url = _ocds_schema_urls(schema_obj, work_dir)
+    return lambda output_dir: _check_conversion(convert_json(output_dir, '', path, schema_url=schema_url,
+                                                             flatten=True, cache=False))
+
+
+@benchmark('ocds.unflatten', 'ocds', ('ocds-releases',))
+def ocds_unflatten(path, work_dir):
+    from cove.lib.converters import convert_json, convert_spreadsheet
+
+    json_data, schema_obj, schema_name = _load_ocds(path)
+    schema_url, pkg_schema_url = _ocds_schema_urls(schema_obj, work_dir)
+    # The spreadsheet version of the same data
+    _check_conversion(convert_json(work_dir, '', path, schema_url=schema_url, flatten=True, cache=False))
+    xlsx_path = os.path.join(work_dir, 'flattened.xlsx')
+    return lambda output_dir: convert_spreadsheet(output_dir, '', xlsx_path, 'xlsx', schema_url=schema_url,
+                                                  pkg_schema_url=pkg_schema_url, cache=False)
+
+
+@benchmark('ocds.schema_validation', 'ocds', ('ocds-releases', 'ocds-records'))
+def ocds_schema_validation(path, work_dir):
+    from cove.lib.common import get_schema_validation_errors, get_schema_validator
+
+    json_data, schema_obj, schema_name = _load_ocds(path)
+    get_schema_validator(schema_obj, schema_name)
+    return lambda output_dir: get_schema_validation_errors(json_data, schema_obj, schema_name, {}, {}, workers=0)
+
+
+@benchmark('ocds.additional_fields', 'ocds', ('ocds-releases', 'ocds-records'))
+def ocds_additional_fields(path, work_dir):
+    from cove.lib.common import get_counts_additional_fields
+
+    json_data, schema_obj, schema_name = _load_ocds(path)
+    return lambda output_dir: get_counts_additional_fields(json_data, schema_obj, schema_name, {},
+                                                           fields_regex=True)
+
+
+@benchmark('ocds.codelists', 'ocds', ('ocds-releases',))
+def ocds_codelists(path, work_dir):
+    from cove.lib.common import get_additional_codelist_values
+
+    json_data, schema_obj, schema_name = _load_ocds(path)
+    return lambda output_dir: get_additional_codelist_values(schema_obj, json_data)
+
+
+@benchmark('ocds.aggregates', 'ocds', ('ocds-releases', 'ocds-records'))
+def ocds_aggregates(path, work_dir):
+    from cove_ocds.lib.ocds import get_records_aggregates, get_releases_aggregates
+
+    json_data = _load_ocds_data(path)
+    get_aggregates = get_records_aggregates if 'records' in json_data else get_releases_aggregates
+    return lambda output_dir: get_aggregates(json_data)
+
+
+@benchmark('ocds.all_checks', 'ocds', ('ocds-releases', 'ocds-records'))
+def ocds_all_checks(path, work_dir):
+    from cove_ocds.lib.ocds import common_checks_ocds
+
+    json_data, schema_obj, schema_name = _load_ocds(path)
+    return lambda output_dir: common_checks_ocds({'file_type': 'json'}, output_dir, json_data, schema_obj,
+                                                 api=True, cache=False)
+
+
+def _load_360_data(path):
+    from cove.lib.stream import load_json
+
+    return load_json(path, ('grants',), settings.STREAM_JSON_THRESHOLD)
+
+
+def _load_360(path):
+    from cove_360.lib.schema import Schema360
+    from cove_360.lib.threesixtygiving import get_360_orgids_prefixes
+
+    schema_obj = Schema360()
+    schema_obj.get_release_pkg_schema_fields()
+    get_360_orgids_prefixes()
+    return _load_360_data(path), schema_obj
+
+
+@benchmark('360.flatten', '360', ('360-json',))
+def threesixty_flatten(path, work_dir):
+    from cove.lib.converters import convert_json
+    from cove_360.lib.schema import Schema360
+
+    schema_obj = Schema360()
+    return lambda output_dir: _check_conversion(convert_json(output_dir, '', path,
+                                                             schema_url=schema_obj.release_schema_url,
+                                                             flatten=True, cache=False))
+
+
+@benchmark('360.unflatten', '360', ('360-csv', '360-xlsx'))
+def threesixty_unflatten(path, work_dir):
+    from cove.lib.converters import convert_spreadsheet
+    from cove_360.lib.schema import Schema360
+
+    schema_obj = Schema360()
+    file_type = os.path.splitext(path)[1][1:]
+    return lambda output_dir: convert_spreadsheet(output_dir, '', path, file_type, schema_obj.release_schema_url,
+                                                  schema_obj.release_pkg_schema_url, cache=False)
+
+
+@benchmark('360.schema_validation', '360', ('360-json',))
+def threesixty_schema_validation(path, work_dir):
+    from cove.lib.common import get_schema_validation_errors, get_schema_validator
+
+    json_data, schema_obj = _load_360(path)
+    schema_name = schema_obj.release_pkg_schema_name
+    get_schema_validator(schema_obj, schema_name)
+    return lambda output_dir: get_schema_validation_errors(json_data, schema_obj, schema_name, {}, {}, workers=0)
+
+
+@benchmark('360.additional_fields', '360', ('360-json',))
+def threesixty_additional_fields(path, work_dir):
+    from cove.lib.common import get_counts_additional_fields
+
+    json_data, schema_obj = _load_360(path)
+    return lambda output_dir: get_counts_additional_fields(json_data, schema_obj, schema_obj.release_pkg_schema_name,
+                                                           {})
+
+
+@benchmark('360.aggregates', '360', ('360-json',))
+def threesixty_aggregates(path, work_dir):
+    from cove_360.lib.threesixtygiving import get_grants_aggregates
+
+    json_data = _load_360_data(path)
+    return lambda output_dir: get_grants_aggregates(json_data)
+
+
+@benchmark('360.additional_checks', '360', ('360-json',))
+def threesixty_additional_checks(path, work_dir):
+    from cove_360.lib.threesixtygiving import get_360_orgids_prefixes, run_additional_checks
+
+    json_data = _load_360_data(path)
+    get_360_orgids_prefixes()
+    return lambda output_dir: run_additional_checks(json_data, {})
+
+
+@benchmark('360.all_checks', '360', ('360-json',))
+def threesixty_all_checks(path, work_dir):
+    from cove_360.lib.threesixtygiving import common_checks_360
+
+    json_data, schema_obj = _load_360(path)
+    return lambda output_dir: common_checks_360({'file_type': 'json'}, output_dir, json_data, schema_obj)
+
+
+def _load_iati(path):
+    import defusedxml.lxml as etree
+
+    with open(path, 'rb') as fp:
+        return etree.parse(fp)
+
+
+@benchmark('iati.unflatten', 'iati', ('iati-csv', 'iati-xlsx'))
+def iati_unflatten(path, work_dir):
+    from cove.lib.converters import convert_spreadsheet
+    from cove_iati.lib.schema import SchemaIATI
+
+    schema_iati = SchemaIATI()
+    file_type = os.path.splitext(path)[1][1:]
+    return lambda output_dir: convert_spreadsheet(output_dir, '', path, file_type, cache=False, xml=True,
+                                                  xml_schemas=[schema_iati.activity_schema,
+                                                               schema_iati.common_schema])
+
+
+@benchmark('iati.schema_validation', 'iati', ('iati-xml',))
+def iati_schema_validation(path, work_dir):
+    from cove_iati.lib.iati import format_lxml_errors, get_xml_validation_errors, lxml_errors_generator
+    from cove_iati.lib.schema import SchemaIATI
+
+    tree = _load_iati(path)
+    schema = SchemaIATI().get_activity_xml_schema()
+
+    def run(output_dir):
+        schema.validate(tree)
+        return get_xml_validation_errors(format_lxml_errors(lxml_errors_generator(schema.error_log)), 'xml', {})
+    return run
+
+
+def _iati_ruleset(name):
+    def run_benchmark(path, work_dir):
+        from cove_iati.lib import rulesets
+
+        tree = _load_iati(path)
+        rulesets.warm_up([name])
+        return lambda output_dir: rulesets.run_ruleset(name, tree)
+    return run_benchmark
+
+
+benchmark('iati.ruleset.standard', 'iati', ('iati-xml',))(_iati_ruleset('iati_standard_v2_ruleset'))
+benchmark('iati.ruleset.openag', 'iati', ('iati-xml',))(_iati_ruleset('iati_openag_ruleset'))
+benchmark('iati.ruleset.orgids', 'iati', ('iati-xml',))(_iati_ruleset('iati_orgids_ruleset'))
+
+
+@benchmark('iati.all_checks', 'iati', ('iati-xml',))
+def iati_all_checks(path, work_dir):
+    from cove_iati.lib import rulesets, schema
+    from cove_iati.lib.iati import common_checks_context_iati
+
+    schema.warm_up()
+    rulesets.warm_up([rulesets.STANDARD_RULESET, rulesets.OPENAG_RULESET, rulesets.ORGIDS_RULESET])
+    return lambda output_dir: common_checks_context_iati({'file_type': 'xml'}, output_dir, path, 'xml', api=True,
+                                                         openag=True, orgids=True)
@@ -0,0 +1,131 @@
+import csv
+import json
+import os
+
+import lxml.etree
+import openpyxl
+import pytest
+
+from benchmarks.compare import compare_results
+from benchmarks.generators import ERROR_INTERVAL, KINDS, write_data
+from benchmarks.run import get_data_file, run_benchmark
+from benchmarks.stages import BENCHMARKS, get_benchmarks
+
+
+def read_data(path):
+    if path.endswith('.xlsx'):
+        workbook = openpyxl.load_workbook(path)
+        return [[[cell.value for cell in row] for row in sheet.iter_rows()] for sheet in workbook.worksheets]
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+@pytest.mark.parametrize('kind', list(KINDS))
+def test_generators_deterministic(kind, tmpdir):
+    paths = [str(tmpdir.join('{}.{}'.format(name, KINDS[kind][1]))) for name in ('a', 'b', 'c')]
+    write_data(kind, paths[0], 45)
+    write_data(kind, paths[1], 45)
+    write_data(kind, paths[2], 45, seed=1)
+    assert read_data(paths[0]) == read_data(paths[1])
+    assert read_data(paths[0]) != read_data(paths[2])
+
+
+@pytest.mark.parametrize(('kind', 'items_key'), [
+    ('ocds-releases', 'releases'), ('ocds-records', 'records'), ('360-json', 'grants')
+])
+def test_generate_json(kind, items_key, tmpdir):
+    path = str(tmpdir.join('data.json'))
+    write_data(kind, path, 45)
+    with open(path) as fp:
+        data = json.load(fp)
+    assert len(data[items_key]) == 45
+    assert json.dumps(data).count('not a date') == 45 // ERROR_INTERVAL
+
+    write_data(kind, path, 45, error_interval=0)
+    with open(path) as fp:
+        assert 'not a date' not in fp.read()
+
+
+def test_generate_360_csv(tmpdir):
+    path = str(tmpdir.join('grants.csv'))
+    write_data('360-csv', path, 45)
+    with open(path) as fp:
+        rows = list(csv.DictReader(fp))
+    assert len(rows) == 45
+    assert rows[0]['Identifier'] == '360G-bench-00000000'
+    assert [row['Amount Awarded'] for row in rows].count('0') == 45 // ERROR_INTERVAL
+
+
+def test_generate_iati_xml(tmpdir):
+    schema_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                               'cove_iati', 'iati_schemas', '2.03', 'iati-activities-schema.xsd')
+    schema = lxml.etree.XMLSchema(lxml.etree.parse(schema_path))
+    path = str(tmpdir.join('activities.xml'))
+
+    write_data('iati-xml', path, 45)
+    tree = lxml.etree.parse(path)
+    assert len(tree.getroot()) == 45
+    assert not schema.validate(tree)
+    assert len(schema.error_log) == 45 // ERROR_INTERVAL
+
+    write_data('iati-xml', path, 45, error_interval=0)
+    assert schema.validate(lxml.etree.parse(path))
+
+
+def test_get_data_file(tmpdir):
+    path = get_data_file('360-csv', 10, str(tmpdir))
+    assert os.listdir(str(tmpdir)) == [os.path.basename(path)]
+    with open(path, 'w') as fp:
+        fp.write('kept')
+    assert get_data_file('360-csv', 10, str(tmpdir)) == path
+    with open(path) as fp:
+        assert fp.read() == 'kept'
+    assert get_data_file('360-csv', 10, str(tmpdir), seed=1) != path
+
+
+def test_get_benchmarks():
+    assert set(app for app, kinds, function in BENCHMARKS.values()) == {'ocds', '360', 'iati'}
+    assert all(kind in KINDS for app, kinds, function in BENCHMARKS.values() for kind in kinds)
+    assert [name for name, kinds, function in get_benchmarks('iati', ['ruleset'])] == [
+        'iati.ruleset.standard', 'iati.ruleset.openag', 'iati.ruleset.orgids']
+
+
+def test_run_benchmark(tmpdir):
+    output_dirs = []
+
+    def benchmark(path, work_dir):
+        assert path == 'data.json'
+
+        def run(output_dir):
+            assert os.listdir(output_dir) == []
+            open(os.path.join(output_dir, 'output'), 'w').close()
+            output_dirs.append(output_dir)
+            return [0] * 10000
+        return run
+
+    times, peak_memory = run_benchmark(benchmark, 'data.json', str(tmpdir), 3)
+    assert len(times) == 3
+    assert peak_memory is None
+    assert len(set(output_dirs)) == 3
+    assert os.listdir(str(tmpdir)) == []
+
+    times, peak_memory = run_benchmark(benchmark, 'data.json', str(tmpdir), 1, memory=True)
+    assert len(times) == 1
+    assert peak_memory >= 80000
+
+
+def test_compare_results():
+    def results(*rows):
+        return {(name, 'iati-xml', 1000): {'status': status, 'min': seconds} for name, status, seconds in rows}
+
+    base = results(('same', 'ok', 1.0), ('slower', 'ok', 1.0), ('faster', 'ok', 1.0), ('broken', 'ok', 1.0),
+                   ('removed', 'ok', 1.0))
+    new = results(('same', 'ok', 1.05), ('slower', 'ok', 1.5), ('faster', 'ok', 0.5), ('broken', 'error', None),
+                  ('added', 'ok', 1.0))
+    rows = compare_results(base, new, threshold=0.1)
+    assert [row['benchmark'] for row in rows] == ['same', 'slower', 'faster', 'broken', 'removed', 'added']
+    assert [row['benchmark'] for row in rows if row['regression']] == ['slower', 'broken']
+    assert rows[1]['change'] == pytest.approx(0.5)
+    assert rows[4]['new'] is None and rows[4]['change'] is None
+
+    assert [row['benchmark'] for row in compare_results(base, new, threshold=0.6) if row['regression']] == ['broken']
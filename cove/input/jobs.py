@@ -0,0 +1,133 @@
+'''Run the analysis of supplied data in a pool of local worker processes.
+
+The SuppliedData row is the queue: its ``job_state`` says whether a job is
+queued, running or finished, and claiming a job is a single conditional UPDATE,
+so several web processes sharing the same database never run it twice. The
+context computed by the job is pickled to the upload directory, where the
+explore view picks it up once the job is done.
+
+With ``JOB_WORKERS = 0`` jobs are run straight away in the request, as before.
+'''
+import logging
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils import translation
+from django.utils.translation import ugettext_lazy as _
+
+from cove.input.models import SuppliedData
+from cove.lib.exceptions import CoveInputDataError
+
+
+logger = logging.getLogger(__name__)
+
+RESULT_FILE_NAME = 'job_result.pickle'
+ACTIVE_STATES = ('queued', 'running')
+
+STAGE_LABELS = {
+    'schema': _('Loading the schema'),
+    'convert': _('Converting the data'),
+    'validate': _('Checking the data'),
+}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.JOB_WORKERS)
+    return _executor
+
+
+def result_path(db_data):
+    return os.path.join(db_data.upload_dir(), RESULT_FILE_NAME)
+
+
+def is_active(db_data):
+    '''Whether a job for this data is queued or running, and not given up on'''
+    return (db_data.job_state in ACTIVE_STATES and db_data.job_queued and
+            db_data.job_queued > timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT))
+
+
+def stage_label(db_data):
+    if db_data.job_state == 'queued':
+        return _('Waiting for a free worker')
+    return STAGE_LABELS.get(db_data.job_stage, _('Starting'))
+
+
+def submit(db_data, func, context, options=None):
+    '''Queue ``func(db_data, context, options)`` unless a job is already active for this data.
+
+    The job is run in the active language, like the request submitting it.
+    Return True if this call queued the job.
+    '''
+    global _executor
+    timeout = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    claimed = SuppliedData.objects.filter(
+        Q(pk=db_data.pk) & (~Q(job_state__in=ACTIVE_STATES) | Q(job_queued__lt=timeout) | Q(job_queued=None))
+    ).update(job_state='queued', job_stage='', job_queued=timezone.now(), job_started=None, job_finished=None)
+    if not claimed:
+        return False
+    db_data.refresh_from_db()
+
+    # Worker processes are forked on the first submit: make sure they don't
+    # share the database connection of this process.
+    connections.close_all()
+    language = translation.get_language()
+    try:
+        get_executor().submit(run_job, db_data.pk, func, context, options, language)
+    except BrokenProcessPool:
+        _executor = None
+        get_executor().submit(run_job, db_data.pk, func, context, options, language)
+    return True
+
+
+def run_job(pk, func, context, options, language=None):
+    '''Run a job in a worker process, in ``language``, and store its result'''
+    db_data = SuppliedData.objects.get(pk=pk)
+    db_data.job_state = 'running'
+    db_data.job_started = timezone.now()
+    SuppliedData.objects.filter(pk=pk).update(job_state=db_data.job_state, job_started=db_data.job_started)
+
+    try:
+        with translation.override(language):
+            result = {'context': func(db_data, context, options or {})}
+        job_state = 'done'
+    except CoveInputDataError as err:
+        result = {'error': err.context}
+        job_state = 'done'
+    except Exception as err:
+        logger.exception(err)
+        result = {}
+        job_state = 'failed'
+
+    if job_state == 'done':
+        with open(result_path(db_data), 'wb') as fp:
+            pickle.dump(result, fp, pickle.HIGHEST_PROTOCOL)
+    SuppliedData.objects.filter(pk=pk).update(job_state=job_state, job_stage='', job_finished=timezone.now())
+
+
+def load_result(db_data):
+    '''Return the result stored by a finished job, or None'''
+    if db_data.job_state != 'done':
+        return None
+    try:
+        with open(result_path(db_data), 'rb') as fp:
+            return pickle.load(fp)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def clear_result(db_data):
+    try:
+        os.remove(result_path(db_data))
+    except FileNotFoundError:
+        pass
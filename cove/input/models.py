@@ -1,23 +1,63 @@
 from django.db import models
+import hashlib
 import uuid
 from django.core.urlresolvers import reverse
 import os
+import tempfile
+import time
+import zipfile
+import zlib
+from contextlib import closing
 from django.conf import settings
-import requests
-from django.core.files.base import ContentFile
-import rfc6266  # (content-disposition header parser)
+from django.template.defaultfilters import filesizeformat
+from django.utils.translation import ugettext as _
 
 CONTENT_TYPE_MAP = {
     'application/json': 'json',
     'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
     'text/csv': 'csv'
 }
+GZIP_CONTENT_TYPES = ('application/gzip', 'application/x-gzip')
+ZIP_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed')
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Seconds between two updates of the download progress in the database
+DOWNLOAD_PROGRESS_INTERVAL = 1
+
+
+class DownloadError(Exception):
+    '''The file at source_url can't be used, the message says why'''
 
 
 def upload_to(instance, filename=''):
     return os.path.join(str(instance.pk), filename)
 
 
+def check_size(size):
+    if settings.DOWNLOAD_MAX_SIZE and size > settings.DOWNLOAD_MAX_SIZE:
+        raise DownloadError(_('The file is bigger than the maximum size of {}.').format(
+            filesizeformat(settings.DOWNLOAD_MAX_SIZE)))
+
+
+def limit_size(chunks):
+    '''Yield the ``chunks``, raising DownloadError once they add up to more than DOWNLOAD_MAX_SIZE'''
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        check_size(size)
+        yield chunk
+
+
+def gunzip(chunks):
+    '''Decompress the gzip ``chunks``, never making chunks bigger than DOWNLOAD_CHUNK_SIZE'''
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk, DOWNLOAD_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+
+
 class SuppliedData(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     source_url = models.URLField(null=True, max_length=2000)
@@ -43,6 +83,32 @@ class SuppliedData(models.Model):
         null=True
     )
 
+    # State of the background job analysing the data (see cove.input.jobs)
+    job_state = models.CharField(
+        max_length=10,
+        choices=[
+            ('', 'Not queued'),
+            ('queued', 'Queued'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ],
+        default='',
+        blank=True
+    )
+    # What the running job is currently doing, e.g. 'convert' or 'validate'
+    job_stage = models.CharField(max_length=20, default='', blank=True)
+    job_queued = models.DateTimeField(null=True, blank=True)
+    job_started = models.DateTimeField(null=True, blank=True)
+    job_finished = models.DateTimeField(null=True, blank=True)
+
+    # SHA-256 of the original file, to reuse the results of identical data (see cove.input.result_cache)
+    content_hash = models.CharField(max_length=64, default='', blank=True)
+
+    # Progress of the download from source_url: bytes received, and bytes announced by the server
+    downloaded_size = models.BigIntegerField(null=True, blank=True)
+    download_size = models.BigIntegerField(null=True, blank=True)
+
     def get_absolute_url(self):
         return reverse('explore', args=(self.pk,), current_app=self.current_app)
 
@@ -52,32 +118,157 @@ class SuppliedData(models.Model):
     def upload_url(self):
         return os.path.join(settings.MEDIA_URL, upload_to(self))
 
+    def set_job_stage(self, stage):
+        '''Record what the running background job is doing, for the processing page'''
+        if self.job_state == 'running':
+            self.job_stage = stage
+            SuppliedData.objects.filter(pk=self.pk).update(job_stage=stage)
+
+    def get_content_hash(self):
+        '''Return the SHA-256 of the original file, computing and storing it if it isn't known yet'''
+        if not self.content_hash:
+            sha256 = hashlib.sha256()
+            with open(self.original_file.path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(64 * 1024), b''):
+                    sha256.update(chunk)
+            self.content_hash = sha256.hexdigest()
+            SuppliedData.objects.filter(pk=self.pk).update(content_hash=self.content_hash)
+        return self.content_hash
+
     def is_google_doc(self):
         return self.source_url.startswith('https://docs.google.com/')
 
+    def set_download_progress(self, downloaded_size):
+        self.downloaded_size = downloaded_size
+        SuppliedData.objects.filter(pk=self.pk).update(downloaded_size=downloaded_size,
+                                                       download_size=self.download_size)
+
     def download(self):
-        if self.source_url:
-            r = requests.get(self.source_url, headers={'User-Agent': 'Cove (cove.opendataservice.coop)'})
+        '''Download the file at source_url to the upload directory.
+
+        The file is written and hashed as it arrives. gzip files are
+        decompressed, and zip files must contain a single file, which is
+        extracted. Raise DownloadError if the file is bigger than
+        DOWNLOAD_MAX_SIZE, or not downloaded within DOWNLOAD_TIMEOUT seconds.
+        '''
+        # Only needed here and slow to import, models are loaded by every command
+        import requests
+        import rfc6266  # (content-disposition header parser)
+
+        if not self.source_url:
+            raise ValueError('No source_url specified.')
+
+        timeout = settings.DOWNLOAD_TIMEOUT or None
+        deadline = timeout and time.monotonic() + timeout
+        try:
+            r = requests.get(self.source_url, headers={'User-Agent': 'Cove (cove.opendataservice.coop)'},
+                             stream=True, timeout=timeout)
+        except requests.ReadTimeout:
+            raise DownloadError(_('The server took more than {} seconds to respond.').format(timeout))
+
+        with closing(r):
             r.raise_for_status()
             content_type = r.headers.get('content-type', '').split(';')[0].lower()
             file_extension = CONTENT_TYPE_MAP.get(content_type)
+            possible_file_name = rfc6266.parse_requests_response(r).filename_unsafe
+            file_name = r.url.split('/')[-1].split('?')[0][:100]
+
+            compression = None
+            if content_type in GZIP_CONTENT_TYPES or possible_file_name.endswith('.gz'):
+                compression = 'gzip'
+                # Named after the decompressed file
+                file_extension = None
+                if possible_file_name.endswith('.gz'):
+                    possible_file_name = possible_file_name[:-3]
+                if file_name.endswith('.gz'):
+                    file_name = file_name[:-3]
+            elif content_type in ZIP_CONTENT_TYPES or possible_file_name.endswith('.zip'):
+                compression = 'zip'
 
             if not file_extension:
-                possible_extension = rfc6266.parse_requests_response(r).filename_unsafe.split('.')[-1]
+                possible_extension = possible_file_name.split('.')[-1]
                 if possible_extension in CONTENT_TYPE_MAP.values():
                     file_extension = possible_extension
 
-            file_name = r.url.split('/')[-1].split('?')[0][:100]
             if file_name == '':
                 file_name = 'file'
             if file_extension:
                 if not file_name.endswith(file_extension):
                     file_name = file_name + '.' + file_extension
-            self.original_file.save(
-                file_name,
-                ContentFile(r.content))
-        else:
-            raise ValueError('No source_url specified.')
+
+            content_length = r.headers.get('content-length', '')
+            self.download_size = int(content_length) if content_length.isdigit() else None
+            if self.download_size:
+                # Fail before downloading anything
+                check_size(self.download_size)
+            self.set_download_progress(0)
+            chunks = limit_size(self._iter_download(r, deadline))
+            try:
+                if compression == 'zip':
+                    self._save_zip(chunks)
+                else:
+                    # requests already decompresses gzip content encoding
+                    if compression == 'gzip' and r.headers.get('content-encoding', '').lower() != 'gzip':
+                        chunks = limit_size(gunzip(chunks))
+                    self._save_file(file_name, chunks)
+            except zlib.error:
+                raise DownloadError(_('The file is not a valid gzip file.'))
+            except zipfile.BadZipFile:
+                raise DownloadError(_('The file is not a valid zip file.'))
+
+    def _iter_download(self, r, deadline):
+        '''Yield the content of the response ``r``, recording the progress and checking the deadline'''
+        progress_time = time.monotonic()
+        for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+            now = time.monotonic()
+            if deadline and now > deadline:
+                raise DownloadError(_('The file took more than {} seconds to download.').format(
+                    settings.DOWNLOAD_TIMEOUT))
+            if now - progress_time >= DOWNLOAD_PROGRESS_INTERVAL:
+                self.set_download_progress(r.raw.tell())
+                progress_time = now
+            yield chunk
+        self.set_download_progress(r.raw.tell())
+
+    def _save_file(self, file_name, chunks):
+        '''Write the ``chunks`` as the original file, named after ``file_name``, and hash them'''
+        storage = self.original_file.storage
+        name = storage.get_available_name(self.original_file.field.generate_filename(self, file_name),
+                                          max_length=self.original_file.field.max_length)
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sha256 = hashlib.sha256()
+        try:
+            with open(path, 'wb') as fp:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    fp.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        self.content_hash = sha256.hexdigest()
+        self.original_file.name = name
+        self.save()
+
+    def _save_zip(self, chunks):
+        '''Extract the single file of the zip file made of ``chunks`` as the original file'''
+        os.makedirs(self.upload_dir(), exist_ok=True)
+        fd, archive_path = tempfile.mkstemp(dir=self.upload_dir(), prefix='.download', suffix='.zip')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+            with zipfile.ZipFile(archive_path) as archive:
+                # Directories end with /
+                members = [info for info in archive.infolist() if not info.filename.endswith('/')]
+                if len(members) != 1:
+                    raise DownloadError(_('A zip file must contain a single file, this one contains {}.').format(
+                        len(members)))
+                with archive.open(members[0]) as member:
+                    self._save_file(os.path.basename(members[0].filename)[:100],
+                                    limit_size(iter(lambda: member.read(DOWNLOAD_CHUNK_SIZE), b'')))
+        finally:
+            os.remove(archive_path)
 
     def __repr__(self):
         return "<SuppliedData source_url={} original_file.name={}>".format(
@@ -0,0 +1,199 @@
+'''Reuse the results of supplied data that has already been checked.
+
+Publishers often supply the same file again and again. The context computed
+for supplied data is stored in RESULT_CACHE_DIR, with a copy of the files that
+the checks wrote to its upload directory (conversions, validation errors,
+source maps...), under a key made of the SHA-256 of the file and of everything
+else the results depend on: the app, its schema settings, the schema version
+already applied to the data, the options chosen by the user, the language the
+messages are in and the version of the code. The schema version and the extensions used are otherwise read from
+the data itself, so they are covered by its hash. When identical data is
+explored for the first time, the files are copied to its upload directory and
+the stored context is used instead of checking the data again.
+
+An empty RESULT_CACHE_DIR disables the cache.
+'''
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+from dealer.contrib.django.settings import BACKEND
+from django.conf import settings
+from django.utils import translation
+
+from cove.input.jobs import RESULT_FILE_NAME
+from cove.lib.source_map import SourceMap
+from cove.lib.stream import StreamedList, StreamedPackage
+
+
+logger = logging.getLogger(__name__)
+
+# Change this when the stored context or files change in a way the code version doesn't show
+CACHE_VERSION = 1
+CONTEXT_FILE_NAME = 'context.pickle'
+FILES_DIR_NAME = 'files'
+
+
+def get_cache_key(db_data, context, options):
+    '''Return the key of the results of ``db_data``, or None if the cache is disabled'''
+    if not settings.RESULT_CACHE_DIR:
+        return None
+    key = {
+        'content_hash': db_data.get_content_hash(),
+        'app': db_data.current_app,
+        'file_type': context.get('file_type'),
+        'schema_version': db_data.schema_version,
+        'options': options,
+        'language': translation.get_language(),
+        'config': getattr(settings, 'COVE_CONFIG', {}),
+        'validation_error_samples': [settings.VALIDATION_ERROR_SAMPLES, settings.VALIDATION_ERROR_RESERVOIR],
+        'code_version': [CACHE_VERSION, BACKEND.revision],
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_entry_dir(key):
+    return os.path.join(settings.RESULT_CACHE_DIR, key)
+
+
+def run_cached(func, db_data, context, options):
+    '''Return ``func(db_data, context, options)``, reusing the results of identical data if there are some'''
+    key = get_cache_key(db_data, context, options)
+    if key is None:
+        return func(db_data, context, options)
+
+    # Only data that has never been shown, the files of its upload directory can be replaced
+    if not db_data.rendered:
+        cached_context = load(key, db_data, context)
+        if cached_context is not None:
+            return cached_context
+
+    context = func(db_data, context, options)
+    try:
+        store(key, db_data, context)
+    except (OSError, pickle.PicklingError) as err:
+        logger.warning('Could not store the results of %s: %s', db_data.pk, err)
+    return context
+
+
+def store(key, db_data, context):
+    '''Store ``context`` and the files of the upload directory of ``db_data`` under ``key``'''
+    entry_dir = get_entry_dir(key)
+    if os.path.exists(entry_dir):
+        return
+
+    upload_dir = db_data.upload_dir()
+    os.makedirs(settings.RESULT_CACHE_DIR, exist_ok=True)
+    # Other processes may be storing the same results, they must only see a complete entry
+    tmp_dir = tempfile.mkdtemp(dir=settings.RESULT_CACHE_DIR, prefix='.tmp')
+    try:
+        files_dir = os.path.join(tmp_dir, FILES_DIR_NAME)
+        os.mkdir(files_dir)
+        skip_names = (os.path.basename(db_data.original_file.name), RESULT_FILE_NAME)
+        for name in os.listdir(upload_dir):
+            if name in skip_names:
+                continue
+            path = os.path.join(upload_dir, name)
+            if os.path.islink(path):
+                # e.g. the extended schema, linked to EXTENDED_SCHEMA_DIR
+                os.symlink(os.path.realpath(path), os.path.join(files_dir, name))
+            elif os.path.isdir(path):
+                shutil.copytree(path, os.path.join(files_dir, name), symlinks=True)
+            else:
+                shutil.copy2(path, os.path.join(files_dir, name))
+
+        with open(os.path.join(tmp_dir, CONTEXT_FILE_NAME), 'wb') as fp:
+            pickle.dump({
+                'context': context,
+                'upload_dir': upload_dir,
+                'upload_url': db_data.upload_url(),
+                'file_name': db_data.original_file.path,
+                'schema_version': db_data.schema_version,
+                'data_schema_version': db_data.data_schema_version,
+            }, fp, pickle.HIGHEST_PROTOCOL)
+
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Stored by another process in the meantime
+            if not os.path.exists(entry_dir):
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load(key, db_data, base_context):
+    '''Copy the results stored under ``key`` to ``db_data`` and return their context, or None if there are none'''
+    entry_dir = get_entry_dir(key)
+    try:
+        with open(os.path.join(entry_dir, CONTEXT_FILE_NAME), 'rb') as fp:
+            entry = pickle.load(fp)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+    files_dir = os.path.join(entry_dir, FILES_DIR_NAME)
+    names = os.listdir(files_dir)
+    links = {name: os.readlink(os.path.join(files_dir, name)) for name in names
+             if os.path.islink(os.path.join(files_dir, name))}
+    if not all(os.path.exists(target) for target in links.values()):
+        return None
+    if os.path.basename(db_data.original_file.name) in names:
+        return None
+
+    upload_dir = db_data.upload_dir()
+    for name in names:
+        path = os.path.join(upload_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+        if name in links:
+            os.symlink(os.path.relpath(links[name], upload_dir), path)
+        elif os.path.isdir(os.path.join(files_dir, name)):
+            shutil.copytree(os.path.join(files_dir, name), path, symlinks=True)
+        else:
+            shutil.copy2(os.path.join(files_dir, name), path)
+
+    # The original file comes first, as it is in the upload directory
+    replacements = (
+        (entry['file_name'], db_data.original_file.path),
+        (entry['upload_dir'], upload_dir),
+        (entry['upload_url'], db_data.upload_url()),
+    )
+    context = replace_paths(entry['context'], replacements)
+    context.update(base_context)
+
+    db_data.schema_version = entry['schema_version']
+    db_data.data_schema_version = entry['data_schema_version']
+    db_data.save()
+    return context
+
+
+def replace_paths(obj, replacements):
+    '''Replace the start of the strings in ``obj`` with the (old, new) ``replacements``, in place where possible'''
+    if isinstance(obj, str):
+        for old, new in replacements:
+            if obj.startswith(old):
+                return new + obj[len(old):]
+    elif isinstance(obj, StreamedList):
+        # Don't read the items from the file
+        obj.file_name = replace_paths(obj.file_name, replacements)
+    elif isinstance(obj, SourceMap):
+        obj.path = replace_paths(obj.path, replacements)
+    elif isinstance(obj, dict):
+        if isinstance(obj, StreamedPackage):
+            obj.file_name = replace_paths(obj.file_name, replacements)
+        for key, value in obj.items():
+            obj[key] = replace_paths(value, replacements)
+    elif isinstance(obj, list):
+        for num, value in enumerate(obj):
+            obj[num] = replace_paths(value, replacements)
+    elif type(obj) is tuple:
+        return tuple(replace_paths(value, replacements) for value in obj)
+    return obj
@@ -1,11 +1,14 @@
+import hashlib
+
 import requests
 
 from django import forms
 from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler
 from django.shortcuts import render, redirect
 from django.utils.translation import ugettext_lazy as _
 
-from cove.input.models import SuppliedData
+from cove.input.models import DownloadError, SuppliedData
 from django.views.decorators.csrf import csrf_exempt
 
 
@@ -31,6 +34,22 @@ class TextForm(forms.Form):
     paste = forms.CharField(label=_('Paste (JSON only)'), widget=forms.Textarea)
 
 
+class HashingUploadHandler(FileUploadHandler):
+    '''Compute the SHA-256 of the uploaded file while the next handlers write it'''
+    content_hash = ''
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.sha256 = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.content_hash = self.sha256.hexdigest()
+
+
 default_form_classes = {
     'upload_form': UploadForm,
     'url_form': UrlForm,
@@ -41,6 +60,8 @@ default_form_classes = {
 @csrf_exempt
 def data_input(request, form_classes=default_form_classes, text_file_name='test.json'):
     forms = {form_name: form_class() for form_name, form_class in form_classes.items()}
+    hashing_upload_handler = HashingUploadHandler(request)
+    request.upload_handlers.insert(0, hashing_upload_handler)
     request_data = None
     if "source_url" in request.GET:
         request_data = request.GET
@@ -62,6 +83,8 @@ def data_input(request, form_classes=default_form_classes, text_file_name='test.
                 data = form.save(commit=False)
             data.current_app = request.current_app
             data.form_name = form_name
+            if form_name == 'upload_form':
+                data.content_hash = hashing_upload_handler.content_hash
             data.save()
             if form_name == 'url_form':
                 try:
@@ -82,6 +105,13 @@ def data_input(request, form_classes=default_form_classes, text_file_name='test.
                         'msg': _(str(err) + '\n\n If you can access the file through a browser then the problem '
                                  'may be related to permissions, or you may be blocking certain user agents.')
                     })
+                except DownloadError as err:
+                    return render(request, 'error.html', context={
+                        'sub_title': _("Sorry we couldn't use the file at that URL"),
+                        'link': 'index',
+                        'link_text': _('Try Again'),
+                        'msg': str(err)
+                    })
             elif form_name == 'text_form':
                 data.original_file.save(text_file_name, ContentFile(form['paste'].value()))
             return redirect(data.get_absolute_url())
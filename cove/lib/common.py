@@ -1,26 +1,35 @@
 import collections
 import csv
-import datetime
 import functools
-import fcntl
+import hashlib
+import itertools
 import json
+import math
 import os
 import re
+import tempfile
+import threading
+from array import array
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from urllib.parse import urlparse, urljoin
 
 import jsonref
 import requests
 from cached_property import cached_property
-from flattentool.schema import get_property_type_set
-from flattentool import unflatten
+from django.conf import settings
 from jsonschema import FormatChecker, RefResolver
 from jsonschema.exceptions import ValidationError
 from jsonschema.validators import Draft4Validator as validator
 from django.utils.html import escape, conditional_escape, format_html
 
+from cove.lib.error_store import VALIDATION_ERRORS_FILE_NAME, ErrorStore, get_error_store
 from cove.lib.exceptions import cove_spreadsheet_conversion_error
-from cove.lib.tools import cached_get_request, decimal_default
+from cove.lib.registry import schema_registry
+from cove.lib.source_map import SourceMap, get_source_maps
+from cove.lib.tools import decimal_default
+from cove.lib.visitor import DataVisitor, walk_data
 
 
 uniqueItemsValidator = validator.VALIDATORS.pop("uniqueItems")
@@ -55,7 +64,7 @@ class CustomJsonrefLoader(jsonref.JsonLoader):
         # ignore url in ref apart from last part
         uri = self.schema_url + uri.split('/')[-1]
         if uri[:4] == 'http':
-            return super().get_remote_json(uri, **kwargs)
+            return schema_registry.get(uri).json(**kwargs)
         else:
             with open(uri) as schema_file:
                 return json.load(schema_file, **kwargs)
@@ -86,7 +95,10 @@ class CustomRefResolver(RefResolver):
         if document:
             return document
         if uri.startswith("http"):
-            return super().resolve_remote(uri)
+            result = schema_registry.get(uri).json()
+            if self.cache_remote:
+                self.store[uri] = result
+            return result
         else:
             with open(uri) as schema_file:
                 result = json.load(schema_file)
@@ -106,34 +118,43 @@ def _deref_schema(schema_str, schema_host):
 
 
 class SchemaJsonMixin():
+    '''Schema documents and objects, shared across instances through the schema registry.
+
+    Objects returned by the get_*_obj methods must not be modified.
+    '''
+    @property
+    def cache_key(self):
+        '''Identify the schema documents in use, for the schema registry keys'''
+        return (self.release_schema_url, self.release_pkg_schema_url)
+
+    def get_schema_str(self, url):
+        uri_scheme = urlparse(url).scheme
+        if uri_scheme == 'http' or uri_scheme == 'https':
+            # Don't even check if the schema changed for a cached schema
+            max_age = float('inf') if getattr(self, 'cache_schema', False) else None
+            return schema_registry.get_text(url, max_age=max_age)
+        else:
+            with open(url) as fp:
+                return fp.read()
+
     @cached_property
     def release_schema_str(self):
-        if getattr(self, 'cache_schema', False):
-            response = cached_get_request(self.release_schema_url)
-        else:
-            response = requests.get(self.release_schema_url)
-        return response.text
+        return self.get_schema_str(self.release_schema_url)
 
     @cached_property
     def release_pkg_schema_str(self):
-        uri_scheme = urlparse(self.release_pkg_schema_url).scheme
-        if uri_scheme == 'http' or uri_scheme == 'https':
-            if getattr(self, 'cache_schema', False):
-                response = cached_get_request(self.release_pkg_schema_url)
-            else:
-                response = requests.get(self.release_pkg_schema_url)
-            return response.text
-        else:
-            with open(self.release_pkg_schema_url) as fp:
-                return fp.read()
+        return self.get_schema_str(self.release_pkg_schema_url)
 
     @property
     def _release_schema_obj(self):
-        return json.loads(self.release_schema_str, object_pairs_hook=OrderedDict)
+        schema_str = self.release_schema_str
+        return schema_registry.get_object(
+            ('json_ordered', schema_str), lambda: json.loads(schema_str, object_pairs_hook=OrderedDict))
 
     @property
     def _release_pkg_schema_obj(self):
-        return json.loads(self.release_pkg_schema_str)
+        schema_str = self.release_pkg_schema_str
+        return schema_registry.get_object(('json', schema_str), lambda: json.loads(schema_str))
 
     def deref_schema(self, schema_str):
         try:
@@ -152,12 +173,32 @@ class SchemaJsonMixin():
             return self.deref_schema(self.release_pkg_schema_str)
         return self._release_pkg_schema_obj
 
+    def get_cache_key(self, extended=False):
+        '''Key of the objects built from the schema (extended or not) in the schema registry'''
+        return (extended,) + self.cache_key
+
+    def get_schema_index(self, name, schema, extended=False):
+        '''Return the SchemaIndex of a dereferenced schema, from the schema registry'''
+        if not schema:
+            # The schema could not be dereferenced, don't remember that
+            return SchemaIndex(schema)
+        return schema_registry.get_object((name,) + self.get_cache_key(extended), lambda: SchemaIndex(schema))
+
+    def get_release_pkg_schema_index(self):
+        return self.get_schema_index('release_pkg_schema_index', self.get_release_pkg_schema_obj(deref=True))
+
     def get_release_pkg_schema_fields(self):
-        return set(schema_dict_fields_generator(self.get_release_pkg_schema_obj(deref=True)))
+        return set(self.get_release_pkg_schema_index().fields)
 
 
 def common_checks_context(upload_dir, json_data, schema_obj, schema_name, context, extra_checkers=None,
-                          fields_regex=False, api=False, cache=True):
+                          fields_regex=False, api=False, cache=True, visitors=(), validation_workers=None):
+    '''Run the checks shared by all the standards, return the updated context and the cell source map.
+
+    ``visitors`` are extra DataVisitor analyses to run in the same traversal of
+    the data as the common ones, their results are available once this returns.
+    ``validation_workers`` overrides the VALIDATION_WORKERS setting.
+    '''
     schema_version = getattr(schema_obj, 'version', None)
     schema_version_choices = getattr(schema_obj, 'version_choices', None)
 
@@ -172,35 +213,23 @@ def common_checks_context(upload_dir, json_data, schema_obj, schema_name, contex
                 'version_used_display': schema_version_choices[schema_version][0]}
             )
 
-    additional_fields = sorted(get_counts_additional_fields(json_data, schema_obj, schema_name,
-                                                            context, fields_regex=fields_regex))
-    context.update({
-        'data_only': additional_fields,
-        'additional_fields_count': sum(item[2] for item in additional_fields)
-    })
-
     cell_source_map = {}
     heading_source_map = {}
     if context['file_type'] != 'json':  # Assume it is csv or xlsx
-        with open(os.path.join(upload_dir, 'cell_source_map.json')) as cell_source_map_fp:
-            cell_source_map = json.load(cell_source_map_fp)
+        cell_source_map, heading_source_map = get_source_maps(upload_dir)
 
-        with open(os.path.join(upload_dir, 'heading_source_map.json')) as heading_source_map_fp:
-            heading_source_map = json.load(heading_source_map_fp)
-
-    # IMPORTANT: If you change this filename, you must change it also in cove/views.py
-    # Otherwsie people can upload a file with this name and inject HTML.
-    validation_errors_path = os.path.join(upload_dir, 'validation_errors-3.json')
+    # IMPORTANT: Uploaded files can't have this name (see cove/views.py),
+    # otherwise people can upload a file with this name and inject HTML.
+    validation_errors_path = os.path.join(upload_dir, VALIDATION_ERRORS_FILE_NAME)
     if os.path.exists(validation_errors_path):
-        with open(validation_errors_path) as validation_error_fp:
-            validation_errors = json.load(validation_error_fp)
+        error_store = ErrorStore.load(validation_errors_path)
     else:
-        validation_errors = get_schema_validation_errors(json_data, schema_obj, schema_name,
-                                                         cell_source_map, heading_source_map,
-                                                         extra_checkers=extra_checkers)
+        with get_error_store(upload_dir) as error_store:
+            get_schema_validation_errors(json_data, schema_obj, schema_name, cell_source_map, heading_source_map,
+                                         extra_checkers=extra_checkers, workers=validation_workers,
+                                         error_store=error_store)
         if cache:
-            with open(validation_errors_path, 'w+') as validation_error_fp:
-                json.dump(validation_errors, validation_error_fp, sort_keys=True, indent=2, default=decimal_default)
+            error_store.dump(validation_errors_path)
 
     extensions = None
     if getattr(schema_obj, 'extensions', None):
@@ -214,15 +243,27 @@ def common_checks_context(upload_dir, json_data, schema_obj, schema_name, contex
     context.update({
         'schema_url': schema_obj.release_pkg_schema_url,
         'extensions': extensions,
-        'validation_errors': sorted(validation_errors.items()),
-        'validation_errors_count': sum(len(value) for value in validation_errors.values()),
+        'validation_errors': error_store.context_errors(),
+        'validation_errors_count': error_store.total,
         'common_error_types': []
     })
 
-    json_data_gen_paths = get_json_data_generic_paths(json_data)
-    context['deprecated_fields'] = get_json_data_deprecated_fields(json_data_gen_paths, schema_obj)
+    fields_present = FieldsPresentVisitor()
+    data_paths = DataPathsIndex(schema_obj.get_release_pkg_schema_index())
+    walk_data(json_data, [fields_present, data_paths] + list(visitors))
+
+    additional_fields = sorted(get_counts_additional_fields(json_data, schema_obj, schema_name, context,
+                                                            fields_regex=fields_regex,
+                                                            fields_present=fields_present.result()))
+    context.update({
+        'data_only': additional_fields,
+        'additional_fields_count': sum(item[2] for item in additional_fields)
+    })
 
-    missing_ids = get_json_data_missing_ids(json_data_gen_paths, schema_obj)
+    json_data_paths = data_paths.result()
+    context['deprecated_fields'] = get_json_data_deprecated_fields(json_data_paths, schema_obj)
+
+    missing_ids = get_json_data_missing_ids(json_data_paths, schema_obj)
     if missing_ids:
         context.update({'structure_warnings': {'missing_ids': missing_ids}})
 
@@ -304,29 +345,34 @@ validator.VALIDATORS["required"] = required_draft4
 validator.VALIDATORS["oneOf"] = oneOf_draft4
 
 
-def fields_present_generator(json_data, prefix=''):
-    if not isinstance(json_data, dict):
-        return
-    for key, value in json_data.items():
-        if isinstance(value, list):
-            for item in value:
-                if isinstance(item, dict):
-                    yield from fields_present_generator(item, prefix + '/' + key)
-            yield prefix + '/' + key
-        elif isinstance(value, dict):
-            yield from fields_present_generator(value, prefix + '/' + key)
-            yield prefix + '/' + key
-        else:
-            yield prefix + '/' + key
+class FieldsPresentVisitor(DataVisitor):
+    '''Count the fields used in the data, e.g. {'/releases/tender/id': 2}'''
+    def __init__(self):
+        self.counter = collections.Counter()
+
+    def visit(self, path, value):
+        if not path:
+            return isinstance(value, dict)
+        if isinstance(path[-1], int):
+            # Only look into objects in arrays, not into arrays of arrays
+            return isinstance(value, dict)
+        self.counter['/' + '/'.join(key for key in path if isinstance(key, str))] += 1
+        return isinstance(value, (dict, list))
 
+    def finish(self):
+        return dict(self.counter)
 
-def get_fields_present(*args, **kwargs):
-    counter = collections.Counter()
-    counter.update(fields_present_generator(*args, **kwargs))
-    return dict(counter)
+
+def get_fields_present(json_data):
+    visitor = FieldsPresentVisitor()
+    walk_data(json_data, [visitor])
+    return visitor.result()
 
 
 def schema_dict_fields_generator(schema_dict):
+    # flattentool (and openpyxl) take a while to import, only load them when needed
+    from flattentool.schema import get_property_type_set
+
     if 'properties' in schema_dict and isinstance(schema_dict['properties'], dict):
         for property_name, value in schema_dict['properties'].items():
             if 'oneOf' in value:
@@ -347,13 +393,98 @@ def schema_dict_fields_generator(schema_dict):
                 yield '/' + property_name
 
 
-def get_counts_additional_fields(json_data, schema_obj, schema_name, context, fields_regex=False):
+def _lookup_schema(schema, path, ref_info=None):
+    if len(path) == 0:
+        return schema, ref_info
+    if hasattr(schema, '__reference__'):
+        ref_info = {
+            'path': path,
+            'reference': schema.__reference__,
+        }
+    path_item, *child_path = path
+    if 'items' in schema:
+        return _lookup_schema(schema['items'], path, ref_info)
+    elif 'properties' in schema:
+        if path_item in schema['properties']:
+            return _lookup_schema(schema['properties'][path_item], child_path, ref_info)
+        else:
+            return None, None
+
+
+def lookup_schema(schema, path):
+    return _lookup_schema(schema, path.split('/'))
+
+
+class SchemaIndex():
+    '''What the checks need to know about a dereferenced package schema, computed once.
+
+    * fields: set of field paths, e.g. '/releases/tender/id'
+    * non_required_ids: generic paths of non-required 'id' fields of objects in arrays
+    * deprecated_paths: (generic path, (deprecation version, description)) tuples
+    * codelist_paths: {generic path: (codelist file name, open?)}
+
+    lookup(path) returns the schema block and $ref information for a slash
+    separated path without array indexes, remembering the result.
+    '''
+    def __init__(self, schema):
+        self.schema = schema
+        self.fields = frozenset(schema_dict_fields_generator(schema))
+        self.non_required_ids = []
+        self.deprecated_paths = []
+        self.codelist_paths = {}
+        self._lookups = {}
+        self._walk(schema)
+
+    def _walk(self, obj, current_path=(), array_parent=False, list_merge=False):
+        properties = obj.get('properties', {})
+        no_required_id = 'id' not in obj.get('required', [])
+
+        if not isinstance(properties, dict):
+            return
+        for prop, value in properties.items():
+            path = current_path + (prop,)
+
+            if prop == 'id' and no_required_id and array_parent and not list_merge:
+                self.non_required_ids.append(path)
+
+            if "deprecated" in value:
+                self.deprecated_paths.append((
+                    path,
+                    (value['deprecated']['deprecatedVersion'], value['deprecated']['description'])
+                ))
+            elif getattr(value, '__reference__', None) and "deprecated" in value.__reference__:
+                self.deprecated_paths.append((
+                    path,
+                    (value.__reference__['deprecated']['deprecatedVersion'],
+                     value.__reference__['deprecated']['description'])
+                ))
+
+            if "codelist" in value and path not in self.codelist_paths:
+                self.codelist_paths[path] = (value['codelist'], value.get('openCodelist', False))
+
+            if value.get('type') == 'object':
+                self._walk(value, path)
+            elif value.get('type') == 'array' and value.get('items', {}).get('properties'):
+                has_list_merge = 'wholeListMerge' in value and value.get('wholeListMerge')
+                self._walk(value['items'], path, array_parent=True, list_merge=has_list_merge)
+
+    def lookup(self, path):
+        try:
+            return self._lookups[path]
+        except KeyError:
+            result = self._lookups[path] = lookup_schema(self.schema, path)
+            return result
+
+
+def get_counts_additional_fields(json_data, schema_obj, schema_name, context, fields_regex=False,
+                                 fields_present=None):
     if schema_name == 'record-package-schema.json':
         schema_fields = schema_obj.get_record_pkg_schema_fields()
     else:
         schema_fields = schema_obj.get_release_pkg_schema_fields()
 
-    fields_present = get_fields_present(json_data)
+    if fields_present is None:
+        fields_present = get_fields_present(json_data)
     data_only_all = set(fields_present) - schema_fields
     data_only = set()
     for field in data_only_all:
@@ -369,121 +500,407 @@ def get_counts_additional_fields(json_data, schema_obj, schema_name, context, fi
     return [('/'.join(key.split('/')[:-1]), key.split('/')[-1], fields_present[key]) for key in data_only]
 
 
-def get_schema_validation_errors(json_data, schema_obj, schema_name, cell_src_map, heading_src_map, extra_checkers=None):
+def _get_validator_args(schema_obj, schema_name):
+    '''Return the package schema and the arguments of the CustomRefResolver to validate against it'''
     if schema_name == 'record-package-schema.json':
         pkg_schema_obj = schema_obj.get_record_pkg_schema_obj()
     else:
         pkg_schema_obj = schema_obj.get_release_pkg_schema_obj()
 
-    validation_errors = collections.defaultdict(list)
+    if getattr(schema_obj, 'extended', None):
+        resolver_kwargs = {'schema_url': schema_obj.schema_host,
+                           'schema_file': schema_obj.extended_schema_file,
+                           'file_schema_name': schema_obj.release_schema_name}
+    else:
+        resolver_kwargs = {'schema_url': schema_obj.schema_host}
+    return pkg_schema_obj, resolver_kwargs
+
+
+def _make_validator(schema, pkg_schema_obj, resolver_kwargs, extra_checkers):
     format_checker = FormatChecker()
     if extra_checkers:
         format_checker.checkers.update(extra_checkers)
 
-    if getattr(schema_obj, 'extended', None):
-        resolver = CustomRefResolver('', pkg_schema_obj, schema_url=schema_obj.schema_host,
-                                     schema_file=schema_obj.extended_schema_file,
-                                     file_schema_name=schema_obj.release_schema_name)
-    else:
-        resolver = CustomRefResolver('', pkg_schema_obj, schema_url=schema_obj.schema_host)
-
-    our_validator = validator(pkg_schema_obj, format_checker=format_checker, resolver=resolver)
-    for e in our_validator.iter_errors(json_data):
-        message_safe = None
-        message = e.message
-        path = "/".join(str(item) for item in e.path)
-        path_no_number = "/".join(str(item) for item in e.path if not isinstance(item, int))
-
-        value = {"path": path}
-        cell_reference = cell_src_map.get(path)
-
-        if cell_reference:
-            first_reference = cell_reference[0]
-            if len(first_reference) == 4:
-                value["sheet"], value["col_alpha"], value["row_number"], value["header"] = first_reference
-            if len(first_reference) == 2:
-                value["sheet"], value["row_number"] = first_reference
-
-        header = value.get('header')
-        if not header and len(e.path):
-            header = e.path[-1]
-
-        validator_type = e.validator
-        if e.validator in ('format', 'type'):
-            validator_type = e.validator_value
-            null_clause = ''
-            if isinstance(e.validator_value, list):
-                validator_type = e.validator_value[0]
-                if 'null' not in e.validator_value:
-                    null_clause = 'is not null, and'
-            else:
-                null_clause = 'is not null, and'
+    resolver = CustomRefResolver('', pkg_schema_obj, **resolver_kwargs)
+    if schema is not pkg_schema_obj and pkg_schema_obj.get('id'):
+        # Resolve references in a part of the package schema as when validating the whole package
+        resolver.push_scope(pkg_schema_obj['id'])
+    return validator(schema, format_checker=format_checker, resolver=resolver)
+
+
+def _build_schema_validator(schema_obj, schema_name, extra_checkers):
+    pkg_schema_obj, resolver_kwargs = _get_validator_args(schema_obj, schema_name)
+    return _make_validator(pkg_schema_obj, pkg_schema_obj, resolver_kwargs, extra_checkers)
 
-            message_template = validation_error_template_lookup.get(validator_type, message)
-            message_safe_template = validation_error_template_lookup_safe.get(validator_type)
-            if message_template:
-                message = message_template.format(header, null_clause)
-            if message_safe_template:
-                message_safe = format_html(message_safe_template, header, null_clause)
-
-        if e.validator == 'oneOf' and e.validator_value[0] == {'format': 'date-time'}:
-            # Give a nice date related error message for 360Giving date `oneOf`s.
-            message = validation_error_template_lookup['date-time']
-            message_safe = format_html(validation_error_template_lookup_safe['date-time'])
-            validator_type = 'date-time'
-
-        if not isinstance(e.instance, (dict, list)):
-            value["value"] = e.instance
-
-        if e.validator == 'required':
-            field_name = e.message
-            parent_name = None
-            if len(e.path) > 2:
-                if isinstance(e.path[-1], int):
-                    parent_name = e.path[-2]
-                else:
-                    parent_name = e.path[-1]
-
-            heading = heading_src_map.get(path_no_number + '/' + e.message)
-            if heading:
-                field_name = heading[0][1]
-                value['header'] = heading[0][1]
-            if parent_name:
-                message = "'{}' is missing but required within '{}'".format(field_name, parent_name)
-                message_safe = format_html("<code>{}</code> is missing but required within <code>{}</code>", field_name, parent_name)
+
+def get_schema_validator(schema_obj, schema_name, extra_checkers=None):
+    '''Return a validator for the package schema, shared through the schema registry.
+
+    The resolver of a validator keeps state while validating, so each thread
+    gets its own validator.
+    '''
+    cache_key = getattr(schema_obj, 'cache_key', None)
+    if cache_key is None:
+        return _build_schema_validator(schema_obj, schema_name, extra_checkers)
+    key = ('validator', threading.get_ident(), schema_name, getattr(schema_obj, 'extended', None),
+           getattr(schema_obj, 'extended_schema_file', None), tuple(sorted(extra_checkers.items())) if extra_checkers else ()) + cache_key
+    return schema_registry.get_object(key, lambda: _build_schema_validator(schema_obj, schema_name, extra_checkers))
+
+
+def _get_validation_error_key_value(e, cell_src_map, heading_src_map):
+    '''Return the (key, value) of a ValidationError in the validation errors, None to skip it'''
+    message_safe = None
+    message = e.message
+    path = "/".join(str(item) for item in e.path)
+    path_no_number = "/".join(str(item) for item in e.path if not isinstance(item, int))
+
+    value = {"path": path}
+    cell_reference = cell_src_map.get(path)
+
+    if cell_reference:
+        first_reference = cell_reference[0]
+        if len(first_reference) == 4:
+            value["sheet"], value["col_alpha"], value["row_number"], value["header"] = first_reference
+        if len(first_reference) == 2:
+            value["sheet"], value["row_number"] = first_reference
+
+    header = value.get('header')
+    if not header and len(e.path):
+        header = e.path[-1]
+
+    validator_type = e.validator
+    if e.validator in ('format', 'type'):
+        validator_type = e.validator_value
+        null_clause = ''
+        if isinstance(e.validator_value, list):
+            validator_type = e.validator_value[0]
+            if 'null' not in e.validator_value:
+                null_clause = 'is not null, and'
+        else:
+            null_clause = 'is not null, and'
+
+        message_template = validation_error_template_lookup.get(validator_type, message)
+        message_safe_template = validation_error_template_lookup_safe.get(validator_type)
+        if message_template:
+            message = message_template.format(header, null_clause)
+        if message_safe_template:
+            message_safe = format_html(message_safe_template, header, null_clause)
+
+    if e.validator == 'oneOf' and e.validator_value[0] == {'format': 'date-time'}:
+        # Give a nice date related error message for 360Giving date `oneOf`s.
+        message = validation_error_template_lookup['date-time']
+        message_safe = format_html(validation_error_template_lookup_safe['date-time'])
+        validator_type = 'date-time'
+
+    if not isinstance(e.instance, (dict, list)):
+        value["value"] = e.instance
+
+    if e.validator == 'required':
+        field_name = e.message
+        parent_name = None
+        if len(e.path) > 2:
+            if isinstance(e.path[-1], int):
+                parent_name = e.path[-2]
             else:
-                message = "'{}' is missing but required".format(field_name)
-                message_safe = format_html("<code>{}</code> is missing but required", field_name, parent_name)
+                parent_name = e.path[-1]
+
+        heading = heading_src_map.get(path_no_number + '/' + e.message)
+        if heading:
+            field_name = heading[0][1]
+            value['header'] = heading[0][1]
+        if parent_name:
+            message = "'{}' is missing but required within '{}'".format(field_name, parent_name)
+            message_safe = format_html("<code>{}</code> is missing but required within <code>{}</code>", field_name, parent_name)
+        else:
+            message = "'{}' is missing but required".format(field_name)
+            message_safe = format_html("<code>{}</code> is missing but required", field_name, parent_name)
 
-        if e.validator == 'enum':
-            if "isCodelist" in e.schema:
-                continue
-            message = "Invalid code found in '{}'".format(header)
-            message_safe = format_html("Invalid code found in <code>{}</code>", header)
+    if e.validator == 'enum':
+        if "isCodelist" in e.schema:
+            return None
+        message = "Invalid code found in '{}'".format(header)
+        message_safe = format_html("Invalid code found in <code>{}</code>", header)
 
-        if e.validator == 'pattern':
-            message_safe = format_html('<code>{}</code> does not match the regex <code>{}</code>', header, e.validator_value)
+    if e.validator == 'pattern':
+        message_safe = format_html('<code>{}</code> does not match the regex <code>{}</code>', header, e.validator_value)
 
-        if e.validator == 'minItems' and e.validator_value == 1:
-            message_safe = format_html('<code>{}</code> is too short. You must supply at least one value, or remove the item entirely (unless it’s required).', e.instance)
+    if e.validator == 'minItems' and e.validator_value == 1:
+        message_safe = format_html('<code>{}</code> is too short. You must supply at least one value, or remove the item entirely (unless it’s required).', e.instance)
 
-        if e.validator == 'minLength' and e.validator_value == 1:
-            message_safe = format_html('<code>"{}"</code> is too short. Strings must be at least one character. This error typically indicates a missing value.', e.instance)
+    if e.validator == 'minLength' and e.validator_value == 1:
+        message_safe = format_html('<code>"{}"</code> is too short. Strings must be at least one character. This error typically indicates a missing value.', e.instance)
 
-        if message_safe is None:
-            message_safe = escape(message)
+    if message_safe is None:
+        message_safe = escape(message)
 
-        unique_validator_key = {
-            'message_type': validator_type,
-            'message': message,
-            'message_safe': conditional_escape(message_safe),
-            'path_no_number': path_no_number
-        }
-        validation_errors[json.dumps(unique_validator_key, sort_keys=True)].append(value)
-    return dict(validation_errors)
+    unique_validator_key = {
+        'message_type': validator_type,
+        'message': message,
+        'message_safe': conditional_escape(message_safe),
+        'path_no_number': path_no_number
+    }
+    return json.dumps(unique_validator_key, sort_keys=True), value
+
+
+class _ItemsMarker(ValidationError):
+    pass
+
+
+def items_marker(validator, marker, instance, schema):
+    '''Stand in for the `items` of a sharded array, to mark where the errors of its items go'''
+    if validator.is_type(instance, "array"):
+        yield _ItemsMarker('')
+
+
+ITEMS_MARKER = 'coveItemsMarker'
+validator.VALIDATORS[ITEMS_MARKER] = items_marker
+
+# Arrays of a package validated in parallel, one chunk of items at a time
+VALIDATION_ITEMS_KEYS = ('releases', 'records', 'grants')
+VALIDATION_CHUNK_SIZE = 500
 
+_validation_executor = None
 
-def get_json_data_generic_paths(json_data, path=(), generic_paths=None):
+
+def get_validation_executor(workers):
+    global _validation_executor
+    if _validation_executor is None or _validation_executor._max_workers != workers:
+        if _validation_executor is not None:
+            _validation_executor.shutdown(wait=False)
+        _validation_executor = ProcessPoolExecutor(max_workers=workers)
+    return _validation_executor
+
+
+def _get_envelope_schema(pkg_schema_obj, items_key):
+    '''Return a copy of the package schema with the `items` of ``items_key`` replaced by ITEMS_MARKER.
+
+    Return None if the items are not described that way. Key order is kept, so
+    errors come in the same order as with the package schema.
+    '''
+    properties = pkg_schema_obj.get('properties')
+    if not isinstance(properties, dict):
+        return None
+    items_property = properties.get(items_key)
+    if (not isinstance(items_property, dict) or '$ref' in items_property or
+            not isinstance(items_property.get('items'), dict)):
+        return None
+
+    envelope_property = OrderedDict((ITEMS_MARKER if key == 'items' else key, value)
+                                    for key, value in items_property.items())
+    envelope_properties = OrderedDict((key, envelope_property if key == items_key else value)
+                                      for key, value in properties.items())
+    return OrderedDict((key, envelope_properties if key == 'properties' else value)
+                       for key, value in pkg_schema_obj.items())
+
+
+def _split_source_map(cell_src_map, items_key):
+    '''Group a cell source map by item of ``items_key``'''
+    by_item = collections.defaultdict(dict)
+    prefix = items_key + '/'
+    for path, reference in cell_src_map.items():
+        if path.startswith(prefix):
+            num = path[len(prefix):].split('/', 1)[0]
+            if num.isdigit():
+                by_item[int(num)][path] = reference
+    return by_item
+
+
+def _get_items_validator_key(pkg_schema_obj, resolver_kwargs, extra_checkers, items_key):
+    '''Return the schema registry key of the validator of the items of a package'''
+    schema_hash = hashlib.sha256(json.dumps(pkg_schema_obj, sort_keys=True).encode('utf-8')).hexdigest()
+    return ('items_validator', items_key, schema_hash, tuple(sorted(resolver_kwargs.items())),
+            tuple(sorted(extra_checkers)) if extra_checkers else ())
+
+
+def _load_schema_file(schema_file):
+    with open(schema_file, encoding='utf-8') as fp:
+        return json.load(fp, object_pairs_hook=OrderedDict)
+
+
+def _get_items_validation_errors(schema_file, resolver_kwargs, extra_checkers, validator_key, items_key, start, items,
+                                 cell_src_map, heading_src_map):
+    '''Validate a chunk of the items of a package, in a worker process.
+
+    ``validator_key`` (see _get_items_validator_key) is computed once for all
+    the chunks. The package schema is only read from ``schema_file`` when the
+    validator isn't in the schema registry of the process yet.
+    '''
+    def build():
+        pkg_schema_obj = _load_schema_file(schema_file)
+        items_schema = pkg_schema_obj['properties'][items_key]['items']
+        return _make_validator(items_schema, pkg_schema_obj, resolver_kwargs, extra_checkers)
+
+    item_validator = schema_registry.get_object(validator_key, build)
+
+    errors = []
+    for num, item in enumerate(items, start):
+        for e in item_validator.iter_errors(item):
+            e.path.appendleft(num)
+            e.path.appendleft(items_key)
+            key_value = _get_validation_error_key_value(e, cell_src_map, heading_src_map)
+            if key_value:
+                errors.append(key_value)
+    return errors
+
+
+def _get_validation_shards(json_data, schema_obj, schema_name):
+    '''Return what _iter_parallel_validation_errors needs to split the validation of the data, or None if it can't'''
+    if not isinstance(json_data, dict):
+        return None
+    items_key = next((key for key in VALIDATION_ITEMS_KEYS if isinstance(json_data.get(key), list)), None)
+    if not items_key or len(json_data[items_key]) < 2:
+        return None
+    pkg_schema_obj, resolver_kwargs = _get_validator_args(schema_obj, schema_name)
+    envelope_schema = _get_envelope_schema(pkg_schema_obj, items_key)
+    if envelope_schema is None:
+        return None
+    return items_key, pkg_schema_obj, resolver_kwargs, envelope_schema
+
+
+def _write_schema_file(pkg_schema_obj):
+    '''Write the package schema to a temporary file, return its path'''
+    fd, path = tempfile.mkstemp(prefix='cove-schema-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            json.dump(pkg_schema_obj, fp)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _submit_items_validation(executor, args):
+    try:
+        return executor.submit(_get_items_validation_errors, *args)
+    except BrokenProcessPool:
+        return None
+
+
+def _iter_parallel_validation_errors(json_data, shards, cell_src_map, heading_src_map, extra_checkers, workers):
+    '''Validate the package envelope here and its items in a pool of ``workers`` processes.
+
+    Yield the (key, value) pairs of the errors in the order of the serial
+    validation. Chunks of items the pool fails to validate are validated here.
+    The package schema is written once to a temporary file rather than sent
+    with every chunk.
+    '''
+    global _validation_executor
+    items_key, pkg_schema_obj, resolver_kwargs, envelope_schema = shards
+    validator_key = _get_items_validator_key(pkg_schema_obj, resolver_kwargs, extra_checkers, items_key)
+
+    envelope_errors = []
+    items_position = None
+    envelope_validator = _make_validator(envelope_schema, pkg_schema_obj, resolver_kwargs, extra_checkers)
+    for e in envelope_validator.iter_errors(json_data):
+        if isinstance(e, _ItemsMarker):
+            items_position = len(envelope_errors)
+            continue
+        key_value = _get_validation_error_key_value(e, cell_src_map, heading_src_map)
+        if key_value:
+            envelope_errors.append(key_value)
+    if items_position is None:
+        yield from envelope_errors
+        return
+    yield from envelope_errors[:items_position]
+
+    items = json_data[items_key]
+    chunk_size = min(VALIDATION_CHUNK_SIZE, max(1, math.ceil(len(items) / (workers * 4))))
+    # Workers look up a SourceMap themselves, only the items of their chunk of a dict are sent to them
+    split_src_map = not isinstance(cell_src_map, SourceMap) and bool(cell_src_map)
+    cell_src_maps = _split_source_map(cell_src_map, items_key) if split_src_map else {}
+    executor = get_validation_executor(workers)
+    schema_file = _write_schema_file(pkg_schema_obj)
+    try:
+        # Keep a couple of chunks per worker in flight, and collect them in order
+        pending = collections.deque()
+        start = 0
+        chunks = iter(items)
+        while True:
+            chunk = list(itertools.islice(chunks, chunk_size))
+            if chunk:
+                chunk_cell_src_map = cell_src_map
+                if split_src_map:
+                    chunk_cell_src_map = {}
+                    for num in range(start, start + len(chunk)):
+                        chunk_cell_src_map.update(cell_src_maps.get(num, {}))
+                args = (schema_file, resolver_kwargs, extra_checkers, validator_key, items_key, start, chunk,
+                        chunk_cell_src_map, heading_src_map)
+                pending.append((args, _submit_items_validation(executor, args)))
+                start += len(chunk)
+            if not pending:
+                break
+            if not chunk or len(pending) >= workers * 2:
+                args, future = pending.popleft()
+                try:
+                    errors = future.result() if future else None
+                except BrokenProcessPool:
+                    errors = None
+                if errors is None:
+                    _validation_executor = None
+                    errors = _get_items_validation_errors(*args)
+                yield from errors
+    finally:
+        os.remove(schema_file)
+    yield from envelope_errors[items_position:]
+
+
+def get_schema_validation_errors(json_data, schema_obj, schema_name, cell_src_map, heading_src_map, extra_checkers=None,
+                                 workers=None, error_store=None):
+    '''Validate the data against the package schema, return the errors grouped by message and field.
+
+    With ``workers`` (VALIDATION_WORKERS by default) the items of the package
+    are validated in that many processes, with the same results. The errors
+    are added to ``error_store``, if given, which decides which of them are
+    returned.
+    '''
+    if workers is None:
+        workers = getattr(settings, 'VALIDATION_WORKERS', 0)
+    if error_store is None:
+        error_store = ErrorStore()
+
+    shards = _get_validation_shards(json_data, schema_obj, schema_name) if workers else None
+    if shards:
+        key_values = _iter_parallel_validation_errors(
+            json_data, shards, cell_src_map, heading_src_map, extra_checkers, workers)
+    else:
+        our_validator = get_schema_validator(schema_obj, schema_name, extra_checkers)
+        key_values = filter(None, (_get_validation_error_key_value(e, cell_src_map, heading_src_map)
+                                   for e in our_validator.iter_errors(json_data)))
+
+    for key, value in key_values:
+        error_store.add(key, value)
+    return error_store.samples
+
+
+class GenericPathsVisitor(DataVisitor):
+    '''Collect the values in the data by generic path, see get_json_data_generic_paths'''
+    def __init__(self):
+        self.generic_paths = {}
+
+    def visit(self, path, value):
+        generic_paths = self.generic_paths
+        if path:
+            generic_key = tuple(i for i in path if type(i) != int)
+            if generic_paths.get(generic_key):
+                generic_paths[generic_key][path] = value
+            else:
+                generic_paths[generic_key] = {path: value}
+
+        if isinstance(value, dict):
+            if not value:
+                generic_paths[path] = {}
+            return True
+        elif isinstance(value, list):
+            if not value:
+                generic_paths[path] = []
+            return True
+        return False
+
+    def finish(self):
+        return self.generic_paths
+
+
+def get_json_data_generic_paths(json_data):
     '''Transform json data into a dictionary with keys made of json paths.
 
     Key are json paths (as tuples). Values are dictionaries with keys including specific
@@ -517,128 +934,98 @@ def get_json_data_generic_paths(json_data, path=(), generic_paths=None):
         ('c', 'cb'): {('c', 2, 'cb'): 'cb'}
     }
     '''
-    if generic_paths is None:
-        generic_paths = {}
-
-    if isinstance(json_data, dict):
-        iterable = list(json_data.items())
-        if not iterable:
-            generic_paths[path] = {}
-    else:
-        iterable = list(enumerate(json_data))
-        if not iterable:
-            generic_paths[path] = []
-
-    for key, value in iterable:
-        generic_key = tuple(i for i in path + (key,) if type(i) != int)
-
-        if generic_paths.get(generic_key):
-            generic_paths[generic_key][path + (key,)] = value
-        else:
-            generic_paths[generic_key] = {path + (key,): value}
+    visitor = GenericPathsVisitor()
+    walk_data(json_data, [visitor])
+    return visitor.result()
 
-        if isinstance(value, (dict, list)):
-            get_json_data_generic_paths(value, path + (key,), generic_paths)
 
-    return generic_paths
+class DataPathsIndex(DataVisitor):
+    '''Where the generic paths the checks look for occur in the data.
 
-
-def _get_schema_non_required_ids(schema_obj, obj=None, current_path=(), id_paths=None,
-                                array_parent=False, list_merge=False):
+    Unlike get_json_data_generic_paths no values are kept, and only the parts of
+    the data leading to these paths are traversed. For each deprecated path of
+    the schema index this records the concrete paths of the fields, and for each
+    array holding objects with a non-required 'id' the concrete paths of the
+    objects with, in a parallel array, whether they have an 'id'.
+    '''
+    def __init__(self, schema_index):
+        self.field_generic_paths = set(path for path, _ in schema_index.deprecated_paths)
+        self.item_generic_paths = set(path[:-1] for path in schema_index.non_required_ids)
+        self.prefixes = set()
+        for generic_path in self.field_generic_paths | self.item_generic_paths:
+            self.prefixes.update(generic_path[:i] for i in range(len(generic_path) + 1))
+        self.fields = {}
+        self.items = {}
+        self.items_have_id = {}
+
+    def visit(self, path, value):
+        generic_path = tuple(key for key in path if not isinstance(key, int))
+        if path and isinstance(path[-1], int):
+            if generic_path in self.item_generic_paths:
+                self.items.setdefault(generic_path, []).append(path)
+                self.items_have_id.setdefault(generic_path, array('b')).append('id' in value)
+        elif generic_path in self.field_generic_paths:
+            paths = self.fields.setdefault(generic_path, [])
+            # An empty object outside of arrays is found with no paths, as
+            # get_json_data_generic_paths does.
+            if value != {} or len(path) != len(generic_path):
+                paths.append(path)
+        return generic_path in self.prefixes and isinstance(value, (dict, list))
+
+    def finish(self):
+        return self
+
+    def __contains__(self, generic_path):
+        return generic_path in self.fields or generic_path in self.items
+
+    def field_paths(self, generic_path):
+        return self.fields.get(generic_path, [])
+
+    def items_without_id(self, generic_path):
+        return [path for path, has_id in zip(self.items.get(generic_path, []),
+                                             self.items_have_id.get(generic_path, []))
+                if not has_id]
+
+
+def get_json_data_paths_index(json_data, schema_obj):
+    index = DataPathsIndex(schema_obj.get_release_pkg_schema_index())
+    walk_data(json_data, [index])
+    return index.result()
+
+
+def _get_schema_non_required_ids(schema_obj):
     '''Get a list of paths for schema non-required object['id'] in arrays of objects.
 
     Return a list of tuples with generic paths (i.e. no indexes for array paths).
     Types "array" in json schema objects with property `"wholeListMerge": true` will
     be skipped.
     '''
-    if id_paths is None:
-        id_paths = []
-    if schema_obj:
-        obj = schema_obj.get_release_pkg_schema_obj(deref=True)
-
-    properties = obj.get('properties', {})
-    no_required_id = 'id' not in obj.get('required', [])
-
-    if not isinstance(properties, dict):
-        return id_paths
-    for prop, value in properties.items():
-        if current_path:
-            path = current_path + (prop,)
-        else:
-            path = (prop,)
-
-        if prop == 'id' and no_required_id and array_parent and not list_merge:
-            id_paths.append(path)
-
-        if value.get('type') == 'object':
-            _get_schema_non_required_ids(None, value, path, id_paths)
-        elif value.get('type') == 'array' and value.get('items', {}).get('properties'):
-            has_list_merge = 'wholeListMerge' in value and value.get('wholeListMerge')
-            _get_schema_non_required_ids(None, value['items'], path, id_paths,
-                                        array_parent=True, list_merge=has_list_merge)
-
-    return id_paths
+    return list(schema_obj.get_release_pkg_schema_index().non_required_ids)
 
 
 def get_json_data_missing_ids(json_data_paths, schema_obj):
+    '''Return the paths of objects in arrays missing a non-required id, json_data_paths is a DataPathsIndex'''
     non_required_schema_ids = _get_schema_non_required_ids(schema_obj)
     missing_ids_paths = []
 
     for generic_path in non_required_schema_ids:
-        generic_no_id = generic_path[:-1]
-        if generic_no_id in json_data_paths:
-            for specific_path in json_data_paths[generic_no_id]:
-                if type(specific_path[-1]) != int:
-                    continue
-                if 'id' not in json_data_paths[generic_no_id][specific_path]:
-                    missing_ids_paths.append('/'.join(list(map(lambda i: str(i), specific_path)) + ['id']))
+        for specific_path in json_data_paths.items_without_id(generic_path[:-1]):
+            missing_ids_paths.append('/'.join(list(map(lambda i: str(i), specific_path)) + ['id']))
 
     return sorted(missing_ids_paths)
 
 
-def _get_schema_deprecated_paths(schema_obj, obj=None, current_path=(), deprecated_paths=None):
+def _get_schema_deprecated_paths(schema_obj):
     '''Get a list of deprecated paths and explanations for deprecation in a schema.
 
     Deprecated paths are given as tuples of tuples:
     ((path, to, field), (deprecation_version, description))
     '''
-    if deprecated_paths is None:
-        deprecated_paths = []
-
-    if schema_obj:
-        obj = schema_obj.get_release_pkg_schema_obj(deref=True)
-
-    properties = obj.get('properties', {})
-    if not isinstance(properties, dict):
-        return deprecated_paths
-    for prop, value in properties.items():
-        if current_path:
-            path = current_path + (prop,)
-        else:
-            path = (prop,)
-
-        if path not in deprecated_paths:
-            if "deprecated" in value:
-                deprecated_paths.append((
-                    path,
-                    (value['deprecated']['deprecatedVersion'], value['deprecated']['description'])
-                ))
-            elif getattr(value, '__reference__', None) and "deprecated" in value.__reference__:
-                deprecated_paths.append((
-                    path,
-                    (value.__reference__['deprecated']['deprecatedVersion'],
-                     value.__reference__['deprecated']['description'])
-                ))
-
-        if value.get('type') == 'object':
-            _get_schema_deprecated_paths(None, value, path, deprecated_paths)
-        elif value.get('type') == 'array' and value.get('items', {}).get('properties'):
-            _get_schema_deprecated_paths(None, value['items'], path, deprecated_paths)
-
-    return deprecated_paths
+    return list(schema_obj.get_release_pkg_schema_index().deprecated_paths)
 
 
 def get_json_data_deprecated_fields(json_data_paths, schema_obj):
+    '''Return the deprecated fields found in the data, json_data_paths is a DataPathsIndex'''
     deprecated_schema_paths = _get_schema_deprecated_paths(schema_obj)
     deprecated_json_data_paths = [path for path in deprecated_schema_paths if path[0] in json_data_paths]
     # Generate an OrderedDict sorted by deprecated field names (keys) mapping
@@ -646,16 +1033,8 @@ def get_json_data_deprecated_fields(json_data_paths, schema_obj):
     # {deprecated_field: ((path, path... ), (version, description))}
     deprecated_fields = OrderedDict()
     for generic_path in sorted(deprecated_json_data_paths, key=lambda tup: tup[0][-1]):
-        deprecated_fields[generic_path[0][-1]] = tuple()
-
-        # Be defensive against invalid schema data and corner cases.
-        # e.g. (invalid OCDS data):
-        # {"version":"1.1", "releases":{"buyer":{"additionalIdentifiers":[]}}}
-        if hasattr(json_data_paths[generic_path[0]], "keys"):
-            deprecated_fields[generic_path[0][-1]] += (tuple(key for key in json_data_paths[generic_path[0]].keys()),
-                                                       generic_path[1])
-        else:
-            deprecated_fields[generic_path[0][-1]] += ((generic_path[0],), generic_path[1])
+        deprecated_fields[generic_path[0][-1]] = (tuple(json_data_paths.field_paths(generic_path[0])),
+                                                  generic_path[1])
 
     # Order the path tuples in values for deprecated_fields.
     deprecated_fields_output = OrderedDict()
@@ -695,42 +1074,21 @@ def add_is_codelist(obj):
             add_is_codelist(value)
 
 
-def get_schema_codelist_paths(schema_obj, obj=None, current_path=(), codelist_paths=None, use_extensions=False):
+def get_schema_codelist_paths(schema_obj, use_extensions=False):
     '''Get a dict of codelist paths including the filename and if they are open.
 
     codelist paths are given as tuples of tuples:
         {("path", "to", "codelist"): (filename, open?), ..}
     '''
-    if codelist_paths is None:
-        codelist_paths = {}
-
-    if schema_obj:
-        obj = schema_obj.get_release_pkg_schema_obj(deref=True, use_extensions=use_extensions)
-
-    properties = obj.get('properties', {})
-    if not isinstance(properties, dict):
-        return codelist_paths
-    for prop, value in properties.items():
-        if current_path:
-            path = current_path + (prop,)
-        else:
-            path = (prop,)
-
-        if "codelist" in value and path not in codelist_paths:
-            codelist_paths[path] = (value['codelist'], value.get('openCodelist', False))
-
-        if value.get('type') == 'object':
-            get_schema_codelist_paths(None, value, path, codelist_paths)
-        elif value.get('type') == 'array' and value.get('items', {}).get('properties'):
-            get_schema_codelist_paths(None, value['items'], path, codelist_paths)
-
-    return codelist_paths
+    if use_extensions:
+        return dict(schema_obj.get_release_pkg_schema_index().codelist_paths)
+    return dict(schema_obj.get_release_pkg_schema_index(use_extensions=False).codelist_paths)
 
 
 def load_codelist(url):
     codelist_map = {}
 
-    response = requests.get(url)
+    response = schema_registry.get(url)
     response.raise_for_status()
     reader = csv.DictReader(line.decode("utf8") for line in response.iter_lines())
     for record in reader:
@@ -743,54 +1101,52 @@ def load_codelist(url):
     return codelist_map
 
 
-@functools.lru_cache()
 def load_core_codelists(codelist_url, unique_files):
-    codelists = {}
-    for codelist_file in unique_files:
-        try:
-            codelist_map = load_codelist(codelist_url + codelist_file)
-        except requests.exceptions.RequestException:
-            return {}
-        codelists[codelist_file] = codelist_map
-    return codelists
-
-
-def _generate_data_path(json_data, path=()):
-    if not json_data or not isinstance(json_data, dict):
-        return path
-    for key, value in json_data.items():
+    def build():
+        return {codelist_file: load_codelist(codelist_url + codelist_file) for codelist_file in unique_files}
+
+    try:
+        return schema_registry.get_object(('core_codelists', codelist_url, unique_files), build)
+    except requests.exceptions.RequestException:
+        # Not cached, so the next call tries again
+        return {}
+
+
+class CodelistValuesVisitor(DataVisitor):
+    '''Collect the values of codelist fields that are not in their codelist'''
+    def __init__(self, schema_obj):
+        schema_obj.process_codelists()
+        self.schema_obj = schema_obj
+        self.additional_codelist_values = {}
+
+    def visit(self, path, value):
+        if not path:
+            return bool(value) and isinstance(value, dict)
+        if isinstance(path[-1], int):
+            return isinstance(value, dict)
         if not value:
-            continue
-        if isinstance(value, list):
-            if isinstance(value[0], dict):
-                for num, item in enumerate(value):
-                    yield from _generate_data_path(item, path + (key, num))
-            else:
-                yield path + (key,), value
-        elif isinstance(value, dict):
-            yield from _generate_data_path(value, path + (key,))
-        else:
-            yield path + (key,), value
-
-
-def get_additional_codelist_values(schema_obj, json_data):
-    schema_obj.process_codelists()
-
-    additional_codelist_values = {}
-    for path, values in _generate_data_path(json_data):
+            return False
+        if isinstance(value, dict) or (isinstance(value, list) and isinstance(value[0], dict)):
+            return True
+        self.add_values(path, value)
+        return False
+
+    def add_values(self, path, values):
+        schema_obj = self.schema_obj
+        additional_codelist_values = self.additional_codelist_values
         if not isinstance(values, list):
             values = [values]
 
         path_no_num = tuple(key for key in path if isinstance(key, str))
 
         if path_no_num not in schema_obj.extended_codelist_schema_paths:
-            continue
+            return
 
         codelist, isopen = schema_obj.extended_codelist_schema_paths[path_no_num]
 
         codelist_values = schema_obj.extended_codelists.get(codelist)
         if not codelist_values:
-            continue
+            return
 
         for value in values:
             if str(value) in codelist_values:
@@ -834,13 +1190,22 @@ def get_additional_codelist_values(schema_obj, json_data):
             additional_codelist_values['/'.join(path_no_num)]['values'].add(str(value))
             #additional_codelist_values['/'.join(path_no_num)]['location_values'].append((path, value))
 
-    for codelist_value in additional_codelist_values.values():
-        codelist_value['values'] = sorted(list(codelist_value['values']))
-    return additional_codelist_values
+    def finish(self):
+        for codelist_value in self.additional_codelist_values.values():
+            codelist_value['values'] = sorted(list(codelist_value['values']))
+        return self.additional_codelist_values
+
+
+def get_additional_codelist_values(schema_obj, json_data):
+    visitor = CodelistValuesVisitor(schema_obj)
+    walk_data(json_data, [visitor])
+    return visitor.result()
 
 
 @cove_spreadsheet_conversion_error
 def get_spreadsheet_meta_data(upload_dir, file_name, schema, file_type='xlsx', name='Meta'):
+    from flattentool import unflatten
+
     if file_type == 'csv':
         input_name = upload_dir
     else:
@@ -862,51 +1227,23 @@ def get_spreadsheet_meta_data(upload_dir, file_name, schema, file_type='xlsx', n
     return metatab_json
 
 
+ORGIDS_URL = 'http://org-id.guide/download.json'
+# The org-ids lists are downloaded at most once a day
+ORGIDS_MAX_AGE = 24 * 60 * 60
+
+
 def get_orgids_prefixes(orgids_url=None):
-    '''Get org-ids.json file from file system (or fetch upstream if it doesn't exist)
+    '''Return the prefixes of the org-ids lists.
 
-    A lock file is needed to avoid different processes trying to access the file
-    trampling each other. If a process has the exclusive lock, a different process
-    will wait until it is released.
+    The download is cached (see cove.lib.registry) and shared by all the
+    processes. It is only an error if it fails the first time ever. The list
+    is shared too, and must not be modified.
     '''
-    local_org_ids_dir = os.path.dirname(os.path.realpath(__file__))
-    local_org_ids_file = os.path.join(local_org_ids_dir, 'org-ids.json')
-    lock_file = os.path.join(local_org_ids_dir, 'org-ids.json.lock')
-    today = datetime.date.today()
-    get_remote_file = False
-    first_request = False
-
     if not orgids_url:
-        orgids_url = 'http://org-id.guide/download.json'
-
-    if os.path.exists(local_org_ids_file):
-        with open(lock_file, 'w') as lock:
-            fcntl.flock(lock, fcntl.LOCK_EX)
-            fp = open(local_org_ids_file)
-            org_ids = json.load(fp)
-            fp.close()
-            fcntl.flock(lock, fcntl.LOCK_UN)
-        date_str = org_ids.get('downloaded', '2000-1-1')
-        date_downloaded = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-        if date_downloaded != today:
-            get_remote_file = True
-    else:
-        get_remote_file = True
-        first_request = True
+        orgids_url = ORGIDS_URL
+    return schema_registry.get_object(('orgids_prefixes', orgids_url), lambda: _load_orgids_prefixes(orgids_url))
 
-    if get_remote_file:
-        try:
-            org_ids = requests.get(orgids_url).json()
-            org_ids['downloaded'] = "%s" % today
-            with open(lock_file, 'w') as lock:
-                fcntl.flock(lock, fcntl.LOCK_EX)
-                fp = open(local_org_ids_file, 'w')
-                json.dump(org_ids, fp, indent=2)
-                fp.close()
-                fcntl.flock(lock, fcntl.LOCK_UN)
-        except requests.exceptions.RequestException:
-            if first_request:
-                raise  # First time ever request fails
-            pass  # Update fails
 
+def _load_orgids_prefixes(orgids_url):
+    org_ids = schema_registry.get(orgids_url, max_age=ORGIDS_MAX_AGE).json()
     return [org_list['code'] for org_list in org_ids['lists']]
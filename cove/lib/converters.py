@@ -3,14 +3,23 @@ import logging
 import os
 import shutil
 import warnings
+from collections import OrderedDict
 
 import flattentool
 import flattentool.exceptions
+import jsonref
 from django.conf import settings
+from flattentool.input import path_search
+from flattentool.json_input import JSONParser
+from flattentool.output import FORMATS as OUTPUT_FORMATS
+from flattentool.output import FORMATS_SUFFIX
+from flattentool.schema import SchemaParser
 from django.utils.translation import ugettext_lazy as _
 from flattentool.json_input import BadlyFormedJSONError
 
 from cove.lib.exceptions import CoveInputDataError, cove_spreadsheet_conversion_error
+from cove.lib.registry import schema_registry
+from cove.lib.source_map import store_source_maps
 
 logger = logging.getLogger(__name__)
 config = settings.COVE_CONFIG
@@ -26,6 +35,65 @@ def filter_conversion_warnings(conversion_warnings):
     return out
 
 
+def flatten_outputs(input_name, outputs, schema=None, main_sheet_name='main', root_list_path='main', root_id=None,
+                    xml=False, id_name='id'):
+    '''Flatten ``input_name`` to each of ``outputs``, a list of (output_name, use_titles), in a single pass
+
+    Each output is what flattentool.flatten would write (a spreadsheet and a
+    directory of CSV files) with field names or titles for headers, but the
+    input and the schema are read once, and the items are walked once,
+    flattening each of them for every output. Return the warnings of each
+    output, in the same order.
+    '''
+    conversion_warnings = []
+    root_schema_dict = None
+    if schema and schema.startswith('http'):
+        root_schema_dict = jsonref.loads(schema_registry.get_text(schema), object_pairs_hook=OrderedDict)
+
+    parsers = []
+    for output_name, use_titles in outputs:
+        with warnings.catch_warnings(record=True) as output_warnings:
+            schema_parser = None
+            if schema:
+                schema_parser = SchemaParser(schema_filename=None if root_schema_dict else schema,
+                                             root_schema_dict=root_schema_dict, root_id=root_id, use_titles=use_titles)
+                schema_parser.parse()
+            if parsers:
+                # The data of the first parser is shared, XML is only read by JSONParser from a file
+                parser = JSONParser(root_json_dict=parsers[0].root_json_dict, root_list_path=root_list_path,
+                                    schema_parser=schema_parser, root_id=root_id, use_titles=use_titles,
+                                    id_name=id_name)
+                parser.xml = xml
+            else:
+                parser = JSONParser(json_filename=input_name, root_list_path=root_list_path,
+                                    schema_parser=schema_parser, root_id=root_id, use_titles=use_titles, xml=xml,
+                                    id_name=id_name)
+        parsers.append(parser)
+        conversion_warnings.append(output_warnings)
+
+    # As in JSONParser.parse, for all the parsers at once
+    with warnings.catch_warnings(record=True) as parse_warnings:
+        for json_dict in path_search(parsers[0].root_json_dict, root_list_path.split('/')):
+            if json_dict is None:
+                continue
+            for parser, output_warnings in zip(parsers, conversion_warnings):
+                parser.parse_json_dict(json_dict, sheet=parser.main_sheet)
+                if parse_warnings:
+                    output_warnings.extend(parse_warnings)
+                    del parse_warnings[:]
+
+    for (output_name, use_titles), parser, output_warnings in zip(outputs, parsers, conversion_warnings):
+        with warnings.catch_warnings(record=True) as write_warnings:
+            for format_name, spreadsheet_output_class in OUTPUT_FORMATS.items():
+                spreadsheet_output_class(
+                    parser=parser,
+                    main_sheet_name=main_sheet_name,
+                    output_name=output_name + FORMATS_SUFFIX[format_name]
+                ).write_sheets()
+        output_warnings.extend(write_warnings)
+    return conversion_warnings
+
+
 @cove_spreadsheet_conversion_error
 def convert_spreadsheet(upload_dir, upload_url, file_name, file_type, schema_url=None, pkg_schema_url=None,
                         metatab_name='Meta', replace=False, xml=False, xml_schemas=None, cache=True):
@@ -93,6 +161,7 @@ def convert_spreadsheet(upload_dir, upload_url, file_name, file_type, schema_url
                 **flattentool_options
             )
             context['conversion_warning_messages'] = filter_conversion_warnings(conversion_warnings)
+        store_source_maps(upload_dir)
 
         if cache:
             with open(conversion_warning_cache_path, 'w+') as fp:
@@ -118,7 +187,6 @@ def convert_json(upload_dir, upload_url, file_name, schema_url=None, replace=Fal
     converted_path = os.path.join(upload_dir, 'flattened')
 
     flatten_kwargs = dict(
-        output_name=converted_path,
         main_sheet_name=config['root_list_path'],
         root_list_path=config['root_list_path'],
         root_id=config['root_id'],
@@ -131,40 +199,42 @@ def convert_json(upload_dir, upload_url, file_name, schema_url=None, replace=Fal
 
     try:
         conversion_warning_cache_path = os.path.join(upload_dir, 'conversion_warning_messages.json')
+        conversion_warning_cache_path_titles = os.path.join(upload_dir, 'conversion_warning_messages_titles.json')
         conversion_exists = os.path.exists(converted_path + '.xlsx')
+        outputs = []
         if not conversion_exists or replace:
-            with warnings.catch_warnings(record=True) as conversion_warnings:
-                if flatten or (replace and conversion_exists):
-                    flattentool.flatten(file_name, **flatten_kwargs)
-                else:
-                    return {'conversion': 'flattenable'}
-                context['conversion_warning_messages'] = filter_conversion_warnings(conversion_warnings)
+            if not flatten and not (replace and conversion_exists):
+                return {'conversion': 'flattenable'}
+            outputs.append((converted_path, False))
+        if config['convert_titles'] and (not os.path.exists(converted_path + '-titles.xlsx') or replace):
+            outputs.append((converted_path + '-titles', True))
+
+        # Both the field names and the titles spreadsheets are made in a single pass over the data
+        conversion_warnings = {}
+        if outputs:
+            conversion_warnings = dict(zip(outputs, flatten_outputs(file_name, outputs, **flatten_kwargs)))
 
+        if (converted_path, False) in conversion_warnings:
+            context['conversion_warning_messages'] = filter_conversion_warnings(
+                conversion_warnings[(converted_path, False)])
             if cache:
                 with open(conversion_warning_cache_path, 'w+') as fp:
                     json.dump(context['conversion_warning_messages'], fp)
-
         elif os.path.exists(conversion_warning_cache_path):
             with open(conversion_warning_cache_path) as fp:
                 context['conversion_warning_messages'] = json.load(fp)
 
         context['converted_file_size'] = os.path.getsize(converted_path + '.xlsx')
-        conversion_warning_cache_path_titles = os.path.join(upload_dir, 'conversion_warning_messages_titles.json')
 
         if config['convert_titles']:
-            with warnings.catch_warnings(record=True) as conversion_warnings_titles:
-                flatten_kwargs.update(dict(
-                    output_name=converted_path + '-titles',
-                    use_titles=True
-                ))
-                if not os.path.exists(converted_path + '-titles.xlsx') or replace:
-                    flattentool.flatten(file_name, **flatten_kwargs)
-                    context['conversion_warning_messages_titles'] = filter_conversion_warnings(conversion_warnings_titles)
-                    with open(conversion_warning_cache_path_titles, 'w+') as fp:
-                        json.dump(context['conversion_warning_messages_titles'], fp)
-                elif os.path.exists(conversion_warning_cache_path_titles):
-                    with open(conversion_warning_cache_path_titles) as fp:
-                        context['conversion_warning_messages_titles'] = json.load(fp)
+            if (converted_path + '-titles', True) in conversion_warnings:
+                context['conversion_warning_messages_titles'] = filter_conversion_warnings(
+                    conversion_warnings[(converted_path + '-titles', True)])
+                with open(conversion_warning_cache_path_titles, 'w+') as fp:
+                    json.dump(context['conversion_warning_messages_titles'], fp)
+            elif os.path.exists(conversion_warning_cache_path_titles):
+                with open(conversion_warning_cache_path_titles) as fp:
+                    context['conversion_warning_messages_titles'] = json.load(fp)
 
             context['converted_file_size_titles'] = os.path.getsize(converted_path + '-titles.xlsx')
 
@@ -0,0 +1,116 @@
+'''Validation errors grouped by message, with bounded memory.
+
+Each group keeps the exact number of errors found but only ``max_samples``
+example values: the first ones, or with ``reservoir`` a uniform random sample
+of the whole group (drawn with a fixed seed, so the same data gives the same
+samples). Every error can also be written to a JSON lines file as it is found,
+for the "all errors" download, without keeping them in memory.
+'''
+import json
+import os
+import random
+
+from django.conf import settings
+
+from cove.lib.tools import decimal_default
+
+
+# IMPORTANT: uploaded files can't have these names, see cove/views.py
+VALIDATION_ERRORS_FILE_NAME = 'validation_errors-4.json'
+FULL_ERRORS_FILE_NAME = 'validation_errors_full.jsonl'
+
+
+class ErrorStore():
+    def __init__(self, max_samples=None, reservoir=False, full_errors_path=None, seed=0):
+        self.max_samples = max_samples
+        self.reservoir = reservoir
+        self.full_errors_path = full_errors_path
+        self.random = random.Random(seed)
+        self.counts = {}
+        self._samples = {}
+        self._full_errors_fp = None
+
+    def add(self, key, value):
+        '''Add an error ``value`` (a dict) to the group ``key`` (a JSON string)'''
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        samples = self._samples.setdefault(key, [])
+        if self.max_samples is None or count <= self.max_samples:
+            samples.append((count, value))
+        elif self.reservoir:
+            num = self.random.randrange(count)
+            if num < self.max_samples:
+                samples[num] = (count, value)
+
+        if self.full_errors_path:
+            if self._full_errors_fp is None:
+                self._full_errors_fp = open(self.full_errors_path, 'w')
+            self._full_errors_fp.write('{{"error": {}, "value": {}}}\n'.format(
+                key, json.dumps(value, sort_keys=True, default=decimal_default)))
+
+    @property
+    def samples(self):
+        '''The sample values of each group, in the order they were found'''
+        if self.reservoir:
+            return {key: [value for count, value in sorted(samples, key=lambda sample: sample[0])]
+                    for key, samples in self._samples.items()}
+        return {key: [value for count, value in samples] for key, samples in self._samples.items()}
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def close(self):
+        if self._full_errors_fp is not None:
+            self._full_errors_fp.close()
+            self._full_errors_fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def context_errors(self):
+        '''Return the groups as sorted [key, samples] pairs, with the number of errors in the key'''
+        samples = self.samples
+        context_errors = []
+        for key in sorted(self.counts):
+            error = json.loads(key)
+            error['count'] = self.counts[key]
+            context_errors.append([json.dumps(error, sort_keys=True), samples[key]])
+        return context_errors
+
+    def to_json(self):
+        samples = self.samples
+        return {key: {'count': count, 'samples': samples[key]} for key, count in self.counts.items()}
+
+    @classmethod
+    def from_json(cls, obj):
+        store = cls()
+        for key, group in obj.items():
+            store.counts[key] = group['count']
+            store._samples[key] = list(enumerate(group['samples'], 1))
+        return store
+
+    def dump(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.to_json(), fp, sort_keys=True, default=decimal_default)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            return cls.from_json(json.load(fp))
+
+
+def get_error_store(upload_dir=None, full_errors=True):
+    '''Return an ErrorStore set up from the settings, writing all the errors to ``upload_dir``'''
+    full_errors_path = None
+    if upload_dir and full_errors and os.path.isdir(upload_dir):
+        full_errors_path = os.path.join(upload_dir, FULL_ERRORS_FILE_NAME)
+        # The file is only created if there are errors, don't leave one from a previous run
+        if os.path.exists(full_errors_path):
+            os.remove(full_errors_path)
+    return ErrorStore(max_samples=settings.VALIDATION_ERROR_SAMPLES or None,
+                      reservoir=settings.VALIDATION_ERROR_RESERVOIR,
+                      full_errors_path=full_errors_path)
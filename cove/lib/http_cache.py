@@ -0,0 +1,93 @@
+'''Responses to GET requests kept on disk, shared by all the processes of a deploy.
+
+Each response is a single file named after the hash of its URL: a first line of
+JSON metadata (status, headers, time it was last fetched or revalidated) then
+the body. Files are written to a temporary name and renamed, so readers in other
+processes never see a partial file and no lock is needed.
+
+This is the persistent layer of the schema registry (cove.lib.registry), which
+decides when cached responses must be revalidated.
+'''
+import hashlib
+import json
+import os
+import tempfile
+
+import requests
+from django.conf import settings
+from requests.structures import CaseInsensitiveDict
+
+
+# Headers needed to revalidate and decode a response
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+class DiskCache():
+    def __init__(self, directory=None):
+        self._directory = directory
+
+    @property
+    def directory(self):
+        '''Directory of the cache files, HTTP_CACHE_DIR by default. Empty disables the cache.'''
+        if self._directory is not None:
+            return self._directory
+        return getattr(settings, 'HTTP_CACHE_DIR', '')
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def load(self, url):
+        '''Return the cached (response, fetched) for ``url``, None if there isn't one'''
+        if not self.directory:
+            return None
+        try:
+            with open(self.path(url), 'rb') as fp:
+                metadata = json.loads(fp.readline().decode('utf-8'))
+                content = fp.read()
+        except (OSError, ValueError):
+            return None
+        if metadata.get('url') != url:
+            return None
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = metadata['status_code']
+        response.reason = metadata['reason']
+        response.headers = CaseInsensitiveDict(metadata['headers'])
+        response.encoding = metadata['encoding']
+        response._content = content
+        response._content_consumed = True
+        return response, metadata['fetched']
+
+    def save(self, url, response, fetched):
+        if not self.directory:
+            return
+        metadata = {
+            'url': url,
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            'encoding': response.encoding,
+            'fetched': fetched,
+        }
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(json.dumps(metadata).encode('utf-8') + b'\n')
+                fp.write(response.content)
+            os.replace(tmp_path, self.path(url))
+        except OSError:
+            # The cache is only an optimisation, carry on without it
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
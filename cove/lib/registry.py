@@ -0,0 +1,165 @@
+'''Process-wide cache of remote documents and of the objects built from them.
+
+Downloaded documents (schemas, extensions, codelists, org-ids, IATI XSDs) are
+kept with their ETag and Last-Modified headers, and revalidated with a
+conditional request once they are older than the TTL (``SCHEMA_CACHE_TTL``
+seconds). When the server can't be reached the cached copy is used, however old.
+Objects built from them (parsed and extended schemas, validators) are kept under
+a key chosen by the caller and rebuilt once older than the TTL, which in turn
+revalidates the documents they use.
+
+Documents are also kept on disk (see cove.lib.http_cache), so they survive
+restarts and deploys and are shared with the other processes.
+
+Objects are shared by all the requests served by the process: callers must not
+modify them. Each process (including the workers forked from it) makes its
+requests with a connection pool of its own.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+
+from cove.lib.http_cache import DiskCache
+
+
+DEFAULT_TTL = 60 * 60
+# Seconds to wait for the server to respond to a request for a document
+REQUEST_TIMEOUT = 30
+
+
+class _Document():
+    def __init__(self, response, fetched=None):
+        self.response = response
+        self.fetched = time.time() if fetched is None else fetched
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self.response.text
+        return self._text
+
+
+class SchemaRegistry():
+    def __init__(self, ttl=None, maxsize=256, disk_cache=None, timeout=REQUEST_TIMEOUT):
+        self._ttl = ttl
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.disk_cache = disk_cache
+        self.documents = {}
+        self.objects = OrderedDict()
+        self.lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        # A forked process would otherwise share the connections of its parent
+        if self._session is None or self._session_pid != os.getpid():
+            self.session = requests.Session()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+        self._session_pid = os.getpid()
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'SCHEMA_CACHE_TTL', DEFAULT_TTL)
+
+    def _get_document(self, url, max_age=None):
+        if max_age is None:
+            max_age = self.ttl
+        with self.lock:
+            document = self.documents.get(url)
+        if document and time.time() - document.fetched < max_age:
+            return document
+        if self.disk_cache:
+            # Another process may have fetched it more recently
+            cached = self.disk_cache.load(url)
+            if cached and (not document or cached[1] > document.fetched):
+                document = _Document(*cached)
+                with self.lock:
+                    self.documents[url] = document
+                if time.time() - document.fetched < max_age:
+                    return document
+
+        headers = {}
+        if document:
+            if document.response.headers.get('ETag'):
+                headers['If-None-Match'] = document.response.headers['ETag']
+            if document.response.headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = document.response.headers['Last-Modified']
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            # Keep using the copy we have if the server can't be reached
+            if document:
+                return document
+            raise
+
+        if document and response.status_code >= 500:
+            return document
+        if document and response.status_code == 304:
+            document.fetched = time.time()
+            if self.disk_cache:
+                self.disk_cache.save(url, document.response, document.fetched)
+            return document
+
+        new_document = _Document(response)
+        # Server errors are likely to be temporary, don't keep them
+        if response.status_code < 500:
+            with self.lock:
+                self.documents[url] = new_document
+            if self.disk_cache:
+                self.disk_cache.save(url, response, new_document.fetched)
+        return new_document
+
+    def get(self, url, max_age=None):
+        '''Return the response for a GET request of ``url``.
+
+        Responses younger than ``max_age`` seconds (the TTL by default) are
+        returned from the cache without checking with the server.
+        '''
+        return self._get_document(url, max_age).response
+
+    def get_text(self, url, max_age=None):
+        '''Like get(), but return the decoded text of the response'''
+        return self._get_document(url, max_age).text
+
+    def get_object(self, key, build):
+        '''Return the object stored under ``key``, calling ``build()`` to make it when missing or expired.
+
+        Exceptions raised by ``build`` are not cached.
+        '''
+        now = time.time()
+        with self.lock:
+            entry = self.objects.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self.objects.move_to_end(key)
+                return entry[0]
+
+        value = build()
+        with self.lock:
+            self.objects[key] = (value, now)
+            self.objects.move_to_end(key)
+            while len(self.objects) > self.maxsize:
+                self.objects.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.objects.clear()
+        if self.disk_cache:
+            self.disk_cache.clear()
+
+
+schema_registry = SchemaRegistry(disk_cache=DiskCache())
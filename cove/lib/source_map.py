@@ -0,0 +1,114 @@
+'''Source maps of converted spreadsheets, stored in SQLite.
+
+flattentool writes where each value of the converted data comes from as two
+JSON objects: cell_source_map.json, with an entry for every cell, and
+heading_source_map.json. The cell source map is often bigger than the data,
+while only the paths of errors are ever looked up. So both are copied once to
+an indexed SQLite file of the upload directory, and read with SourceMap: a
+read-only mapping doing a query for each lookup, which processes and threads
+can share by file name.
+'''
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+from urllib.request import pathname2url
+
+from cove.lib.stream import iter_json_object
+
+
+SOURCE_MAPS_FILE_NAME = 'source_maps.sqlite3'
+CELL_SOURCE_MAP = 'cell_source_map'
+HEADING_SOURCE_MAP = 'heading_source_map'
+
+
+def zero_index_key(path):
+    '''Return ``path`` without its 0 indexes
+
+    XML paths leave out the index of sequences with a single item (see
+    cove_iati.lib.iati.lxml_errors_generator), so they can be a source map
+    path with some of its 0 indexes missing, e.g. 'iati-activity/sector/@code'
+    for 'iati-activity/0/sector/0/@code'. Both have the same key.
+    '''
+    return '/'.join(part for part in path.split('/') if part != '0')
+
+
+def store_source_maps(upload_dir):
+    '''Copy the JSON source maps of ``upload_dir`` to its SQLite file, replacing any previous copy'''
+    path = os.path.join(upload_dir, SOURCE_MAPS_FILE_NAME)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        with connection:
+            for name in (CELL_SOURCE_MAP, HEADING_SOURCE_MAP):
+                connection.execute('CREATE TABLE {} (path TEXT PRIMARY KEY, zero_index_key TEXT, value TEXT)'
+                                   .format(name))
+                json_path = os.path.join(upload_dir, name + '.json')
+                if os.path.exists(json_path):
+                    rows = ((key, zero_index_key(key), json.dumps(value))
+                            for key, value in iter_json_object(json_path, parse_float=float))
+                    connection.executemany('INSERT OR REPLACE INTO {} VALUES (?, ?, ?)'.format(name), rows)
+                connection.execute('CREATE INDEX {0}_zero_index_key ON {0} (zero_index_key)'.format(name))
+    finally:
+        connection.close()
+    # Readers in other processes never see a partial file
+    os.replace(tmp_path, path)
+
+
+def get_source_maps(upload_dir):
+    '''Return the cell and heading SourceMap of ``upload_dir``, storing them first if needed'''
+    path = os.path.join(upload_dir, SOURCE_MAPS_FILE_NAME)
+    json_path = os.path.join(upload_dir, CELL_SOURCE_MAP + '.json')
+    if not os.path.exists(path) or (os.path.exists(json_path) and
+                                    os.path.getmtime(json_path) > os.path.getmtime(path)):
+        store_source_maps(upload_dir)
+    return SourceMap(path, CELL_SOURCE_MAP), SourceMap(path, HEADING_SOURCE_MAP)
+
+
+class SourceMap(Mapping):
+    '''Read-only mapping of a source map stored by store_source_maps, looked up one path at a time'''
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _query(self, sql, *args):
+        with self._lock:
+            if self._connection is None:
+                self._connection = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(self.path)), uri=True,
+                                                   check_same_thread=False)
+            return self._connection.execute(sql.format(self.name), args).fetchall()
+
+    def __getitem__(self, path):
+        rows = self._query('SELECT value FROM {} WHERE path = ?', path)
+        if not rows:
+            raise KeyError(path)
+        return json.loads(rows[0][0])
+
+    def __contains__(self, path):
+        return bool(self._query('SELECT 1 FROM {} WHERE path = ?', path))
+
+    def __iter__(self):
+        '''Iterate over all the paths, which are all read at once'''
+        return (path for path, in self._query('SELECT path FROM {} ORDER BY rowid'))
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM {}')[0][0]
+
+    def __bool__(self):
+        return bool(self._query('SELECT 1 FROM {} LIMIT 1'))
+
+    def get_zero_index_paths(self, key):
+        '''Return the paths whose zero_index_key is ``key``, in the order of the source map'''
+        return [path for path, in self._query('SELECT path FROM {} WHERE zero_index_key = ? ORDER BY rowid', key)]
+
+    def __reduce__(self):
+        return (self.__class__, (self.path, self.name))
+
+    def __repr__(self):
+        return '<SourceMap {!r} from {}>'.format(self.name, self.path)
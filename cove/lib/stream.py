@@ -0,0 +1,293 @@
+'''Incremental reading of large JSON data packages.
+
+A data package is a JSON object holding one large array of items (``releases``
+or ``records`` for OCDS, ``grants`` for 360Giving) next to a few small
+top-level fields (``version``, ``extensions``, ``publisher``...).
+
+``load_json_package`` reads the top-level fields once and returns a dict whose
+item arrays are ``StreamedList`` objects: read-only lists that parse their items
+from the file one at a time on every iteration. Code written for plain
+``json.load`` output (``isinstance(value, list)``, ``for item in value``,
+``len(value)``, jsonschema validation) keeps working, while peak memory is
+bounded by the largest single item rather than by the whole file.
+'''
+import json
+import os
+import re
+import types
+from decimal import Decimal
+from itertools import islice
+
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+# What may follow the part of a number decoded so far, when the number is cut by the end of the buffer
+NUMBER_TAIL_RE = re.compile(r'[0-9.eE+-]*\Z')
+
+
+class NotJSONObjectError(ValueError):
+    '''The top level of the JSON data is not an object.'''
+
+
+class _Reader():
+    '''Buffered reader over a text file that decodes one JSON value at a time.'''
+    def __init__(self, fp, decoder):
+        self.fp = fp
+        self.decoder = decoder
+        self.buffer = ''
+        self.pos = 0
+        self.offset = 0  # number of characters discarded from the buffer so far
+
+    def fill(self, size=None):
+        '''Append up to ``size`` (CHUNK_SIZE by default) characters to the buffer, return False at end of file'''
+        data = self.fp.read(size or CHUNK_SIZE)
+        if not data:
+            return False
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def error(self, msg, pos=None):
+        if pos is None:
+            pos = self.pos
+        return ValueError('{} (char {})'.format(msg, self.offset + pos))
+
+    def peek(self):
+        '''Return the next non whitespace character without consuming it, '' at end of file'''
+        while True:
+            self.pos = WHITESPACE_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise self.error('Expecting one of {}'.format(' '.join(repr(c) for c in chars)))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as err:
+                # The value may just be cut by the end of the buffer.
+                if self.fill(size):
+                    size *= 2
+                    continue
+                raise self.error(err.msg, err.pos) from None
+            # A number at the end of the buffer may continue in the next chunk: 1 then 5,
+            # or 1 followed by . or e (left undecoded) then 5 or 3.
+            if (isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) and
+                    NUMBER_TAIL_RE.match(self.buffer, end) and self.fill(size)):
+                continue
+            self.pos = end
+            return value
+
+
+def _iter_array(reader):
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(',]') == ']':
+            return
+
+
+def _iter_members(reader, item_keys):
+    '''Yield (key, value) pairs of a top level JSON object.
+
+    Values of ``item_keys`` holding arrays are yielded as generators over the
+    array items. Items not consumed by the caller are skipped.
+    '''
+    if reader.peek() != '{':
+        if not reader.peek():
+            raise reader.error('Expecting value')
+        raise NotJSONObjectError('The top level of the JSON data is not an object')
+    reader.pos += 1
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            if reader.peek() != '"':
+                raise reader.error('Expecting property name enclosed in double quotes')
+            key = reader.value()
+            reader.expect(':')
+            if key in item_keys and reader.peek() == '[':
+                reader.pos += 1
+                items = _iter_array(reader)
+                yield key, items
+                for _ in items:
+                    pass
+            else:
+                yield key, reader.value()
+            if reader.expect(',}') == '}':
+                break
+    if reader.peek():
+        raise reader.error('Extra data')
+
+
+def _decoder(parse_float):
+    return json.JSONDecoder(parse_float=parse_float)
+
+
+class StreamedList(list):
+    '''Read-only list of the items of a top-level array in a JSON file.
+
+    Items are decoded from the file on each iteration and never kept, so
+    iterating twice parses the array twice.
+    '''
+    def __init__(self, file_name, key, length, parse_float=Decimal, encoding='utf-8', item_hook=None):
+        super().__init__()
+        self.file_name = file_name
+        self.key = key
+        self.length = length
+        self.parse_float = parse_float
+        self.encoding = encoding
+        self.item_hook = item_hook
+
+    def __iter__(self):
+        with open(self.file_name, encoding=self.encoding) as fp:
+            reader = _Reader(fp, _decoder(self.parse_float))
+            for key, value in _iter_members(reader, (self.key,)):
+                if key == self.key:
+                    for item in value:
+                        yield self.item_hook(item) if self.item_hook else item
+                    return
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step < 0:
+                return list(self)[index]
+            return list(islice(self, start, stop, step))
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('list index out of range')
+        return next(islice(self, index, None))
+
+    def __contains__(self, value):
+        return any(item == value for item in self)
+
+    def __eq__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __reversed__(self):
+        return reversed(list(self))
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __repr__(self):
+        return '<StreamedList {!r}: {} items from {}>'.format(self.key, self.length, self.file_name)
+
+    def __reduce__(self):
+        return (self.__class__, (self.file_name, self.key, self.length, self.parse_float,
+                                 self.encoding, self.item_hook))
+
+    def copy(self):
+        return list(self)
+
+    def count(self, value):
+        return sum(1 for item in self if item == value)
+
+    def index(self, value, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.length)
+        for num, item in islice(enumerate(self), start, stop):
+            if item == value:
+                return num
+        raise ValueError('{!r} is not in list'.format(value))
+
+    def map(self, func):
+        '''Return a StreamedList over the same items with ``func`` applied to each of them'''
+        item_hook = func
+        if self.item_hook:
+            item_hook = _compose(func, self.item_hook)
+        return self.__class__(self.file_name, self.key, self.length, self.parse_float, self.encoding, item_hook)
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('StreamedList is read-only')
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+
+class _compose():
+    '''Picklable composition of two single argument functions'''
+    def __init__(self, outer, inner):
+        self.outer = outer
+        self.inner = inner
+
+    def __call__(self, value):
+        return self.outer(self.inner(value))
+
+
+class StreamedPackage(dict):
+    '''A JSON object loaded with its item arrays as StreamedList values.'''
+    def __init__(self, file_name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.file_name = file_name
+
+    def __reduce__(self):
+        return (self.__class__, (self.file_name, list(self.items())))
+
+
+def load_json_package(file_name, item_keys, parse_float=Decimal, encoding='utf-8'):
+    '''Read a JSON object, streaming the arrays found under ``item_keys``.
+
+    The file is read once here, which checks that it is well formed, collects the
+    other top-level fields and counts the items. Raise ValueError for malformed
+    JSON and NotJSONObjectError if the top level is not an object.
+    '''
+    members = []
+    with open(file_name, encoding=encoding) as fp:
+        reader = _Reader(fp, _decoder(parse_float))
+        for key, value in _iter_members(reader, item_keys):
+            if isinstance(value, types.GeneratorType):
+                length = sum(1 for _ in value)
+                value = StreamedList(file_name, key, length, parse_float=parse_float, encoding=encoding)
+            members.append((key, value))
+    return StreamedPackage(file_name, members)
+
+
+def iter_json_object(file_name, parse_float=Decimal, encoding='utf-8'):
+    '''Yield the (key, value) pairs of a JSON object one at a time, without loading the whole file.
+
+    Raise ValueError for malformed JSON and NotJSONObjectError if the top level is not an object.
+    '''
+    with open(file_name, encoding=encoding) as fp:
+        yield from _iter_members(_Reader(fp, _decoder(parse_float)), ())
+
+
+def load_json(file_name, item_keys, stream_threshold=None, parse_float=Decimal, encoding='utf-8'):
+    '''Load JSON data from a file, streaming item arrays of files bigger than stream_threshold bytes.
+
+    A falsy ``stream_threshold`` disables streaming. Raise ValueError for malformed JSON.
+    Only streamed data raise NotJSONObjectError, otherwise the caller can check the type
+    of the value returned.
+    '''
+    if stream_threshold and os.path.getsize(file_name) > stream_threshold:
+        return load_json_package(file_name, item_keys, parse_float=parse_float, encoding=encoding)
+    with open(file_name, encoding=encoding) as fp:
+        return json.load(fp, parse_float=parse_float)
@@ -1,18 +1,20 @@
 from functools import lru_cache, wraps  # use this to preserve function signatures and docstrings
 from decimal import Decimal
 
-import requests
-
 from . exceptions import UnrecognisedFileType
 
 
+# Errors caused by data that doesn't have the expected structure
+DATA_ERRORS = (KeyError, TypeError, IndexError, AttributeError, ValueError)
+
+
 def ignore_errors(f):
     @wraps(f)
     def ignore(json_data, *args, ignore_errors=False, return_on_error={}, **kwargs):
         if ignore_errors:
             try:
                 return f(json_data, *args, **kwargs)
-            except (KeyError, TypeError, IndexError, AttributeError, ValueError):
+            except DATA_ERRORS:
                 return return_on_error
         else:
             return f(json_data, *args, **kwargs)
@@ -88,4 +90,7 @@ def decimal_default(o):
 
 @lru_cache(maxsize=64)
 def cached_get_request(url):
+    # Imported here as this module is used by the command line entry points
+    import requests
+
     return requests.get(url)
@@ -0,0 +1,92 @@
+'''Run several analyses of JSON data in a single traversal.
+
+Each analysis is a DataVisitor. walk_data() goes through the data depth first,
+in document order, and calls ``visit(path, value)`` for every node on the
+visitors interested in it. ``path`` is the tuple of keys and array indexes
+leading to the node, ``()`` for the top level. ``visit`` returns True to also be
+called for the children of the node (members of an object, items of an array),
+so a visitor only pays for the parts of the data it looks at, and children no
+visitor asked for are not traversed at all.
+
+With streamed data (see cove.lib.stream) this also means the items are parsed
+once for all the analyses, instead of once per analysis.
+
+Errors caused by unexpected data (see tools.DATA_ERRORS) stop the visitor that
+raised them, not the traversal: they are raised again by ``visitor.result()``,
+which, like functions decorated with tools.ignore_errors, can return a default
+value instead.
+'''
+from cove.lib import tools
+
+
+class DataVisitor():
+    error = None
+
+    def visit(self, path, value):
+        '''Look at the node at ``path``, return True to visit its children'''
+        return False
+
+    def finish(self):
+        '''Return the result of the analysis, once all the data has been visited'''
+        return None
+
+    def result(self, ignore_errors=False, return_on_error={}):
+        if self.error is None:
+            try:
+                return self.finish()
+            except tools.DATA_ERRORS as err:
+                self.error = err
+        if ignore_errors:
+            return return_on_error
+        raise self.error
+
+
+class ItemsVisitor(DataVisitor):
+    '''Visitor of each item of the top-level array ``items_key``, e.g. each release of a package.
+
+    Nothing else is traversed. An ``items_key`` that is not an array is looped
+    over like an array would be.
+    '''
+    items_key = None
+
+    def visit(self, path, value):
+        if not path:
+            items = tools.get_no_exception(value, self.items_key, [])
+            if isinstance(items, list):
+                return bool(items)
+            for item in items:
+                self.visit_item(None, item)
+            return False
+        if len(path) == 1:
+            return path[0] == self.items_key
+        self.visit_item(path[1], value)
+        return False
+
+    def visit_item(self, num, item):
+        pass
+
+
+def _walk(path, value, visitors):
+    children_visitors = []
+    for visitor in visitors:
+        if visitor.error is not None:
+            continue
+        try:
+            if visitor.visit(path, value):
+                children_visitors.append(visitor)
+        except tools.DATA_ERRORS as err:
+            visitor.error = err
+
+    if not children_visitors:
+        return
+    if isinstance(value, dict):
+        for key, child in value.items():
+            _walk(path + (key,), child, children_visitors)
+    elif isinstance(value, list):
+        for num, item in enumerate(value):
+            _walk(path + (num,), item, children_visitors)
+
+
+def walk_data(json_data, visitors):
+    '''Traverse ``json_data`` once, feeding every node to the visitors that asked for it'''
+    _walk((), json_data, list(visitors))
@@ -1,9 +1,24 @@
+import csv
+import glob
 import json
 import os
 import shutil
 import sys
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+from cove.lib.error_store import FULL_ERRORS_FILE_NAME
+
+
+RESULTS_FILE_NAME = 'results.json'
+# Written last in the output directory of each file of a batch, the files that have one are done
+BATCH_STATUS_FILE_NAME = 'batch_status.json'
+BATCH_SUMMARY_FILE_NAME = 'summary.csv'
+BATCH_REPORT_FILE_NAME = 'summary.jsonl'
+BATCH_SUMMARY_FIELDS = ('file', 'output_dir', 'status', 'validation_errors', 'seconds', 'message')
 
 
 class SetEncoder(json.JSONEncoder):
@@ -13,18 +28,157 @@ class SetEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def get_batch_files(source):
+    '''Return the files of a batch: the files in the directory ``source``, the files listed in the
+    manifest ``source`` (one path per line, relative to the manifest) or the files matching the glob
+    pattern ``source``.
+    '''
+    if os.path.isdir(source):
+        files = []
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            files.extend(os.path.join(dirpath, name) for name in filenames if not name.startswith('.'))
+        files.sort()
+    elif os.path.isfile(source):
+        manifest_dir = os.path.dirname(source)
+        with open(source) as fp:
+            lines = (line.strip() for line in fp)
+            files = [os.path.join(manifest_dir, line) for line in lines if line and not line.startswith('#')]
+        missing = [path for path in files if not os.path.isfile(path)]
+        if missing:
+            raise CommandError('Files listed in {} not found: {}'.format(source, ', '.join(missing)))
+        files = list(OrderedDict.fromkeys(files))
+    else:
+        files = sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+
+    if not files:
+        raise CommandError('No files to process in {}'.format(source))
+    return files
+
+
+def get_batch_output_dirs(files, output_dir):
+    '''Return an OrderedDict of file -> its output directory, named after the file like in single file mode.
+
+    Files in subdirectories get the same subdirectories in ``output_dir``.
+    '''
+    common_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in files])
+    output_dirs = OrderedDict(
+        (path, os.path.join(output_dir, os.path.splitext(os.path.relpath(os.path.abspath(path), common_dir))[0]))
+        for path in files
+    )
+    duplicates = set(name for name, count in Counter(output_dirs.values()).items() if count > 1)
+    # The output directory of a file can't be inside the output directory of another one either
+    names = set(output_dirs.values())
+    for name in names:
+        parent = os.path.dirname(name)
+        while parent and parent != output_dir:
+            if parent in names:
+                duplicates.update((name, parent))
+            parent = os.path.dirname(parent)
+    if duplicates:
+        raise CommandError('Several files would have the same output directory: {}'.format(
+            ', '.join(sorted(duplicates))))
+    return output_dirs
+
+
+def load_batch_status(output_dir):
+    '''Return the summary row of a file processed by a previous batch, or None if it wasn't'''
+    try:
+        with open(os.path.join(output_dir, BATCH_STATUS_FILE_NAME)) as fp:
+            return json.load(fp, object_pairs_hook=OrderedDict)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def count_validation_errors(output_dir):
+    '''Return the number of validation errors found in a file, from the list of all of them'''
+    try:
+        with open(os.path.join(output_dir, FULL_ERRORS_FILE_NAME), 'rb') as fp:
+            return sum(1 for line in fp)
+    except FileNotFoundError:
+        return 0
+
+
+def process_batch_file(process_file, file, output_dir, file_options, exclude_file=False, count_errors=None):
+    '''Process ``file`` of a batch in ``output_dir`` with ``process_file``, return its summary row.
+
+    Runs in the worker processes of the batch. Errors are recorded in the row
+    rather than raised, so that one bad file doesn't stop the batch.
+    ``count_errors(result)`` returns other numbers of errors for the row.
+    '''
+    start = time.time()
+    row = OrderedDict([('file', file), ('output_dir', output_dir), ('status', 'ok'), ('validation_errors', None),
+                       ('seconds', None), ('message', '')])
+    # Left by an interrupted batch
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+
+    try:
+        if not exclude_file:
+            shutil.copy2(file, output_dir)
+        result = process_file(output_dir, file, file_options)
+        with open(os.path.join(output_dir, RESULTS_FILE_NAME), 'w') as result_file:
+            json.dump(result, result_file, indent=2, sort_keys=True, cls=SetEncoder)
+        row['validation_errors'] = count_validation_errors(output_dir)
+        if count_errors:
+            row.update(count_errors(result))
+    except Exception as e:
+        row['status'] = 'error'
+        row['message'] = str(e) or e.__class__.__name__
+
+    row['seconds'] = round(time.time() - start, 3)
+    with open(os.path.join(output_dir, BATCH_STATUS_FILE_NAME), 'w') as fp:
+        json.dump(row, fp)
+    return row
+
+
+def format_summary(rows):
+    '''Return the summary rows of a batch as a text table'''
+    lines = ['{:<6} {:>8} {:>9}  {}'.format('Status', 'Errors', 'Seconds', 'File')]
+    for row in rows:
+        errors = '-' if row['validation_errors'] is None else row['validation_errors']
+        line = '{:<6} {:>8} {:>9.2f}  {}'.format(row['status'], errors, row['seconds'], row['file'])
+        if row['message']:
+            line += ': {}'.format(row['message'])
+        lines.append(line)
+
+    failed = sum(1 for row in rows if row['status'] != 'ok')
+    lines.append('{} files, {} ok, {} failed, {:.2f} seconds'.format(
+        len(rows), len(rows) - failed, failed, sum(row['seconds'] for row in rows)))
+    return '\n'.join(lines)
+
+
 class CoveBaseCommand(BaseCommand):
+    # For batch mode and serve_api: the options of the command that apply to each file, and module level
+    # functions (set with staticmethod) so that worker processes can run them. process_file(output_dir, file,
+    # file_options) returns the results of a file, count_errors(results) other numbers of errors for its summary.
+    # serve_api adds cache_schema=False to the file options: the schemas are checked for changes after the TTL.
+    file_options = ()
+    process_file = None
+    count_errors = None
+
     def __init__(self, *args, **kwargs):
         self.output_dir = ''
         super(CoveBaseCommand, self).__init__(*args, **kwargs)
 
     def add_arguments(self, parser):
-        parser.add_argument('file', help='File to be processed by Cove')
+        parser.add_argument('file', help='File to be processed by Cove, or with --batch a directory, a manifest '
+                            '(a file listing one path per line) or a glob pattern')
         parser.add_argument('--output-dir', '-o', default='', help='Directory where the output is created, defaults to the name of the file')
         parser.add_argument('--delete', '-d', action='store_true', help='Delete existing directory if it exits')
         parser.add_argument('--exclude-file', '-e', action='store_true', help='Do not include the file in the output directory')
+        parser.add_argument('--batch', '-b', action='store_true', help='Process several files, each in its own '
+                            'directory of the output directory, and write a summary')
+        parser.add_argument('--jobs', '-j', type=int, default=None, help='Number of files of a batch processed at '
+                            'the same time, defaults to the number of CPUs')
+        parser.add_argument('--resume', '-r', action='store_true', help='Continue a batch in an existing output '
+                            'directory, skipping the files already processed')
 
     def handle(self, file, *args, **options):
+        if options.get('batch'):
+            raise CommandError('{} does not have a batch mode'.format(self.__module__.split('.')[-1]))
+
         output_dir = options.get('output_dir')
         delete = options.get('delete')
         exclude_file = options.get('exclude_file')
@@ -44,3 +198,77 @@ class CoveBaseCommand(BaseCommand):
             shutil.copy2(file, output_dir)
 
         self.output_dir = output_dir
+
+    def get_file_options(self, options):
+        return {name: options.get(name) for name in self.file_options}
+
+    def warm_up(self, file_options=None):
+        '''Load what processing files with ``file_options`` needs (any file if None), e.g. before forking'''
+
+    def handle_batch(self, source, **options):
+        '''Process the files of ``source`` with process_file.
+
+        The worker processes are forked after warm_up, so they all start with
+        what it loaded, and each keeps it for all the files it processes.
+        '''
+        file_options = self.get_file_options(options)
+        files = get_batch_files(source)
+        output_dir = options.get('output_dir')
+        if not output_dir:
+            name = os.path.basename(os.path.normpath(source)).split('.')[0]
+            output_dir = '{}_results'.format(name) if os.path.exists(source) else 'batch_results'
+
+        if os.path.exists(output_dir) and not options.get('resume'):
+            if options.get('delete'):
+                shutil.rmtree(output_dir)
+            else:
+                self.stdout.write('Directory {} already exists, use --resume to continue its batch'.format(output_dir))
+                sys.exit(1)
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Don't process the output of previous batches
+        real_output_dir = os.path.join(os.path.realpath(output_dir), '')
+        files = [path for path in files if not os.path.realpath(path).startswith(real_output_dir)]
+        output_dirs = get_batch_output_dirs(files, output_dir)
+
+        rows = OrderedDict()
+        if options.get('resume'):
+            for path, file_output_dir in output_dirs.items():
+                row = load_batch_status(file_output_dir)
+                if row is not None:
+                    rows[path] = row
+        todo = [path for path in files if path not in rows]
+        self.stdout.write('{} files to process, {} already processed'.format(len(todo), len(rows)))
+
+        if todo:
+            self.warm_up(file_options)
+            jobs = min(options.get('jobs') or os.cpu_count() or 1, len(todo))
+            args = [(self.process_file, path, output_dirs[path], file_options, options.get('exclude_file'),
+                     self.count_errors) for path in todo]
+            if jobs == 1:
+                for arg in args:
+                    self._batch_file_done(rows, len(files), process_batch_file(*arg))
+            else:
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    futures = [executor.submit(process_batch_file, *arg) for arg in args]
+                    for future in as_completed(futures):
+                        self._batch_file_done(rows, len(files), future.result())
+
+        summary = [rows[path] for path in files]
+        with open(os.path.join(output_dir, BATCH_SUMMARY_FILE_NAME), 'w', newline='') as fp:
+            writer = csv.DictWriter(fp, BATCH_SUMMARY_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(summary)
+        # All the numbers of errors, one JSON object per line
+        with open(os.path.join(output_dir, BATCH_REPORT_FILE_NAME), 'w') as fp:
+            for row in summary:
+                fp.write(json.dumps(row) + '\n')
+        self.stdout.write(format_summary(summary))
+
+        self.output_dir = output_dir
+        if any(row['status'] != 'ok' for row in summary):
+            sys.exit(1)
+
+    def _batch_file_done(self, rows, total, row):
+        rows[row['file']] = row
+        self.stdout.write('[{}/{}] {} {}'.format(len(rows), total, row['status'], row['file']))
@@ -0,0 +1,240 @@
+'''Check files sent over HTTP with the command line version of the current app, in a long-running process.
+
+Each ``ocds-cli`` or ``iati-cli`` run loads Python, Django and the schemas
+before it checks its file. This server loads them once, with the warm_up of
+the command (all the schema versions, rulesets, org-ids prefixes...), and
+then answers each request with the results the command would have written to
+results.json.
+
+It listens on a localhost port, or on a Unix socket with --socket::
+
+    POST /validate?name=<file name>&<option>=<value>...   the file is the body of the request
+    POST /validate?path=<path of a local file>&<option>=<value>...
+    GET /                                                 the app and the options it takes
+
+The options are the file options of the command (e.g. ``schema_version`` and
+``convert`` for OCDS, ``openag`` and ``orgids`` for IATI). The files are
+written to a temporary directory that is deleted after the response, unless
+``output_dir`` is given. ``path`` and ``output_dir`` give access to the files
+of the server, so they are only accepted with --allow-local-paths, which is
+refused unless the server listens on localhost or a Unix socket. The body of
+the request must have a Content-Length: chunked requests get a 411 response.
+Files that can't be checked get a 400 response with the error.
+
+Unlike a single run of the command, which keeps the schemas it downloads
+for the whole run, the server checks them for changes after SCHEMA_CACHE_TTL
+seconds.
+'''
+import http.server
+import ipaddress
+import json
+import logging
+import os
+import shutil
+import signal
+import socketserver
+import sys
+import tempfile
+from urllib.parse import parse_qsl, urlparse
+
+from django.conf import settings
+from django.core.management import load_command_class
+from django.core.management.base import BaseCommand, CommandError
+
+from cove.management.commands.base_command import SetEncoder
+
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class LengthRequired(Exception):
+    pass
+
+
+def is_local_host(host):
+    '''Whether only this machine can connect to ``host``'''
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ValidationAPI():
+    '''Check files with the CoveBaseCommand ``command`` of ``app_name``, given the parameters of a request.
+
+    The ``path`` and ``output_dir`` parameters are refused unless ``allow_local_paths`` is set.
+    '''
+    def __init__(self, app_name, command_name, allow_local_paths=False):
+        self.app_name = app_name
+        self.command_name = command_name
+        self.allow_local_paths = allow_local_paths
+        self.command = load_command_class(app_name, command_name)
+        if not self.command.process_file:
+            raise CommandError('{} does not check files one at a time'.format(command_name))
+        self.parser = self.command.create_parser('', command_name)
+        self.option_actions = {action.dest: action for action in self.parser._actions
+                               if action.dest in self.command.file_options}
+
+    def warm_up(self):
+        self.command.warm_up()
+
+    def describe(self):
+        return {'app': self.app_name, 'command': self.command_name, 'options': list(self.command.file_options)}
+
+    def get_file_options(self, params):
+        '''Return the file options of the command given as request parameters, parsed like its arguments'''
+        args = []
+        for name, value in params.items():
+            action = self.option_actions.get(name.replace('-', '_'))
+            if action is None:
+                raise CommandError('Unknown parameter {}'.format(name))
+            if action.nargs == 0:
+                if value.lower() in TRUE_VALUES:
+                    args.append(action.option_strings[0])
+            else:
+                args.extend([action.option_strings[0], value])
+        file_options = self.command.get_file_options(vars(self.parser.parse_args(args + ['-'])))
+        # Check the schemas for changes after SCHEMA_CACHE_TTL, the server runs for much longer than a command
+        file_options['cache_schema'] = False
+        return file_options
+
+    def validate(self, params, read_body):
+        '''Return the results of the file of a request'''
+        params = dict(params)
+        path = params.pop('path', None)
+        name = os.path.basename(params.pop('name', '') or '')
+        output_dir = params.pop('output_dir', None)
+        if (path or output_dir) and not self.allow_local_paths:
+            raise CommandError('The path and output_dir parameters are only accepted with --allow-local-paths')
+        if not path and not name:
+            raise CommandError('The name of the file (name) or its path (path) is missing')
+        if path and not os.path.isfile(path):
+            raise CommandError('{} is not a file'.format(path))
+        file_options = self.get_file_options(params)
+
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        else:
+            tmp_dir = tempfile.mkdtemp(prefix='cove-api-')
+        try:
+            file_output_dir = output_dir or tmp_dir
+            if not path:
+                path = os.path.join(file_output_dir, name)
+                with open(path, 'wb') as fp:
+                    read_body(fp)
+            return self.command.process_file(file_output_dir, path, file_options)
+        finally:
+            if not output_dir:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class ValidationRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urlparse(self.path).path != '/':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        self.send_json(200, self.server.api.describe())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/validate':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            results = self.server.api.validate(parse_qsl(url.query), self.read_body)
+        except LengthRequired as e:
+            self.send_json(411, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.info('Could not check %s', self.path, exc_info=not isinstance(e, CommandError))
+            self.send_json(400, {'error': str(e) or e.__class__.__name__})
+            return
+        self.send_json(200, results)
+
+    def read_body(self, fp):
+        if self.headers.get('Content-Length') is None:
+            # e.g. chunked, which BaseHTTPRequestHandler doesn't decode
+            raise LengthRequired('The Content-Length of the file is missing')
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            fp.write(chunk)
+            remaining -= len(chunk)
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj, sort_keys=True, cls=SetEncoder).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The client address of a Unix socket is empty
+        logger.debug(format, *args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(api, host='127.0.0.1', port=0, socket_path=None):
+    '''Return a server answering the requests with ``api``, on a Unix socket if ``socket_path`` is given'''
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ValidationRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ValidationRequestHandler)
+    server.api = api
+    return server
+
+
+class Command(BaseCommand):
+    help = 'Check files sent over HTTP with the command line version of the current app'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Address to listen on, defaults to localhost')
+        parser.add_argument('--port', '-p', type=int, default=8001, help='Port to listen on')
+        parser.add_argument('--socket', '-s', default='', help='Listen on this Unix socket instead of a port')
+        parser.add_argument('--command', '-c', default='',
+                            help='Command checking the files, defaults to the command line version of the app, '
+                                 'e.g. ocds_cli for cove_ocds')
+        parser.add_argument('--allow-local-paths', action='store_true',
+                            help='Accept the path and output_dir parameters, reading and writing the files of the '
+                                 'server. Only with a localhost address or a Unix socket')
+
+    def handle(self, *args, **options):
+        if options.get('allow_local_paths') and not options.get('socket') and not is_local_host(options.get('host')):
+            raise CommandError('--allow-local-paths is only accepted on a localhost address or a Unix socket')
+        app_name = settings.COVE_CONFIG['app_name']
+        command_name = options.get('command') or '{}_cli'.format(app_name.split('_', 1)[-1])
+        try:
+            api = ValidationAPI(app_name, command_name, allow_local_paths=options.get('allow_local_paths'))
+        except ImportError:
+            raise CommandError('{} has no {} command'.format(app_name, command_name))
+
+        api.warm_up()
+        server = make_server(api, options.get('host'), options.get('port'), options.get('socket'))
+        self.stdout.write('Checking files with {} on {}'.format(
+            command_name, options.get('socket') or 'http://{}:{}/'.format(*server.server_address[:2])))
+        # Stop like with Ctrl+C, removing the socket
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if options.get('socket') and os.path.exists(options.get('socket')):
+                os.remove(options.get('socket'))
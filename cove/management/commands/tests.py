@@ -1,5 +1,12 @@
+import csv
+import json
+from io import StringIO
+
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from cove.input.models import SuppliedData
+from cove.lib.error_store import FULL_ERRORS_FILE_NAME
+from cove.management.commands.base_command import CoveBaseCommand, get_batch_files, get_batch_output_dirs
 from django.core.files.base import ContentFile
 import pytest
 import os
@@ -18,3 +25,106 @@ def test_expire_files():
     call_command('expire_files')
     assert os.path.exists(recent.upload_dir())
     assert not os.path.exists(old.upload_dir())
+
+
+def process_test_file(output_dir, file, options):
+    with open(file) as fp:
+        data = json.load(fp)
+    if 'error' in data:
+        raise ValueError(data['error'])
+    with open(os.path.join(output_dir, FULL_ERRORS_FILE_NAME), 'w') as fp:
+        fp.write('{}\n' * data.get('errors', 0))
+    return {'file': os.path.basename(file), 'option': options['option']}
+
+
+def count_test_errors(result):
+    return {'option_errors': result['option']}
+
+
+def write_batch_files(tmpdir):
+    tmpdir.join('a.json').write('{"errors": 2}', ensure=True)
+    tmpdir.join('b.json').write('{"error": "Bad file"}')
+    tmpdir.join('sub', 'c.json').write('{}', ensure=True)
+    tmpdir.join('.hidden.json').write('{}')
+
+
+def test_get_batch_files(tmpdir):
+    write_batch_files(tmpdir)
+    files = [str(tmpdir.join(name)) for name in ('a.json', 'b.json', 'sub/c.json')]
+    assert get_batch_files(str(tmpdir)) == files
+    assert get_batch_files(str(tmpdir.join('**', '*.json'))) == files
+    assert get_batch_files(str(tmpdir.join('*.json'))) == files[:2]
+
+    tmpdir.join('manifest.txt').write('# Comment\nsub/c.json\n\na.json\nsub/c.json\n')
+    assert get_batch_files(str(tmpdir.join('manifest.txt'))) == [files[2], files[0]]
+
+    tmpdir.join('manifest.txt').write('missing.json\n')
+    with pytest.raises(CommandError):
+        get_batch_files(str(tmpdir.join('manifest.txt')))
+    with pytest.raises(CommandError):
+        get_batch_files(str(tmpdir.join('*.xml')))
+
+
+def test_get_batch_output_dirs():
+    assert list(get_batch_output_dirs(['data/a.json', 'data/sub/b.xlsx'], 'out').values()) == ['out/a', 'out/sub/b']
+    with pytest.raises(CommandError):
+        get_batch_output_dirs(['data/a.json', 'data/a.xlsx'], 'out')
+    with pytest.raises(CommandError):
+        get_batch_output_dirs(['data/sub.json', 'data/sub/b.json'], 'out')
+
+
+class BatchTestCommand(CoveBaseCommand):
+    file_options = ('option',)
+    process_file = staticmethod(process_test_file)
+    count_errors = staticmethod(count_test_errors)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_handle_batch(tmpdir, jobs):
+    write_batch_files(tmpdir.join('data'))
+    output_dir = str(tmpdir.join('out'))
+    command = BatchTestCommand(stdout=StringIO())
+
+    with pytest.raises(SystemExit):
+        command.handle_batch(str(tmpdir.join('data')), option=1, output_dir=output_dir, jobs=jobs)
+    assert sorted(os.listdir(output_dir)) == ['a', 'b', 'sub', 'summary.csv', 'summary.jsonl']
+    assert sorted(os.listdir(os.path.join(output_dir, 'a'))) == [
+        'a.json', 'batch_status.json', 'results.json', 'validation_errors_full.jsonl']
+    with open(os.path.join(output_dir, 'a', 'results.json')) as fp:
+        assert json.load(fp) == {'file': 'a.json', 'option': 1}
+    assert not os.path.exists(os.path.join(output_dir, 'b', 'results.json'))
+
+    with open(os.path.join(output_dir, 'summary.csv')) as fp:
+        summary = list(csv.DictReader(fp))
+    assert [(row['output_dir'], row['status'], row['validation_errors'], row['message']) for row in summary] == [
+        (os.path.join(output_dir, 'a'), 'ok', '2', ''),
+        (os.path.join(output_dir, 'b'), 'error', '', 'Bad file'),
+        (os.path.join(output_dir, 'sub', 'c'), 'ok', '0', ''),
+    ]
+    with open(os.path.join(output_dir, 'summary.jsonl')) as fp:
+        report = [json.loads(line) for line in fp]
+    assert [(row['status'], row['validation_errors'], row.get('option_errors')) for row in report] == [
+        ('ok', 2, 1), ('error', None, None), ('ok', 0, 1)]
+    table = command.stdout.getvalue()
+    assert '3 files, 2 ok, 1 failed' in table
+    assert 'Bad file' in table
+
+    # Without --resume or --delete the output directory is left alone
+    with pytest.raises(SystemExit):
+        command.handle_batch(str(tmpdir.join('data')), option=2, output_dir=output_dir)
+    assert os.path.exists(os.path.join(output_dir, 'summary.csv'))
+
+    # An interrupted batch: c.json wasn't finished, a new file was added
+    os.remove(os.path.join(output_dir, 'sub', 'c', 'batch_status.json'))
+    tmpdir.join('data', 'd.json').write('{}')
+    command = BatchTestCommand(stdout=StringIO())
+    with pytest.raises(SystemExit):
+        command.handle_batch(str(tmpdir.join('data')), option=2, output_dir=output_dir, jobs=jobs, resume=True)
+    assert '2 files to process, 2 already processed' in command.stdout.getvalue()
+    with open(os.path.join(output_dir, 'a', 'results.json')) as fp:
+        assert json.load(fp) == {'file': 'a.json', 'option': 1}
+    with open(os.path.join(output_dir, 'sub', 'c', 'results.json')) as fp:
+        assert json.load(fp) == {'file': 'c.json', 'option': 2}
+    with open(os.path.join(output_dir, 'summary.csv')) as fp:
+        assert [row['file'] for row in csv.DictReader(fp)] == [
+            str(tmpdir.join('data', name)) for name in ('a.json', 'b.json', 'd.json', 'sub/c.json')]
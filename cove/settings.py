@@ -15,8 +15,6 @@ import environ
 import os
 import warnings
 
-import raven
-
 from django.utils.crypto import get_random_string
 
 COVE_CONFIG = {
@@ -43,6 +41,19 @@ env = environ.Env(  # set default values and casting
     SECRET_KEY=(str, secret_key),
     DB_NAME=(str, os.path.join(BASE_DIR, 'db.sqlite3')),
     DEBUG_TOOLBAR=(bool, False),
+    STREAM_JSON_THRESHOLD=(int, 50 * 1024 * 1024),
+    STREAM_XML_THRESHOLD=(int, 50 * 1024 * 1024),
+    JOB_WORKERS=(int, 0),
+    JOB_TIMEOUT=(int, 60 * 60),
+    SCHEMA_CACHE_TTL=(int, 60 * 60),
+    HTTP_CACHE_DIR=(str, os.path.join(BASE_DIR, 'http_cache')),
+    EXTENDED_SCHEMA_DIR=(str, os.path.join(BASE_DIR, 'media', 'extended_schemas')),
+    RESULT_CACHE_DIR=(str, ''),
+    DOWNLOAD_MAX_SIZE=(int, 1024 * 1024 * 1024),
+    DOWNLOAD_TIMEOUT=(int, 5 * 60),
+    VALIDATION_WORKERS=(int, 0),
+    VALIDATION_ERROR_SAMPLES=(int, 100),
+    VALIDATION_ERROR_RESERVOIR=(bool, False),
     # SCHEMA_URL_360=(str, 'https://raw.githubusercontent.com/ThreeSixtyGiving/standard/master/schema/'),
 )
 
@@ -58,6 +69,47 @@ GOOGLE_ANALYTICS_ID = env('GOOGLE_ANALYTICS_ID')
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# JSON files bigger than this (in bytes) have their releases/records/grants
+# streamed from disk instead of being loaded in memory. 0 disables streaming.
+STREAM_JSON_THRESHOLD = env('STREAM_JSON_THRESHOLD')
+# IATI XML files bigger than this (in bytes) are parsed and checked one activity
+# at a time instead of being loaded in memory. 0 disables streaming.
+STREAM_XML_THRESHOLD = env('STREAM_XML_THRESHOLD')
+
+# Number of worker processes checking supplied data in the background, while the
+# explore page polls for the results. 0 does the work in the web request instead.
+JOB_WORKERS = env('JOB_WORKERS')
+# Seconds after which a queued or running job is considered lost and can be queued again.
+JOB_TIMEOUT = env('JOB_TIMEOUT')
+
+# Seconds before schemas, extensions and objects built from them are checked for changes.
+SCHEMA_CACHE_TTL = env('SCHEMA_CACHE_TTL')
+# Directory where downloaded schemas, codelists, extensions and org-ids are kept,
+# shared by all the processes and kept across restarts. Empty keeps them in memory only.
+HTTP_CACHE_DIR = env('HTTP_CACHE_DIR')
+# Directory where each distinct schema with extensions applied is written once, named
+# after a hash of its content, and linked from the upload directories that use it.
+# Empty writes a copy in each upload directory instead.
+EXTENDED_SCHEMA_DIR = env('EXTENDED_SCHEMA_DIR')
+# Directory where the results of checked data are kept, to be reused when the same file
+# is supplied again with the same options. Empty disables this.
+RESULT_CACHE_DIR = env('RESULT_CACHE_DIR')
+
+# Files supplied by URL bigger than this (in bytes, after decompression) are refused,
+# and so are downloads taking longer than DOWNLOAD_TIMEOUT seconds. 0 disables either limit.
+DOWNLOAD_MAX_SIZE = env('DOWNLOAD_MAX_SIZE')
+DOWNLOAD_TIMEOUT = env('DOWNLOAD_TIMEOUT')
+
+# Number of processes validating the releases/records/grants of a package against
+# the schema in parallel. 0 validates them in the process doing the checks.
+VALIDATION_WORKERS = env('VALIDATION_WORKERS')
+
+# Number of example values kept for each kind of validation error, all the errors are
+# counted and can be downloaded. 0 keeps them all. With VALIDATION_ERROR_RESERVOIR the
+# examples are a random sample of the errors instead of the first ones.
+VALIDATION_ERROR_SAMPLES = env('VALIDATION_ERROR_SAMPLES')
+VALIDATION_ERROR_RESERVOIR = env('VALIDATION_ERROR_RESERVOIR')
+
 DEALER_TYPE = 'git'
 
 # Quick-start development settings - unsuitable for production
@@ -72,6 +124,9 @@ DEBUG = env('DEBUG')
 ALLOWED_HOSTS = env('ALLOWED_HOSTS')
 
 if env('SENTRY_DSN'):
+    # raven takes a while to import, only load it if it is used
+    import raven
+
     RAVEN_CONFIG = {
         'dsn': env('SENTRY_DSN'),
         'release': raven.fetch_git_sha(os.path.join(os.path.dirname(__file__), '..')),
@@ -223,3 +278,8 @@ LOGGING = {
         },
     },
 }
+
+if not env('SENTRY_DSN'):
+    # Nothing to send to, don't import raven for its handler
+    del LOGGING['handlers']['sentry']
+    LOGGING['loggers']['']['handlers'].remove('sentry')
@@ -1,12 +1,24 @@
 import json
 import os
+import pickle
 
+import flattentool
 import pytest
+import requests
 from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
 
 from cove.lib.common import get_fields_present, get_json_data_generic_paths
+from cove.lib.converters import flatten_outputs
+from cove.lib.error_store import ErrorStore
 from cove.lib.exceptions import UnrecognisedFileType
+from cove.lib.http_cache import DiskCache
+from cove.lib import registry as registry_module
+from cove.lib.registry import SchemaRegistry
+from cove.lib.source_map import SOURCE_MAPS_FILE_NAME, get_source_maps
+from cove.lib import stream
+from cove.lib.stream import NotJSONObjectError, StreamedList, load_json, load_json_package
 from cove.lib.tools import get_file_type
+from cove.lib.visitor import DataVisitor, ItemsVisitor, walk_data
 
 
 def test_fields_present():
@@ -56,3 +68,360 @@ def test_get_json_data_generic_paths():
         ('releases', 1, 'buyer', 'name'): 'Parks Canada',
         ('releases', 0, 'buyer', 'name'): 'Agriculture & Agrifood Canada'
     }
+
+
+class RecordingVisitor(DataVisitor):
+    def __init__(self, max_depth):
+        self.max_depth = max_depth
+        self.paths = []
+
+    def visit(self, path, value):
+        self.paths.append(path)
+        return len(path) < self.max_depth
+
+    def finish(self):
+        return self.paths
+
+
+class FailingItemsVisitor(ItemsVisitor):
+    items_key = 'items'
+
+    def visit_item(self, num, item):
+        item['missing']
+
+
+def test_walk_data():
+    json_data = {'a': [{'b': 1}, 2], 'items': [{}, {}]}
+    shallow = RecordingVisitor(1)
+    deep = RecordingVisitor(10)
+    failing = FailingItemsVisitor()
+    walk_data(json_data, [shallow, deep, failing])
+
+    assert shallow.result() == [(), ('a',), ('items',)]
+    assert deep.result() == [(), ('a',), ('a', 0), ('a', 0, 'b'), ('a', 1), ('items',), ('items', 0), ('items', 1)]
+    with pytest.raises(KeyError):
+        failing.result()
+    assert failing.result(ignore_errors=True) == {}
+    assert failing.result(ignore_errors=True, return_on_error=None) is None
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # Exercise values cut across buffer boundaries
+    monkeypatch.setattr(stream, 'CHUNK_SIZE', 7)
+
+
+def test_load_json_package(small_chunks):
+    file_name = os.path.join('cove', 'fixtures', 'tenders_releases_2_releases_with_deprecated_fields.json')
+    with open(file_name) as fp:
+        json_data = json.load(fp)
+
+    streamed_data = load_json_package(file_name, ('releases', 'records'), parse_float=float)
+    assert isinstance(streamed_data['releases'], StreamedList)
+    assert len(streamed_data['releases']) == 2
+    assert streamed_data == json_data
+    assert list(streamed_data['releases']) == json_data['releases']
+    assert streamed_data['releases'][-1] == json_data['releases'][1]
+    assert streamed_data['releases'][:1] == json_data['releases'][:1]
+    assert get_fields_present(streamed_data) == get_fields_present(json_data)
+    assert get_json_data_generic_paths(streamed_data) == get_json_data_generic_paths(json_data)
+
+
+def test_load_json_package_streamed_list(tmpdir, small_chunks):
+    file_name = str(tmpdir.join('data.json'))
+    with open(file_name, 'w') as fp:
+        fp.write('{"releases": [{"ocid": "a"}, 1.5, "x", [12345678901234]], "version": "1.1", "records": {}}')
+
+    data = load_json_package(file_name, ('releases', 'records'))
+    assert data['version'] == '1.1'
+    assert data['records'] == {}
+    releases = data['releases']
+    assert len(releases) == 4
+    assert list(releases) == [{'ocid': 'a'}, 1.5, 'x', [12345678901234]]
+    assert 'x' in releases
+    assert releases.index('x') == 2
+    assert list(releases.map(str)) == ["{'ocid': 'a'}", '1.5', 'x', '[12345678901234]']
+    with pytest.raises(TypeError):
+        releases.append({})
+
+
+@pytest.mark.parametrize('number', ['1.5', '12e3', '1.5e-3', '-12.25E+2'])
+def test_load_json_package_number_across_chunks(tmpdir, monkeypatch, number):
+    file_name = str(tmpdir.join('data.json'))
+    content = '{{"a": {0}, "releases": [{0}, {0}], "b": {0}}}'.format(number)
+    with open(file_name, 'w') as fp:
+        fp.write(content)
+
+    # Cut the numbers at every position
+    for chunk_size in range(1, len(content) + 1):
+        monkeypatch.setattr(stream, 'CHUNK_SIZE', chunk_size)
+        data = load_json_package(file_name, ('releases',), parse_float=float)
+        assert data == json.loads(content), chunk_size
+
+
+@pytest.mark.parametrize('content', ['', '{"releases": [{}', '{"releases": [{}]} []', '{"releases": [{},]}'])
+def test_load_json_package_malformed(tmpdir, small_chunks, content):
+    file_name = str(tmpdir.join('data.json'))
+    with open(file_name, 'w') as fp:
+        fp.write(content)
+
+    with pytest.raises(ValueError):
+        load_json_package(file_name, ('releases',))
+
+
+def test_load_json_threshold(tmpdir):
+    file_name = str(tmpdir.join('data.json'))
+    with open(file_name, 'w') as fp:
+        fp.write('[{"ocid": "a"}]')
+
+    assert load_json(file_name, ('releases',), stream_threshold=0) == [{'ocid': 'a'}]
+    with pytest.raises(NotJSONObjectError):
+        load_json(file_name, ('releases',), stream_threshold=1)
+
+
+class FakeResponse():
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.reason = 'OK'
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.encoding = 'utf-8'
+        self.headers = headers or {}
+
+
+class FakeSession():
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append((url, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_schema_registry_get(monkeypatch):
+    registry = SchemaRegistry(ttl=60)
+    registry.session = FakeSession(
+        FakeResponse(200, 'schema', {'ETag': '"1"'}),
+        FakeResponse(304),
+        FakeResponse(200, 'new schema', {'ETag': '"2"'}),
+        requests.exceptions.ConnectionError(),
+    )
+    now = 1000
+    monkeypatch.setattr(registry_module.time, 'time', lambda: now)
+
+    assert registry.get_text('http://example.com/schema.json') == 'schema'
+    assert registry.get_text('http://example.com/schema.json') == 'schema'
+    assert len(registry.session.requests) == 1
+
+    # Revalidated with the ETag once expired
+    now += 61
+    assert registry.get_text('http://example.com/schema.json') == 'schema'
+    assert registry.session.requests[1][1] == {'If-None-Match': '"1"'}
+    now += 61
+    assert registry.get_text('http://example.com/schema.json') == 'new schema'
+    # The cached copy is used if the server can't be reached
+    now += 61
+    assert registry.get_text('http://example.com/schema.json') == 'new schema'
+    assert len(registry.session.requests) == 4
+
+
+def test_schema_registry_session_per_process(monkeypatch):
+    registry = SchemaRegistry()
+    session = registry.session
+    assert isinstance(session, requests.Session)
+    assert registry.session is session
+
+    # A forked worker makes a session of its own
+    monkeypatch.setattr(registry_module.os, 'getpid', lambda: -1)
+    assert registry.session is not session
+    assert registry.session is registry.session
+
+
+def test_disk_cache(tmpdir):
+    disk_cache = DiskCache(str(tmpdir))
+    assert disk_cache.load('http://example.com/schema.json') is None
+
+    disk_cache.save('http://example.com/schema.json', FakeResponse(200, 'schéma', {'ETag': '"1"', 'X-Other': 'a'}), 1000)
+    response, fetched = disk_cache.load('http://example.com/schema.json')
+    assert fetched == 1000
+    assert response.status_code == 200
+    assert response.text == 'schéma'
+    assert dict(response.headers) == {'ETag': '"1"'}
+    assert disk_cache.load('http://example.com/other.json') is None
+
+    disk_cache.clear()
+    assert disk_cache.load('http://example.com/schema.json') is None
+    assert DiskCache('').load('http://example.com/schema.json') is None
+
+
+def test_source_map(tmpdir):
+    cell_source_map = {
+        'releases/0/id': [['releases', 'A', 2, 'id']],
+        'releases/0/tender/items/0/id': [['items', 'B', 2, 'tender/items/0/id']],
+        'releases/1/id': [['releases', 'A', 3, 'id']],
+    }
+    tmpdir.join('cell_source_map.json').write(json.dumps(cell_source_map))
+    tmpdir.join('heading_source_map.json').write(json.dumps({'releases/id': [['releases', 'id']]}))
+
+    cell_src_map, heading_src_map = get_source_maps(str(tmpdir))
+    assert tmpdir.join(SOURCE_MAPS_FILE_NAME).check()
+    assert cell_src_map['releases/1/id'] == [['releases', 'A', 3, 'id']]
+    assert cell_src_map.get('releases/2/id') is None
+    assert 'releases/0/id' in cell_src_map
+    assert 'releases/0' not in cell_src_map
+    assert list(cell_src_map) == list(cell_source_map)
+    assert len(cell_src_map) == 3
+    assert cell_src_map == cell_source_map
+    assert cell_src_map.get_zero_index_paths('releases/tender/items/id') == ['releases/0/tender/items/0/id']
+    assert cell_src_map.get_zero_index_paths('releases/1/id') == ['releases/1/id']
+    assert heading_src_map == {'releases/id': [['releases', 'id']]}
+    assert pickle.loads(pickle.dumps(cell_src_map)) == cell_source_map
+
+    tmpdir.join('cell_source_map.json').write('{}')
+    os.utime(str(tmpdir.join('cell_source_map.json')), (0, os.path.getmtime(str(tmpdir.join(SOURCE_MAPS_FILE_NAME))) + 1))
+    cell_src_map, heading_src_map = get_source_maps(str(tmpdir))
+    assert not cell_src_map
+    assert heading_src_map
+
+
+def test_flatten_outputs(tmpdir):
+    schema = {
+        'type': 'object',
+        'properties': {
+            'id': {'type': 'string', 'title': 'Identifier'},
+            'amount': {'type': 'number', 'title': 'Amount'},
+            'beneficiaries': {'type': 'array', 'title': 'Beneficiaries', 'items': {
+                'type': 'object',
+                'properties': {'id': {'type': 'string', 'title': 'Identifier'},
+                               'name': {'type': 'string', 'title': 'Name'}}
+            }}
+        }
+    }
+    data = {'grants': [
+        {'id': 'a', 'amount': 1, 'beneficiaries': [{'id': 'x', 'name': 'X'}, {'id': 'y', 'other': 'Y'}]},
+        {'id': 'b', 'extra': True, 'beneficiaries': []},
+    ]}
+    tmpdir.join('schema.json').write(json.dumps(schema))
+    tmpdir.join('data.json').write(json.dumps(data))
+    kwargs = dict(schema=str(tmpdir.join('schema.json')), main_sheet_name='grants', root_list_path='grants',
+                  root_id='')
+
+    conversion_warnings = flatten_outputs(str(tmpdir.join('data.json')), [
+        (str(tmpdir.join('flattened')), False),
+        (str(tmpdir.join('flattened-titles')), True),
+    ], **kwargs)
+    assert len(conversion_warnings) == 2
+
+    for name, use_titles in (('flattened', False), ('flattened-titles', True)):
+        flattentool.flatten(str(tmpdir.join('data.json')), output_name=str(tmpdir.join('expected-' + name)),
+                            use_titles=use_titles, **kwargs)
+        assert tmpdir.join(name + '.xlsx').check()
+        expected = tmpdir.join('expected-' + name)
+        assert sorted(path.basename for path in tmpdir.join(name).listdir()) == sorted(
+            path.basename for path in expected.listdir())
+        for path in expected.listdir():
+            assert tmpdir.join(name, path.basename).read() == path.read()
+
+    assert tmpdir.join('flattened', 'grants.csv').read().splitlines()[0] == 'id,amount,extra,beneficiaries'
+    assert tmpdir.join('flattened-titles', 'grants.csv').read().splitlines()[0] == 'Identifier,Amount,extra,beneficiaries'
+
+
+def test_schema_registry_disk_cache(monkeypatch, tmpdir):
+    now = 1000
+    monkeypatch.setattr(registry_module.time, 'time', lambda: now)
+    registry = SchemaRegistry(ttl=60, disk_cache=DiskCache(str(tmpdir)))
+    registry.session = FakeSession(FakeResponse(200, 'schema', {'ETag': '"1"'}))
+    assert registry.get_text('http://example.com/schema.json') == 'schema'
+
+    # Another process uses the copy on disk without a request
+    other_registry = SchemaRegistry(ttl=60, disk_cache=DiskCache(str(tmpdir)))
+    other_registry.session = FakeSession(
+        FakeResponse(304),
+        FakeResponse(503),
+    )
+    assert other_registry.get_text('http://example.com/schema.json') == 'schema'
+    assert other_registry.session.requests == []
+
+    # and revalidates it once expired, for all the processes
+    now += 61
+    assert other_registry.get_text('http://example.com/schema.json') == 'schema'
+    assert other_registry.session.requests[0][1] == {'If-None-Match': '"1"'}
+    assert DiskCache(str(tmpdir)).load('http://example.com/schema.json')[1] == now
+
+    # The cached copy is used on server errors
+    now += 61
+    assert other_registry.get_text('http://example.com/schema.json') == 'schema'
+    assert len(other_registry.session.requests) == 2
+
+
+def test_schema_registry_get_object(monkeypatch):
+    registry = SchemaRegistry(ttl=60, maxsize=2)
+    now = 1000
+    monkeypatch.setattr(registry_module.time, 'time', lambda: now)
+    built = []
+
+    def build(value):
+        built.append(value)
+        return value
+
+    assert registry.get_object('a', lambda: build(1)) == 1
+    assert registry.get_object('a', lambda: build(2)) == 1
+    now += 61
+    assert registry.get_object('a', lambda: build(3)) == 3
+    registry.get_object('b', lambda: build(4))
+    registry.get_object('c', lambda: build(5))
+    assert registry.get_object('a', lambda: build(6)) == 6
+    assert built == [1, 3, 4, 5, 6]
+
+
+def test_error_store_samples(tmpdir):
+    full_errors_path = str(tmpdir.join('full.jsonl'))
+    with ErrorStore(max_samples=2, full_errors_path=full_errors_path) as store:
+        for num in range(5):
+            store.add('{"message": "a"}', {'path': 'a/{}'.format(num)})
+        store.add('{"message": "b"}', {'path': 'b'})
+
+    assert store.counts == {'{"message": "a"}': 5, '{"message": "b"}': 1}
+    assert store.total == 6
+    assert store.samples == {'{"message": "a"}': [{'path': 'a/0'}, {'path': 'a/1'}],
+                             '{"message": "b"}': [{'path': 'b'}]}
+    assert store.context_errors() == [
+        ['{"count": 5, "message": "a"}', [{'path': 'a/0'}, {'path': 'a/1'}]],
+        ['{"count": 1, "message": "b"}', [{'path': 'b'}]],
+    ]
+
+    with open(full_errors_path) as fp:
+        lines = [json.loads(line) for line in fp]
+    assert len(lines) == 6
+    assert lines[4] == {'error': {'message': 'a'}, 'value': {'path': 'a/4'}}
+
+    store.dump(str(tmpdir.join('errors.json')))
+    loaded = ErrorStore.load(str(tmpdir.join('errors.json')))
+    assert loaded.counts == store.counts
+    assert loaded.samples == store.samples
+
+
+def test_error_store_reservoir():
+    def sample(seed):
+        store = ErrorStore(max_samples=10, reservoir=True, seed=seed)
+        for num in range(1000):
+            store.add('{}', {'num': num})
+        return [value['num'] for value in store.samples['{}']]
+
+    samples = sample(0)
+    assert len(samples) == 10
+    assert samples == sorted(samples)
+    assert samples[-1] >= 10
+    assert sample(0) == samples
+    assert sample(1) != samples
+
+
+def test_error_store_unbounded():
+    store = ErrorStore()
+    for num in range(1000):
+        store.add('{}', {'num': num})
+    assert store.samples['{}'] == [{'num': num} for num in range(1000)]
@@ -31,6 +31,8 @@ urlpatterns = [
     url(r'^$', cove.input.views.data_input, name='index'),
     url(r'^terms/$', TemplateView.as_view(template_name='terms.html'), name='terms'),
     url(r'^stats/$', cove.views.stats, name='stats'),
+    url(r'^data/(.+)/status$', cove.views.job_status, name='job_status'),
+    url(r'^data/(.+)/validation_errors$', cove.views.validation_errors_download, name='validation_errors_download'),
     url(r'^test/500$', cause500),
     url(r'^admin/', include(admin.site.urls)),
     url(r'^i18n/', include('django.conf.urls.i18n'))
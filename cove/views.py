@@ -1,13 +1,20 @@
+import functools
 import logging
+import os
 from datetime import timedelta
 
+from django.conf import settings
 from django.db.models.aggregates import Count
-from django.shortcuts import render
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import redirect, render
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from cove.input import jobs, result_cache
 from cove.input.models import SuppliedData
+from cove.lib.error_store import FULL_ERRORS_FILE_NAME, VALIDATION_ERRORS_FILE_NAME
+from cove.lib.exceptions import CoveInputDataError
 from cove.lib.tools import get_file_type as _get_file_type
 
 logger = logging.getLogger(__name__)
@@ -29,7 +36,7 @@ def explore_data_context(request, pk, get_file_type=None):
 
     try:
         file_name = data.original_file.file.name
-        if file_name.endswith('validation_errors-3.json'):
+        if file_name.endswith((VALIDATION_ERRORS_FILE_NAME, FULL_ERRORS_FILE_NAME)):
             raise PermissionError('You are not allowed to upload a file with this name.')
     except FileNotFoundError:
         return {}, None, render(request, 'error.html', {
@@ -59,6 +66,94 @@ def explore_data_context(request, pk, get_file_type=None):
     return (context, data, None)
 
 
+def explore_data_job(request, db_data, context, func, options=None):
+    '''Compute the explore context with ``func(db_data, context, options)``.
+
+    When JOB_WORKERS is set the work is done in a background job: return
+    (None, response) with a processing page or redirect to return instead
+    until the job is done. Otherwise return (context, None). Options posted
+    while a job is active are not used: the processing page says so.
+
+    The results of data identical to data checked before are reused (see
+    cove.input.result_cache).
+    '''
+    func = functools.partial(result_cache.run_cached, func)
+    if not settings.JOB_WORKERS:
+        context = func(db_data, context, options or {})
+    else:
+        if request.method == 'POST':
+            if not jobs.is_active(db_data):
+                jobs.clear_result(db_data)
+                jobs.submit(db_data, func, context, options)
+                return None, redirect(request.path)
+            context.update({
+                'job_state': db_data.job_state,
+                'job_stage_label': jobs.stage_label(db_data),
+                'job_options_ignored': True,
+            })
+            return None, render(request, 'processing.html', context, status=409)
+
+        result = jobs.load_result(db_data)
+        if result is None:
+            if db_data.job_state == 'failed':
+                return None, render(request, 'error.html', {
+                    'sub_title': _("Sorry, we can't process that data"),
+                    'link': 'index',
+                    'link_text': _('Try Again'),
+                    'msg': _('Something went wrong while checking your data.')
+                }, status=500)
+            if not jobs.is_active(db_data):
+                jobs.submit(db_data, func, context, options)
+            context.update({
+                'job_state': db_data.job_state,
+                'job_stage_label': jobs.stage_label(db_data),
+            })
+            return None, render(request, 'processing.html', context, status=202)
+        if 'error' in result:
+            raise CoveInputDataError(context=result['error'])
+        context = result['context']
+
+    context['first_render'] = not db_data.rendered
+    if not db_data.rendered:
+        db_data.rendered = True
+        db_data.save()
+    return context, None
+
+
+def job_status(request, pk):
+    try:
+        data = SuppliedData.objects.get(pk=pk)
+    except (SuppliedData.DoesNotExist, ValidationError):
+        raise Http404
+
+    return JsonResponse({
+        'state': data.job_state,
+        'stage': data.job_stage,
+        'stage_label': str(jobs.stage_label(data)),
+        'queued': data.job_queued,
+        'started': data.job_started,
+        'finished': data.job_finished,
+        'downloaded_size': data.downloaded_size,
+        'download_size': data.download_size,
+    })
+
+
+def validation_errors_download(request, pk):
+    '''Stream all the validation errors of the data, one JSON object per line'''
+    try:
+        data = SuppliedData.objects.get(pk=pk)
+    except (SuppliedData.DoesNotExist, ValidationError):
+        raise Http404
+
+    try:
+        full_errors_fp = open(os.path.join(data.upload_dir(), FULL_ERRORS_FILE_NAME), 'rb')
+    except FileNotFoundError:
+        raise Http404
+    response = FileResponse(full_errors_fp, content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="validation_errors.jsonl"'
+    return response
+
+
 def stats(request):
     query = SuppliedData.objects.filter(current_app=request.current_app)
     by_form = query.values('form_name').annotate(Count('id'))
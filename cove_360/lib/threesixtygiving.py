@@ -2,12 +2,14 @@ import re
 from collections import defaultdict, OrderedDict
 from decimal import Decimal
 
-import cove.lib.tools as tools
 from cove.lib.common import common_checks_context, get_orgids_prefixes
+from cove.lib.visitor import ItemsVisitor, walk_data
 
 
-orgids_prefixes = get_orgids_prefixes()
-orgids_prefixes.append('360G')
+def get_360_orgids_prefixes():
+    '''Return the org-ids prefixes and 360Giving's own, downloaded when first needed rather than on import'''
+    return get_orgids_prefixes() + ['360G']
+
 
 currency_html = {
     "GBP": "&pound;",
@@ -16,102 +18,116 @@ currency_html = {
 }
 
 
-@tools.ignore_errors
-def get_grants_aggregates(json_data):
-
-    id_count = 0
-    count = 0
-    unique_ids = set()
-    duplicate_ids = set()
-    max_award_date = ""
-    min_award_date = ""
-    distinct_funding_org_identifier = set()
-    distinct_recipient_org_identifier = set()
-    currencies = {}
-
-    if 'grants' in json_data:
-        for grant in json_data['grants']:
-            count = count + 1
-            currency = grant.get('currency')
-
-            if currency not in currencies.keys():
-                currencies[currency] = {
-                    "count": 0,
-                    "total_amount": 0,
-                    "max_amount": 0,
-                    "min_amount": 0,
-                    "currency_symbol": currency_html.get(currency, "")
-                }
-
-            currencies[currency]["count"] += 1
-            amount_awarded = grant.get('amountAwarded')
-            if amount_awarded and isinstance(amount_awarded, (int, Decimal, float)):
-                currencies[currency]["total_amount"] += amount_awarded
-                currencies[currency]['max_amount'] = max(amount_awarded, currencies[currency]['max_amount'])
-                if not currencies[currency]["min_amount"]:
-                    currencies[currency]['min_amount'] = amount_awarded
-                currencies[currency]['min_amount'] = min(amount_awarded, currencies[currency]['min_amount'])
-
-            award_date = str(grant.get('awardDate', ''))
-            if award_date:
-                max_award_date = max(award_date, max_award_date)
-                if not min_award_date:
-                    min_award_date = award_date
-                min_award_date = min(award_date, min_award_date)
-
-            grant_id = grant.get('id')
-            if grant_id:
-                id_count = id_count + 1
-                if grant_id in unique_ids:
-                    duplicate_ids.add(grant_id)
-                unique_ids.add(grant_id)
-
-            funding_orgs = grant.get('fundingOrganization', [])
-            for funding_org in funding_orgs:
-                funding_org_id = funding_org.get('id')
-                if funding_org_id:
-                    distinct_funding_org_identifier.add(funding_org_id)
-
-            recipient_orgs = grant.get('recipientOrganization', [])
-            for recipient_org in recipient_orgs:
-                recipient_org_id = recipient_org.get('id')
-                if recipient_org_id:
-                    distinct_recipient_org_identifier.add(recipient_org_id)
-
-    recipient_org_prefixes = get_prefixes(distinct_recipient_org_identifier)
-    recipient_org_identifier_prefixes = recipient_org_prefixes['prefixes']
-    recipient_org_identifiers_unrecognised_prefixes = recipient_org_prefixes['unrecognised_prefixes']
-    
-    funding_org_prefixes = get_prefixes(distinct_funding_org_identifier)
-    funding_org_identifier_prefixes = funding_org_prefixes['prefixes']
-    funding_org_identifiers_unrecognised_prefixes = funding_org_prefixes['unrecognised_prefixes']
+class GrantsAggregatesVisitor(ItemsVisitor):
+    items_key = 'grants'
+
+    def __init__(self):
+        self.id_count = 0
+        self.count = 0
+        self.unique_ids = set()
+        self.duplicate_ids = set()
+        self.max_award_date = ""
+        self.min_award_date = ""
+        self.distinct_funding_org_identifier = set()
+        self.distinct_recipient_org_identifier = set()
+        self.currencies = {}
+
+    def visit_item(self, num, grant):
+        self.count = self.count + 1
+        currency = grant.get('currency')
+
+        if currency not in self.currencies.keys():
+            self.currencies[currency] = {
+                "count": 0,
+                "total_amount": 0,
+                "max_amount": 0,
+                "min_amount": 0,
+                "currency_symbol": currency_html.get(currency, "")
+            }
+
+        self.currencies[currency]["count"] += 1
+        amount_awarded = grant.get('amountAwarded')
+        if amount_awarded and isinstance(amount_awarded, (int, Decimal, float)):
+            self.currencies[currency]["total_amount"] += amount_awarded
+            self.currencies[currency]['max_amount'] = max(amount_awarded, self.currencies[currency]['max_amount'])
+            if not self.currencies[currency]["min_amount"]:
+                self.currencies[currency]['min_amount'] = amount_awarded
+            self.currencies[currency]['min_amount'] = min(amount_awarded, self.currencies[currency]['min_amount'])
+
+        award_date = str(grant.get('awardDate', ''))
+        if award_date:
+            self.max_award_date = max(award_date, self.max_award_date)
+            if not self.min_award_date:
+                self.min_award_date = award_date
+            self.min_award_date = min(award_date, self.min_award_date)
+
+        grant_id = grant.get('id')
+        if grant_id:
+            self.id_count = self.id_count + 1
+            if grant_id in self.unique_ids:
+                self.duplicate_ids.add(grant_id)
+            self.unique_ids.add(grant_id)
+
+        funding_orgs = grant.get('fundingOrganization', [])
+        for funding_org in funding_orgs:
+            funding_org_id = funding_org.get('id')
+            if funding_org_id:
+                self.distinct_funding_org_identifier.add(funding_org_id)
+
+        recipient_orgs = grant.get('recipientOrganization', [])
+        for recipient_org in recipient_orgs:
+            recipient_org_id = recipient_org.get('id')
+            if recipient_org_id:
+                self.distinct_recipient_org_identifier.add(recipient_org_id)
+
+    def finish(self):
+        distinct_funding_org_identifier = self.distinct_funding_org_identifier
+        distinct_recipient_org_identifier = self.distinct_recipient_org_identifier
+
+        recipient_org_prefixes = get_prefixes(distinct_recipient_org_identifier)
+        recipient_org_identifier_prefixes = recipient_org_prefixes['prefixes']
+        recipient_org_identifiers_unrecognised_prefixes = recipient_org_prefixes['unrecognised_prefixes']
+
+        funding_org_prefixes = get_prefixes(distinct_funding_org_identifier)
+        funding_org_identifier_prefixes = funding_org_prefixes['prefixes']
+        funding_org_identifiers_unrecognised_prefixes = funding_org_prefixes['unrecognised_prefixes']
+
+        return {
+            'count': self.count,
+            'id_count': self.id_count,
+            'unique_ids': self.unique_ids,
+            'duplicate_ids': self.duplicate_ids,
+            'max_award_date': self.max_award_date.split("T")[0],
+            'min_award_date': self.min_award_date.split("T")[0],
+            'distinct_funding_org_identifier': distinct_funding_org_identifier,
+            'distinct_recipient_org_identifier': distinct_recipient_org_identifier,
+            'currencies': self.currencies,
+            'recipient_org_identifier_prefixes': recipient_org_identifier_prefixes,
+            'recipient_org_identifiers_unrecognised_prefixes': recipient_org_identifiers_unrecognised_prefixes,
+            'funding_org_identifier_prefixes': funding_org_identifier_prefixes,
+            'funding_org_identifiers_unrecognised_prefixes': funding_org_identifiers_unrecognised_prefixes
+        }
 
-    return {
-        'count': count,
-        'id_count': id_count,
-        'unique_ids': unique_ids,
-        'duplicate_ids': duplicate_ids,
-        'max_award_date': max_award_date.split("T")[0],
-        'min_award_date': min_award_date.split("T")[0],
-        'distinct_funding_org_identifier': distinct_funding_org_identifier,
-        'distinct_recipient_org_identifier': distinct_recipient_org_identifier,
-        'currencies': currencies,
-        'recipient_org_identifier_prefixes': recipient_org_identifier_prefixes,
-        'recipient_org_identifiers_unrecognised_prefixes': recipient_org_identifiers_unrecognised_prefixes,
-        'funding_org_identifier_prefixes': funding_org_identifier_prefixes,
-        'funding_org_identifiers_unrecognised_prefixes': funding_org_identifiers_unrecognised_prefixes
-    }
+
+def get_grants_aggregates(json_data, ignore_errors=False):
+    visitor = GrantsAggregatesVisitor()
+    walk_data(json_data, [visitor])
+    return visitor.result(ignore_errors=ignore_errors)
 
 
 def common_checks_360(context, upload_dir, json_data, schema_obj):
     schema_name = schema_obj.release_pkg_schema_name
-    common_checks = common_checks_context(upload_dir, json_data, schema_obj, schema_name, context)
-    cell_source_map = common_checks['cell_source_map']
-    additional_checks = run_additional_checks(json_data, cell_source_map, ignore_errors=True, return_on_error=None)
+    # Run the data-side checks in the same traversal as the common ones
+    additional_checks_visitor = AdditionalChecksVisitor()
+    aggregates = GrantsAggregatesVisitor()
+    common_checks = common_checks_context(upload_dir, json_data, schema_obj, schema_name, context,
+                                          visitors=[additional_checks_visitor, aggregates])
+    additional_checks_visitor.cell_source_map = common_checks['cell_source_map']
+    additional_checks = additional_checks_visitor.result(ignore_errors=True, return_on_error=None)
 
     context.update(common_checks['context'])
     context.update({
-        'grants_aggregates': get_grants_aggregates(json_data, ignore_errors=True),
+        'grants_aggregates': aggregates.result(ignore_errors=True),
         'additional_checks_errored': additional_checks is None,
         'additional_checks': additional_checks,
         'additional_checks_count': (len(additional_checks) if additional_checks else 0) + (1 if context['data_only'] else 0),
@@ -122,6 +138,7 @@ def common_checks_360(context, upload_dir, json_data, schema_obj):
 
 
 def get_prefixes(distinct_identifiers):
+    orgids_prefixes = get_360_orgids_prefixes()
 
     org_identifier_prefixes = defaultdict(int)
     org_identifiers_unrecognised_prefixes = defaultdict(int)
@@ -293,11 +310,15 @@ class RecipientOrgUnrecognisedPrefix(AdditionalTest):
         "message": "Using external identifiers (such as a charity or company number) helps people using your data to match it up against other data - for example to see who else has given grants to the same recipient, even if they’re known by a different name. If the data describes lots of grants to organisations that don’t have such identifiers, or grants to individuals, then you can ignore this notice."
     }
 
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.orgids_prefixes = get_360_orgids_prefixes()
+
     def process(self, grant, path_prefix):
         try:
             count_failure = False
             for num, organization in enumerate(grant['recipientOrganization']):
-                for prefix in orgids_prefixes:
+                for prefix in self.orgids_prefixes:
                     if organization['id'].lower().startswith(prefix.lower()):
                         break
                 else:
@@ -322,11 +343,15 @@ class FundingOrgUnrecognisedPrefix(AdditionalTest):
         "message": "Using external identifiers (such as a charity or company number) helps people using your data to match it up against other data - for example to see who else has given grants to the same recipient, even if they’re known by a different name. If the data describes lots of grants to organisations that don’t have such identifiers, or grants to individuals, then you can ignore this notice."
     }
 
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.orgids_prefixes = get_360_orgids_prefixes()
+
     def process(self, grant, path_prefix):
         try:
             count_failure = False
             for num, organization in enumerate(grant['fundingOrganization']):
-                for prefix in orgids_prefixes:
+                for prefix in self.orgids_prefixes:
                     if organization['id'].lower().startswith(prefix.lower()):
                         break
                 else:
@@ -713,31 +738,52 @@ TEST_CLASSES = [
 ]
 
 
-@tools.ignore_errors
-def run_additional_checks(json_data, cell_source_map):
-    if 'grants' not in json_data:
-        return []
-    test_instances = [test_cls(grants=json_data['grants']) for test_cls in TEST_CLASSES]
+class AdditionalChecksVisitor(ItemsVisitor):
+    '''Run the TEST_CLASSES checks on each grant.
+
+    The cell source map, needed for the results of spreadsheet data, can be
+    set after the traversal.
+    '''
+    items_key = 'grants'
+
+    def __init__(self, cell_source_map=None):
+        self.cell_source_map = cell_source_map
+        self.test_instances = None
 
-    for num, grant in enumerate(json_data['grants']):
-        for test_instance in test_instances:
+    def visit(self, path, value):
+        if not path and 'grants' in value:
+            self.test_instances = [test_cls(grants=value['grants']) for test_cls in TEST_CLASSES]
+        return super().visit(path, value)
+
+    def visit_item(self, num, grant):
+        for test_instance in self.test_instances:
             test_instance.process(grant, 'grants/{}'.format(num))
 
-    results = []
+    def finish(self):
+        if self.test_instances is None:
+            return []
 
-    for test_instance in test_instances:
-        if not test_instance.failed:
-            continue
+        results = []
 
-        spreadsheet_locations = []
-        spreadsheet_keys = ('sheet', 'letter', 'row_number', 'header')
-        if cell_source_map:
-            try:
-                spreadsheet_locations = [dict(zip(spreadsheet_keys, cell_source_map[location][0]))
-                                         for location in test_instance.json_locations]
-            except KeyError:
+        for test_instance in self.test_instances:
+            if not test_instance.failed:
                 continue
-        results.append((test_instance.produce_message(),
-                        test_instance.json_locations,
-                        spreadsheet_locations))
-    return results
+
+            spreadsheet_locations = []
+            spreadsheet_keys = ('sheet', 'letter', 'row_number', 'header')
+            if self.cell_source_map:
+                try:
+                    spreadsheet_locations = [dict(zip(spreadsheet_keys, self.cell_source_map[location][0]))
+                                             for location in test_instance.json_locations]
+                except KeyError:
+                    continue
+            results.append((test_instance.produce_message(),
+                            test_instance.json_locations,
+                            spreadsheet_locations))
+        return results
+
+
+def run_additional_checks(json_data, cell_source_map, ignore_errors=False, return_on_error={}):
+    visitor = AdditionalChecksVisitor(cell_source_map)
+    walk_data(json_data, [visitor])
+    return visitor.result(ignore_errors=ignore_errors, return_on_error=return_on_error)
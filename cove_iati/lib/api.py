@@ -5,6 +5,7 @@ import shutil
 from .iati import common_checks_context_iati, get_file_type
 from .schema import SchemaIATI
 from cove.lib.converters import convert_spreadsheet
+from cove.lib.source_map import SOURCE_MAPS_FILE_NAME
 
 
 class APIException(Exception):
@@ -55,6 +56,7 @@ def iati_json_output(output_dir, file, openag=False, orgids=False):
         # TODO: can we do this by no writing the files in the first place?
         os.remove(os.path.join(output_dir, 'heading_source_map.json'))
         os.remove(os.path.join(output_dir, 'cell_source_map.json'))
+        os.remove(os.path.join(output_dir, SOURCE_MAPS_FILE_NAME))
 
         if file_type == 'csv':
             shutil.rmtree(os.path.join(output_dir, 'csv_dir'))
@@ -7,7 +7,8 @@ class RuleSetStepException(Exception):
         self.id = ''
         self.feature_name = context.feature.name
         try:
-            self.id = context.xml.xpath('iati-identifier/text()')[0]
+            # Not a smart string, which would keep the whole document in memory
+            self.id = context.xml.xpath('iati-identifier/text()', smart_strings=False)[0]
         except IndexError:
             pass
 
@@ -1,130 +1,223 @@
 import json
 import os
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import defusedxml.lxml as etree
 import lxml.etree
-from bdd_tester import bdd_tester
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.utils.html import format_html
 
+from .rulesets import OPENAG_RULESET, ORGIDS_RULESET, STANDARD_RULESET, run_ruleset
 from .schema import SchemaIATI
+from cove.lib.error_store import VALIDATION_ERRORS_FILE_NAME, ErrorStore, get_error_store
 from cove.lib.exceptions import CoveInputDataError, UnrecognisedFileTypeXML
+from cove.lib.source_map import SourceMap, get_source_maps, zero_index_key
 from cove.lib.tools import ignore_errors
 
+# The activity in the paths of errors of a document with a single activity, see
+# lxml_errors_generator. Ruleset errors can have several paths, separated by spaces.
+ACTIVITY_PATH_RE = re.compile(r'(?<![^ ])/[^/ ]+/iati-activity(?![^/ ])')
+
 
 def common_checks_context_iati(context, upload_dir, data_file, file_type, api=False, openag=False, orgids=False):
     '''TODO: this function is trying to do too many things. Separate some
     of its logic into smaller functions doing one single thing each.
     '''
     schema_aiti = SchemaIATI()
-    lxml_errors = {}
     cell_source_map = {}
-    validation_errors_path = os.path.join(upload_dir, 'validation_errors-3.json')
-
-    with open(data_file, 'rb') as fp, open(schema_aiti.activity_schema) as schema_fp:
-        try:
-            tree = etree.parse(fp)
-        except lxml.etree.XMLSyntaxError as err:
-            raise CoveInputDataError(context={
-                'sub_title': _("Sorry, we can't process that data"),
-                'link': 'index',
-                'link_text': _('Try Again'),
-                'msg': _(format_html('We think you tried to upload a XML file, but it is not well formed XML.'
-                         '\n\n<span class="glyphicon glyphicon-exclamation-sign" aria-hidden="true">'
-                         '</span> <strong>Error message:</strong> {}', err)),
-                'error': format(err)
-            })
-        except UnicodeDecodeError as err:
-            raise CoveInputDataError(context={
-                'sub_title': _("Sorry, we can't process that data"),
-                'link': 'index',
-                'link_text': _('Try Again'),
-                'msg': _(format_html('We think you tried to upload a XML file, but the encoding is incorrect.'
-                         '\n\n<span class="glyphicon glyphicon-exclamation-sign" aria-hidden="true">'
-                         '</span> <strong>Error message:</strong> {}', err)),
-                'error': format(err)
-            })
-        schema_tree = etree.parse(schema_fp)
-
-    schema = lxml.etree.XMLSchema(schema_tree)
-    schema.validate(tree)
-    lxml_errors = lxml_errors_generator(schema.error_log)
-    errors_all = format_lxml_errors(lxml_errors)
-    invalid_data = bool(schema.error_log)
+    validation_errors_path = os.path.join(upload_dir, VALIDATION_ERRORS_FILE_NAME)
+    schema = schema_aiti.get_activity_xml_schema()
     return_on_error = [{'message': 'There was a problem running ruleset checks',
                         'exception': True}]
 
+    rulesets = [STANDARD_RULESET]
+    if openag:
+        rulesets.append(OPENAG_RULESET)
+    if orgids:
+        rulesets.append(ORGIDS_RULESET)
+
+    stream = settings.STREAM_XML_THRESHOLD and os.path.getsize(data_file) > settings.STREAM_XML_THRESHOLD
+    if stream:
+        # Activities are validated and checked against the rulesets as the file is read
+        futures = {ruleset: Future() for ruleset in rulesets}
+        lxml_errors = stream_activity_checks(data_file, schema, rulesets, futures)
+    else:
+        with open(data_file, 'rb') as fp:
+            try:
+                tree = etree.parse(fp)
+            except (lxml.etree.XMLSyntaxError, UnicodeDecodeError) as err:
+                raise xml_input_error(err)
+        schema.validate(tree)
+        lxml_errors = lxml_errors_generator(schema.error_log)
+    errors_all = format_lxml_errors(lxml_errors)
+
     # Validation errors
     if file_type != 'xml':
-        with open(os.path.join(upload_dir, 'cell_source_map.json')) as cell_source_map_fp:
-            cell_source_map = json.load(cell_source_map_fp)
+        cell_source_map = get_source_maps(upload_dir)[0]
     if os.path.exists(validation_errors_path):
-        with open(validation_errors_path) as validation_error_fp:
-            validation_errors = json.load(validation_error_fp)
+        error_store = ErrorStore.load(validation_errors_path)
     else:
-        validation_errors = get_xml_validation_errors(errors_all, file_type, cell_source_map)
+        with get_error_store(upload_dir) as error_store:
+            get_xml_validation_errors(errors_all, file_type, cell_source_map, error_store=error_store)
         if not api:
-            with open(validation_errors_path, 'w+') as validation_error_fp:
-                validation_error_fp.write(json.dumps(validation_errors))
-
-    # Ruleset errors
-    ruleset_errors = get_iati_ruleset_errors(
-        tree,
-        os.path.join(upload_dir, 'ruleset'),
-        api=api,
-        ignore_errors=invalid_data,
-        return_on_error=return_on_error
-    )
+            error_store.dump(validation_errors_path)
+    invalid_data = bool(error_store.total)
 
+    # Ruleset errors, each ruleset is run once and at the same time as the others
+    if stream:
+        # Read the rest of the file if the validation errors were already known
+        for error in errors_all:
+            pass
+    else:
+        with ThreadPoolExecutor(max_workers=len(rulesets)) as executor:
+            futures = {ruleset: executor.submit(run_ruleset, ruleset, tree) for ruleset in rulesets}
+    flat_errors = {ruleset: _get_ruleset_result(future, ignore_errors=invalid_data, return_on_error=return_on_error)
+                   for ruleset, future in futures.items()}
+
+    if flat_errors[STANDARD_RULESET] is return_on_error:
+        ruleset_errors = return_on_error
+    else:
+        ruleset_errors = format_ruleset_errors(flat_errors[STANDARD_RULESET], api=api)
     if openag:
-        ruleset_errors_ag = get_openag_ruleset_errors(
-            tree,
-            os.path.join(upload_dir, 'ruleset_openang'),
-            ignore_errors=invalid_data,
-            return_on_error=return_on_error
-        )
-        context.update({'ruleset_errors_openag': ruleset_errors_ag})
+        context.update({'ruleset_errors_openag': flat_errors[OPENAG_RULESET]})
     if orgids:
-        ruleset_errors_orgids = get_orgids_ruleset_errors(
-            tree,
-            os.path.join(upload_dir, 'ruleset_orgids'),
-            ignore_errors=invalid_data,
-            return_on_error=return_on_error
-        )
-        context.update({'ruleset_errors_orgids': ruleset_errors_orgids})
+        context.update({'ruleset_errors_orgids': flat_errors[ORGIDS_RULESET]})
 
     context.update({
-        'validation_errors': sorted(validation_errors.items()),
+        'validation_errors': error_store.context_errors(),
         'ruleset_errors': ruleset_errors
     })
 
     if not api:
         context.update({
-            'validation_errors_count': sum(len(value) for value in validation_errors.values()),
+            'validation_errors_count': error_store.total,
             'cell_source_map': cell_source_map,
             'first_render': False
         })
-        if ruleset_errors:
-            ruleset_errors_by_activity = get_iati_ruleset_errors(
-                tree,
-                os.path.join(upload_dir, 'ruleset'),
-                group_by='activity',
-                ignore_errors=invalid_data,
-                return_on_error=return_on_error
-            )
-            context['ruleset_errors'] = [ruleset_errors, ruleset_errors_by_activity]
-
         count_ruleset_errors = 0
-        if isinstance(ruleset_errors, dict):
-            for rules in ruleset_errors.values():
-                for errors in rules.values():
-                    count_ruleset_errors += len(errors)
+        if ruleset_errors is return_on_error:
+            context['ruleset_errors'] = [return_on_error, return_on_error]
+        elif ruleset_errors:
+            ruleset_errors_by_activity = format_ruleset_errors(flat_errors[STANDARD_RULESET], group_by='activity')
+            context['ruleset_errors'] = [ruleset_errors, ruleset_errors_by_activity]
+            count_ruleset_errors = len(flat_errors[STANDARD_RULESET])
 
         context['ruleset_errors_count'] = count_ruleset_errors
     return context
 
 
+def xml_input_error(err):
+    '''Return the CoveInputDataError for an XML file that can't be parsed'''
+    if isinstance(err, UnicodeDecodeError):
+        msg = format_html(_('We think you tried to upload a XML file, but the encoding is incorrect.'
+                            '\n\n<span class="glyphicon glyphicon-exclamation-sign" aria-hidden="true">'
+                            '</span> <strong>Error message:</strong> {}'), err)
+    else:
+        msg = format_html(_('We think you tried to upload a XML file, but it is not well formed XML.'
+                            '\n\n<span class="glyphicon glyphicon-exclamation-sign" aria-hidden="true">'
+                            '</span> <strong>Error message:</strong> {}'), err)
+    return CoveInputDataError(context={
+        'sub_title': _("Sorry, we can't process that data"),
+        'link': 'index',
+        'link_text': _('Try Again'),
+        'msg': msg,
+        'error': format(err)
+    })
+
+
+def iter_activity_documents(data_file):
+    '''Yield (document, index, multiple) for each activity of the XML file ``data_file``, as it is parsed
+
+    ``document`` is a copy of the root element whose only child is the activity at
+    position ``index`` in the file, and ``multiple`` tells whether the file has other
+    activities. Activities are moved out of the parsed tree as the file is read,
+    so at most two of them are in memory at a time. A file without
+    activities is yielded whole, with an index of None.
+    '''
+    # defusedxml has no iterparse, so do what its parser does: don't resolve
+    # entities or fetch anything, and refuse entity declarations
+    parser = lxml.etree.iterparse(data_file, tag='iati-activity', resolve_entities=False, no_network=True)
+    docinfo_checked = False
+    pending = None
+    index = -1
+    for event, activity in parser:
+        if not docinfo_checked:
+            etree.check_docinfo(activity.getroottree())
+            docinfo_checked = True
+        root = activity.getparent()
+        if root is None or root.getparent() is not None:
+            continue
+        # The parser may still add text after the activity it has just read, so
+        # activities are moved out of the tree once the next one is read
+        if pending is not None:
+            yield _activity_document(pending), index, True
+        # Whatever came before the activity (whitespace, comments) isn't needed anymore
+        while activity.getprevious() is not None:
+            del root[0]
+        pending = activity
+        index += 1
+
+    if pending is not None:
+        yield _activity_document(pending), index, index > 0
+    else:
+        if not docinfo_checked:
+            etree.check_docinfo(parser.root.getroottree())
+        yield parser.root, None, False
+
+
+def _activity_document(activity):
+    '''Move ``activity`` to a copy of its root element, and return the copy'''
+    root = activity.getparent()
+    document = lxml.etree.Element(root.tag, attrib=root.attrib, nsmap=root.nsmap)
+    document.append(activity)
+    return document
+
+
+def activity_error_path(path, index):
+    '''Add the position ``index`` of an activity to an error ``path`` of a document with just that activity'''
+    return ACTIVITY_PATH_RE.sub(r'\g<0>[{}]'.format(index + 1), path)
+
+
+def stream_activity_checks(data_file, schema, rulesets, futures):
+    '''Yield the lxml errors of the XML file ``data_file`` one activity at a time, as the file is parsed
+
+    Each activity is also checked against the ``rulesets``, and the result of
+    each ruleset (its errors for all the activities, or the exception raised)
+    is set in the Future of ``futures`` for that ruleset, as run_ruleset in an
+    executor would. Errors have the same paths as when validating the whole file.
+    '''
+    ruleset_errors = {ruleset: [] for ruleset in rulesets}
+    try:
+        for document, index, multiple in iter_activity_documents(data_file):
+            schema.validate(document)
+            for error in lxml_errors_generator(schema.error_log):
+                # Errors in the root element are the same for every activity
+                if index and not ACTIVITY_PATH_RE.match(error['path']):
+                    continue
+                if multiple:
+                    error['path'] = activity_error_path(error['path'], index)
+                yield error
+
+            for ruleset in list(ruleset_errors):
+                try:
+                    errors = run_ruleset(ruleset, document.getroottree())
+                except Exception as err:
+                    futures[ruleset].set_exception(err)
+                    del ruleset_errors[ruleset]
+                    continue
+                if multiple:
+                    for error in errors:
+                        error['path'] = activity_error_path(error['path'], index)
+                ruleset_errors[ruleset].extend(errors)
+    except (lxml.etree.XMLSyntaxError, UnicodeDecodeError) as err:
+        raise xml_input_error(err)
+
+    for ruleset, errors in ruleset_errors.items():
+        futures[ruleset].set_result(errors)
+
+
 def lxml_errors_generator(schema_error_log):
     '''Yield dict with lxml error path and message
 
@@ -179,57 +272,49 @@ def format_lxml_errors(lxml_errors):
         yield {'path': path, 'message': message, 'value': value}
 
 
-def get_zero_paths_list(cell_path):
-    '''Get all combinations of zeroes removed/not removed in a cell source path
-
-    Returns a list. The list doesn't include the original path.
+def get_cell_path_index(cell_source_map):
+    '''Return the paths of ``cell_source_map`` grouped by zero_index_key, in the same order
 
-    e.g:
-        'path/0/to/1/cell/0/source' will produce:
-
-        ['path/1/to/1/cell/0/source',
-         'path/0/to/1/cell/1/source',
-         'path/to/1/cell/source']
+    A SourceMap has them indexed already, so None is returned for it.
     '''
-    cell_zero_indexes, cell_zero_combinations, zero_paths_list = [], [], []
-    cell_path_chars = cell_path.split('/')
-
-    for index, char in enumerate(cell_path_chars):
-        if char == '0':
-            cell_zero_indexes.append(index)
-
-    n_zeros = len(cell_zero_indexes)
-    for i in range(1, 2 ** n_zeros):
-        cell_zero_combinations.append(bin(i)[2:].zfill(n_zeros))
-
-    for bin_repr in cell_zero_combinations:
-        for index_bit in zip(cell_zero_indexes, bin_repr):
-            if index_bit[1] == '0':
-                cell_path_chars[index_bit[0]] = '0'
-            else:
-                cell_path_chars[index_bit[0]] = None
-        path = '/'.join(filter(bool, cell_path_chars))
-        zero_paths_list.append(path)
-
-    return zero_paths_list
+    if isinstance(cell_source_map, SourceMap):
+        return None
+    cell_path_index = {}
+    for cell_path in cell_source_map:
+        cell_path_index.setdefault(zero_index_key(cell_path), []).append(cell_path)
+    return cell_path_index
+
+
+def has_missing_zeros(error_path, cell_path):
+    '''Whether ``error_path`` is ``cell_path`` with none, some or all of its 0 indexes left out'''
+    error_parts = error_path.split('/')
+    num = 0
+    for part in cell_path.split('/'):
+        if num < len(error_parts) and error_parts[num] == part:
+            num += 1
+        elif part != '0':
+            return False
+    return num == len(error_parts)
+
+
+def find_cell_path(error_path, cell_source_map, cell_path_index):
+    '''Return the path of the cell of ``cell_source_map`` that ``error_path`` comes from, None if there isn't one'''
+    if error_path in cell_source_map:
+        return error_path
+    key = zero_index_key(error_path)
+    if cell_path_index is None:
+        cell_paths = cell_source_map.get_zero_index_paths(key)
+    else:
+        cell_paths = cell_path_index.get(key, [])
+    for cell_path in cell_paths:
+        if has_missing_zeros(error_path, cell_path):
+            return cell_path
+    return None
 
 
-def error_path_source(error, cell_source_paths, cell_source_map, missing_zeros=False):
+def error_path_source(error, cell_path, cell_source_map):
     source = {}
-    found_path = None
-
-    if missing_zeros:
-        for cell_path in cell_source_paths:
-            if error['path'] in get_zero_paths_list(cell_path):
-                found_path = cell_path
-                break
-    else:
-        for cell_path in cell_source_paths:
-            if cell_path == error['path']:
-                found_path = cell_path
-                break
-
-    if found_path:
+    if cell_path:
         if len(cell_source_map[cell_path][0]) > 2:
             source = {
                 'sheet': cell_source_map[cell_path][0][0],
@@ -250,59 +335,22 @@ def error_path_source(error, cell_source_paths, cell_source_map, missing_zeros=F
     return source
 
 
-def get_xml_validation_errors(errors, file_type, cell_source_map):
-    validation_errors = {}
+def get_xml_validation_errors(errors, file_type, cell_source_map, error_store=None):
+    if error_store is None:
+        error_store = ErrorStore()
     if file_type != 'xml':
-        cell_source_map_paths = {}
-        for cell_path in cell_source_map.keys():
-            generic_cell_path = re.sub(r'/\d+', '', cell_path)
-            if cell_source_map_paths.get(generic_cell_path):
-                cell_source_map_paths[generic_cell_path].append(cell_path)
-            else:
-                cell_source_map_paths[generic_cell_path] = [cell_path]
+        cell_path_index = get_cell_path_index(cell_source_map)
 
     for error in errors:
         validation_key = json.dumps({'message': error['message']}, sort_keys=True)
-        if not validation_errors.get(validation_key):
-            validation_errors[validation_key] = []
 
         if file_type != 'xml':
-            generic_error_path = re.sub(r'/\d+', '', error['path'])
-            cell_paths = cell_source_map_paths.get(generic_error_path, [])
-            source = error_path_source(error, cell_paths, cell_source_map)
-            if source:
-                validation_errors[validation_key].append(source)
-            else:
-                source = error_path_source(error, cell_paths, cell_source_map, missing_zeros=True)
-                validation_errors[validation_key].append(source)
+            cell_path = find_cell_path(error['path'], cell_source_map, cell_path_index)
+            error_store.add(validation_key, error_path_source(error, cell_path, cell_source_map))
         else:
-            validation_errors[validation_key].append({'path': error['path'], 'value': error['value']})
-
-    return validation_errors
-
-
-def format_ruleset_errors(output_dir):
-    ruleset_errors = []
-
-    for output_file in os.listdir(output_dir):
-        with open(os.path.join(output_dir, output_file)) as fp:
-            scenario_outline = ' '.join(re.sub('\.', '/', output_file[:-7]).split('_'))
-            for line in fp:
-                line = line.strip()
+            error_store.add(validation_key, {'path': error['path'], 'value': error['value']})
 
-                if line:
-                    json_line = json.loads(line)
-                    for error in json_line['errors']:
-                        rule_error = {
-                            'id': json_line['id'],
-                            'path': error['path'],
-                            'rule': scenario_outline,
-                            'explanation': error['explanation'],
-                            'ruleset': json_line['ruleset']
-                        }
-                        ruleset_errors.append(rule_error)
-
-    return ruleset_errors
+    return error_store.samples
 
 
 def _ruleset_errors_by_rule(flat_errors):
@@ -331,42 +379,38 @@ def _ruleset_errors_by_activity(flat_errors):
     return ruleset_errors
 
 
-@ignore_errors
-def get_iati_ruleset_errors(lxml_etree, output_dir, group_by='rule', api=False):
-    if group_by not in ['rule', 'activity']:
-        raise ValueError('Only `rule` or `activity` are valid values for group_by argument')
-
-    bdd_tester(etree=lxml_etree, features=['cove_iati/rulesets/iati_standard_v2_ruleset/'],
-               output_path=output_dir)
-
-    if not os.path.isdir(output_dir):
+def format_ruleset_errors(flat_errors, group_by='rule', api=False):
+    '''Return the errors of a ruleset as a flat list for the API, or grouped by rule or by activity'''
+    if not flat_errors:
         return []
     if api:
-        return format_ruleset_errors(output_dir)
+        return flat_errors
     if group_by == 'rule':
-        return _ruleset_errors_by_rule(format_ruleset_errors(output_dir))
+        return _ruleset_errors_by_rule(flat_errors)
     else:
-        return _ruleset_errors_by_activity(format_ruleset_errors(output_dir))
+        return _ruleset_errors_by_activity(flat_errors)
 
 
 @ignore_errors
-def get_openag_ruleset_errors(lxml_etree, output_dir):
-    bdd_tester(etree=lxml_etree, features=['cove_iati/rulesets/iati_openag_ruleset/'],
-               output_path=output_dir)
+def _get_ruleset_result(future):
+    return future.result()
 
-    if not os.path.isdir(output_dir):
-        return []
-    return format_ruleset_errors(output_dir)
+
+@ignore_errors
+def get_iati_ruleset_errors(lxml_etree, group_by='rule', api=False):
+    if group_by not in ['rule', 'activity']:
+        raise ValueError('Only `rule` or `activity` are valid values for group_by argument')
+    return format_ruleset_errors(run_ruleset(STANDARD_RULESET, lxml_etree), group_by=group_by, api=api)
 
 
 @ignore_errors
-def get_orgids_ruleset_errors(lxml_etree, output_dir):
-    bdd_tester(etree=lxml_etree, features=['cove_iati/rulesets/iati_orgids_ruleset/'],
-               output_path=output_dir)
+def get_openag_ruleset_errors(lxml_etree):
+    return run_ruleset(OPENAG_RULESET, lxml_etree)
 
-    if not os.path.isdir(output_dir):
-        return []
-    return format_ruleset_errors(output_dir)
+
+@ignore_errors
+def get_orgids_ruleset_errors(lxml_etree):
+    return run_ruleset(ORGIDS_RULESET, lxml_etree)
 
 
 def get_file_type(file):
@@ -0,0 +1,164 @@
+'''Check IATI activities against the rulesets in cove_iati/rulesets.
+
+A ruleset is a directory of Gherkin ``.feature`` files, where each scenario is
+a rule, and of the definitions of their steps in ``steps/*.py`` (registered
+with the ``given`` and ``then`` decorators of cove_iati.rulesets.utils).
+Each ruleset is compiled once per process into Rule objects, which are run
+directly on the parsed XML: every rule is checked against each activity, and
+the first step raising a RuleSetStepException gives the errors of the rule
+for that activity. Like a failing scenario with behave, a step raising any
+other exception (e.g. on an empty element) is logged and skips only that rule
+for that activity.
+'''
+import functools
+import glob
+import importlib
+import logging
+import os
+import re
+
+from cove.lib.common import get_orgids_prefixes
+from cove_iati.lib.exceptions import RuleSetStepException
+from cove_iati.rulesets import utils
+
+
+RULESETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'rulesets')
+STANDARD_RULESET = 'iati_standard_v2_ruleset'
+OPENAG_RULESET = 'iati_openag_ruleset'
+ORGIDS_RULESET = 'iati_orgids_ruleset'
+
+STEP_KEYWORDS = {'Given': 'given', 'When': 'given', 'Then': 'then'}
+CONTINUATION_KEYWORDS = ('And', 'But')
+
+logger = logging.getLogger(__name__)
+
+
+class Feature():
+    def __init__(self, name):
+        self.name = name
+
+
+class Context():
+    '''What the steps of a rule know about the activity being checked'''
+    def __init__(self, xml, feature):
+        self.xml = xml
+        self.feature = feature
+        self.xpath_expression = None
+
+
+class Rule():
+    def __init__(self, feature, name, steps):
+        self.feature = feature
+        # Rule names are in lower case, with / for the paths that the feature files write with dots
+        self.name = name.lower().replace('.', '/')
+        self.steps = steps
+
+    def check(self, activity):
+        '''Return the errors of ``activity`` for this rule, none if the rule can't be checked'''
+        context = Context(activity, self.feature)
+        for func, kwargs in self.steps:
+            try:
+                func(context, **kwargs)
+            except RuleSetStepException as e:
+                return [{
+                    'id': e.id,
+                    'path': error['path'],
+                    'rule': self.name,
+                    'explanation': error['explanation'],
+                    'ruleset': e.feature_name
+                } for error in e.errors]
+            except Exception:
+                logger.warning('Could not check the rule "%s" on the activity %s (line %s)', self.name,
+                               activity.findtext('iati-identifier'), activity.sourceline, exc_info=True)
+                return []
+        return []
+
+
+def _compile_step_pattern(pattern):
+    '''Return a regex matching the steps of ``pattern``, with a named group for each ``{name}``'''
+    parts = re.split(r'\{(\w+)\}', pattern)
+    regex = ''.join(re.escape(part) if num % 2 == 0 else '(?P<{}>.+?)'.format(part)
+                    for num, part in enumerate(parts))
+    return re.compile('^{}$'.format(regex))
+
+
+def _get_step_definitions(modules):
+    step_definitions = {'given': [], 'then': []}
+    for module in modules:
+        for value in vars(module).values():
+            step_type = getattr(value, 'step_type', None)
+            if step_type in step_definitions:
+                step_definitions[step_type].append((_compile_step_pattern(value.step_pattern), value))
+    return step_definitions
+
+
+def _match_step(step_definitions, step_type, text, path):
+    for regex, func in step_definitions[step_type]:
+        match = regex.match(text)
+        if match:
+            return func, match.groupdict()
+    raise ValueError('{}: no definition for the {} step "{}"'.format(path, step_type, text))
+
+
+def _parse_feature(path, step_definitions):
+    '''Return the rules of the feature file at ``path``'''
+    feature = None
+    rules = []
+    step_type = None
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith(('#', '@')):
+                continue
+            keyword, _, text = line.partition(' ')
+            if line.startswith('Feature:'):
+                feature = Feature(line[len('Feature:'):].strip())
+            elif line.startswith(('Scenario:', 'Scenario Outline:')) and feature:
+                rules.append(Rule(feature, line.split(':', 1)[1].strip(), []))
+                step_type = 'given'
+            elif keyword in STEP_KEYWORDS and rules:
+                step_type = STEP_KEYWORDS[keyword]
+                rules[-1].steps.append(_match_step(step_definitions, step_type, text.strip(), path))
+            elif keyword in CONTINUATION_KEYWORDS and rules and rules[-1].steps:
+                rules[-1].steps.append(_match_step(step_definitions, step_type, text.strip(), path))
+            else:
+                raise ValueError('{}: could not parse "{}"'.format(path, line))
+    return rules
+
+
+@functools.lru_cache()
+def get_ruleset(name):
+    '''Return the rules of the ruleset ``name``, a directory of cove_iati/rulesets'''
+    directory = os.path.join(RULESETS_DIR, name)
+    modules = [utils]
+    for path in sorted(glob.glob(os.path.join(directory, 'steps', '*.py'))):
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        modules.append(importlib.import_module('cove_iati.rulesets.{}.steps.{}'.format(name, module_name)))
+    step_definitions = _get_step_definitions(modules)
+
+    rules = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.feature'))):
+        rules.extend(_parse_feature(path, step_definitions))
+    return rules
+
+
+def warm_up(names=(STANDARD_RULESET,)):
+    '''Compile the rulesets ``names`` and load the data they use, e.g. before forking worker processes'''
+    for name in names:
+        try:
+            get_ruleset(name)
+            if name == ORGIDS_RULESET:
+                get_orgids_prefixes()
+        except Exception:
+            # The ruleset is compiled again when needed
+            logger.exception('Could not compile the %s ruleset', name)
+
+
+def run_ruleset(name, lxml_etree):
+    '''Return the errors of all the activities of ``lxml_etree`` (a parsed XML document) for the ruleset ``name``'''
+    rules = get_ruleset(name)
+    errors = []
+    for activity in lxml_etree.getroot().iterfind('iati-activity'):
+        for rule in rules:
+            errors.extend(rule.check(activity))
+    return errors
@@ -1,13 +1,40 @@
+import logging
 import os
+import threading
 from urllib.parse import urljoin
 
-import requests
+import defusedxml.lxml as etree
+import lxml.etree
 from django.conf import settings
 
+from cove.lib.registry import schema_registry
+
 config = settings.COVE_CONFIG
 
 current_dir = os.path.dirname(os.path.realpath(__file__))
 
+logger = logging.getLogger(__name__)
+
+
+def _compile_xml_schema(path):
+    with open(path, 'rb') as schema_fp:
+        return lxml.etree.XMLSchema(etree.parse(schema_fp))
+
+
+def warm_up(versions=None):
+    '''Download and compile the schemas of ``versions`` (the default version by default).
+
+    Call it when a process starts, so that the first request doesn't pay for it.
+    '''
+    for version in versions or [SchemaIATI.default_version]:
+        try:
+            schema_iati = SchemaIATI(version)
+            schema_iati.get_activity_xml_schema()
+            schema_iati.get_organization_xml_schema()
+        except Exception:
+            # The schemas are loaded again when needed, don't stop the process from starting
+            logger.exception('Could not load the IATI %s schemas', version)
+
 
 class SchemaIATI():
     default_schema_host = config['schema_host']
@@ -23,15 +50,34 @@ class SchemaIATI():
         self.schema_directory = os.path.join(current_dir, '../../', config['app_name'], config['schema_directory'], self.version)
 
         if not os.path.isdir(self.schema_directory):
-            os.makedirs(self.schema_directory)
-
+            # Download all the schemas first, not to leave a partial schema directory behind
+            xml_texts = {}
             for filename in [self.activity_schema_name, self.organization_schema_name,
                              self.common_schema_name, self.xml_schema_name]:
+                response = schema_registry.get(urljoin(self.schema_host, filename))
+                response.raise_for_status()
+                xml_texts[filename] = response.text
+
+            os.makedirs(self.schema_directory, exist_ok=True)
+            for filename, xml_text in xml_texts.items():
                 with open(os.path.join(self.schema_directory, filename), 'w') as schema_file:
-                    schema_file_url = urljoin(self.schema_host, filename)
-                    xml_text = requests.get(schema_file_url).text
                     schema_file.write(xml_text)
 
         self.activity_schema = os.path.join(self.schema_directory, self.activity_schema_name)
         self.organization_schema = os.path.join(self.schema_directory, self.organization_schema_name)
         self.common_schema = os.path.join(self.schema_directory, self.common_schema_name)
+
+    def _get_xml_schema(self, path):
+        '''Return the compiled XMLSchema of the file at ``path``, from the schema registry.
+
+        A XMLSchema keeps the error log of the last validation, so each thread
+        gets its own.
+        '''
+        return schema_registry.get_object(('iati_xml_schema', threading.get_ident(), path),
+                                          lambda: _compile_xml_schema(path))
+
+    def get_activity_xml_schema(self):
+        return self._get_xml_schema(self.activity_schema)
+
+    def get_organization_xml_schema(self):
+        return self._get_xml_schema(self.organization_schema)
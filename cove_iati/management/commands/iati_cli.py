@@ -1,15 +1,39 @@
 import json
 import os
 import sys
+from collections import OrderedDict
 
 
 from cove.lib.exceptions import CoveInputDataError
 from cove.management.commands.base_command import CoveBaseCommand, SetEncoder
-from cove_iati.lib.api import APIException, iati_json_output
+
+
+RULESET_ERRORS_KEYS = ('ruleset_errors', 'ruleset_errors_openag', 'ruleset_errors_orgids')
+
+# The libraries checking the data are imported when used, so that e.g. --help is fast
+
+
+def process_file(output_dir, file, options):
+    '''Return the results of a file of a batch'''
+    from cove_iati.lib.api import APIException, iati_json_output
+
+    try:
+        return iati_json_output(output_dir, file, openag=options['openag'], orgids=options['orgids'])
+    except CoveInputDataError as e:
+        raise APIException('Not well formed XML: %s' % str(e.context['error']))
+
+
+def count_errors(result):
+    '''Return the number of errors of each ruleset in the results of a file of a batch'''
+    return OrderedDict((key, len(result[key]) if isinstance(result[key], list) else None)
+                       for key in RULESET_ERRORS_KEYS if key in result)
 
 
 class Command(CoveBaseCommand):
     help = 'Run Command Line version of Cove IATI'
+    file_options = ('openag', 'orgids')
+    process_file = staticmethod(process_file)
+    count_errors = staticmethod(count_errors)
 
     def add_arguments(self, parser):
         parser.add_argument('--openag', '-a', action='store_true', help='Run ruleset checks for IATI OpenAg')
@@ -18,10 +42,17 @@ class Command(CoveBaseCommand):
         super(Command, self).add_arguments(parser)
 
     def handle(self, file, *args, **options):
-        super(Command, self).handle(file, *args, **options)
         openag = options.get('openag')
         orgids = options.get('orgids')
 
+        if options.get('batch'):
+            self.handle_batch(file, **options)
+            return
+
+        super(Command, self).handle(file, *args, **options)
+
+        from cove_iati.lib.api import APIException, iati_json_output
+
         try:
             result = iati_json_output(self.output_dir, file, openag=openag, orgids=orgids)
         except APIException as e:
@@ -33,3 +64,14 @@ class Command(CoveBaseCommand):
 
         with open(os.path.join(self.output_dir, "results.json"), 'w+') as result_file:
             json.dump(result, result_file, indent=2, cls=SetEncoder)
+
+    def warm_up(self, file_options=None):
+        from cove_iati.lib import rulesets, schema
+
+        schema.warm_up()
+        names = [rulesets.STANDARD_RULESET]
+        if file_options is None or file_options['openag']:
+            names.append(rulesets.OPENAG_RULESET)
+        if file_options is None or file_options['orgids']:
+            names.append(rulesets.ORGIDS_RULESET)
+        rulesets.warm_up(names)
@@ -1,9 +1,5 @@
-from behave import then
-
 from cove.lib.common import get_orgids_prefixes
-from cove_iati.rulesets.utils import get_child_full_xpath, get_xobjects, register_ruleset_errors
-
-ORGIDS_PREFIXES = get_orgids_prefixes()
+from cove_iati.rulesets.utils import get_child_full_xpath, get_xobjects, register_ruleset_errors, then
 
 
 @then('`{attribute}` id attribute must start with an org-ids prefix')
@@ -11,10 +7,11 @@ ORGIDS_PREFIXES = get_orgids_prefixes()
 def step_openag_org_id_prefix_expected(context, attribute):
     errors = []
     fail_msg = '@{} {} does not start with a recognised org-ids prefix'
+    orgids_prefixes = get_orgids_prefixes()
 
     for xpath in get_xobjects(context.xml, context.xpath_expression):
         attr_id = xpath.attrib.get(attribute, '')
-        for prefix in ORGIDS_PREFIXES:
+        for prefix in orgids_prefixes:
             if attr_id.startswith(prefix):
                 break
         else:
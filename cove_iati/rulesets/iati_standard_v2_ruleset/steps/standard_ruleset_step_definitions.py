@@ -7,24 +7,8 @@ from decimal import Decimal
 import datetime
 import re
 
-from behave import given, then
-
-from cove_iati.rulesets.utils import invalid_date_format, get_child_full_xpath, get_xobjects, register_ruleset_errors
-
-
-@given('an IATI activity')
-def step_given_iati_activity(context):
-    context.xpath_expression = '.'
-
-
-@given('`{xpath_expression}` organisations')
-def step_given_organisations(context, xpath_expression):
-    context.xpath_expression = xpath_expression
-
-
-@given('`{xpath_expression}` elements')
-def step_given_elements(context, xpath_expression):
-    context.xpath_expression = xpath_expression
+from cove_iati.rulesets.utils import (get_child_full_xpath, get_xobjects, invalid_date_format, register_ruleset_errors,
+                                     then)
 
 
 @then('`{xpath}` must be today or in the past')
@@ -1,9 +1,47 @@
 import datetime
-from functools import wraps
+from functools import lru_cache, wraps
+
+import lxml.etree
 
 from cove_iati.lib.exceptions import RuleSetStepException
 
 
+def _step_decorator(step_type):
+    def step(pattern):
+        '''Register the decorated function as the definition of the steps matching ``pattern``.
+
+        Each ``{name}`` in the pattern matches some text, passed to the function
+        as the keyword argument ``name`` after the context (see cove_iati.lib.rulesets).
+        '''
+        def decorator(func):
+            func.step_type = step_type
+            func.step_pattern = pattern
+            return func
+        return decorator
+    return step
+
+
+given = _step_decorator('given')
+then = _step_decorator('then')
+
+
+# Steps available to all the rulesets
+
+@given('an IATI activity')
+def step_given_iati_activity(context):
+    context.xpath_expression = '.'
+
+
+@given('`{xpath_expression}` organisations')
+def step_given_organisations(context, xpath_expression):
+    context.xpath_expression = xpath_expression
+
+
+@given('`{xpath_expression}` elements')
+def step_given_elements(context, xpath_expression):
+    context.xpath_expression = xpath_expression
+
+
 def invalid_date_format(date_str):
     try:
         datetime.datetime.strptime(date_str, '%Y-%m-%d')
@@ -23,15 +61,20 @@ def get_child_full_xpath(parent_xobj, child_xobj):
         return tree.getpath(child_xobj)
 
 
+@lru_cache(maxsize=1024)
+def _compile_xpath(xpath_expression, namespaces):
+    return lxml.etree.XPath(xpath_expression, namespaces=dict(namespaces))
+
+
 def get_xobjects(xobj, xpath_expression):
     '''Given a xpath, return a list of xml objects out of a parent xml object'''
     nsmap = xobj.getparent().nsmap
-    xobjects = xobj.xpath(xpath_expression, namespaces=nsmap)
+    xobjects = _compile_xpath(xpath_expression, tuple(nsmap.items()))(xobj)
     return xobjects
 
 
 def register_ruleset_errors(namespaces=None):
-    '''Raise a RuleSetStepException to register errors (bdd-tester/behave).
+    '''Raise a RuleSetStepException to register errors (see cove_iati.lib.rulesets).
 
     Also, check the date for the presence of declared namespaces required
     to apply the rule.
@@ -12,6 +12,17 @@ PIWIK = settings.PIWIK
 GOOGLE_ANALYTICS_ID = settings.GOOGLE_ANALYTICS_ID
 MEDIA_ROOT = settings.MEDIA_ROOT
 MEDIA_URL = settings.MEDIA_URL
+STREAM_XML_THRESHOLD = settings.STREAM_XML_THRESHOLD
+JOB_WORKERS = settings.JOB_WORKERS
+JOB_TIMEOUT = settings.JOB_TIMEOUT
+SCHEMA_CACHE_TTL = settings.SCHEMA_CACHE_TTL
+HTTP_CACHE_DIR = settings.HTTP_CACHE_DIR
+RESULT_CACHE_DIR = settings.RESULT_CACHE_DIR
+DOWNLOAD_MAX_SIZE = settings.DOWNLOAD_MAX_SIZE
+DOWNLOAD_TIMEOUT = settings.DOWNLOAD_TIMEOUT
+VALIDATION_WORKERS = settings.VALIDATION_WORKERS
+VALIDATION_ERROR_SAMPLES = settings.VALIDATION_ERROR_SAMPLES
+VALIDATION_ERROR_RESERVOIR = settings.VALIDATION_ERROR_RESERVOIR
 DEALER_TYPE = settings.DEALER_TYPE
 SECRET_KEY = settings.SECRET_KEY
 DEBUG = settings.DEBUG
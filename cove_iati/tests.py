@@ -1,14 +1,31 @@
 import pytest
 import defusedxml.lxml as etree
+import http.client
 import json
 import lxml.etree
 import os
+import socket
+import subprocess
+import sys
+import threading
 import uuid
 
+from django.conf import settings
+from django.core.files.base import ContentFile
 from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+
+from cove.input.models import SuppliedData
+from cove.lib.exceptions import CoveInputDataError
+from cove.lib.source_map import get_source_maps
+from cove.management.commands.serve_api import ValidationAPI, make_server
 
 from .lib import iati
+from .lib.api import iati_json_output
 from .lib.exceptions import RuleSetStepException
+from .lib.rulesets import OPENAG_RULESET, STANDARD_RULESET, Feature, Rule, get_ruleset, run_ruleset
+from .lib.schema import SchemaIATI
 from .rulesets.utils import invalid_date_format, get_child_full_xpath, get_xobjects, register_ruleset_errors
 
 
@@ -179,20 +196,24 @@ def test_register_ruleset_errors_decorator():
     ('basic_iati_unordered_invalid_iso_dates.xlsx', False, {}, [
         'basic_iati_unordered_invalid_iso_dates.xlsx',
         'results.json',
-        'unflattened.xml'
+        'unflattened.xml',
+        'validation_errors_full.jsonl'
     ]),
     ('basic_iati_unordered_invalid_iso_dates.xlsx', False, {'exclude_file': True}, [
         'results.json',
-        'unflattened.xml'
+        'unflattened.xml',
+        'validation_errors_full.jsonl'
     ]),
     ('basic_iati_unordered_valid.csv', False, {}, [
         'basic_iati_unordered_valid.csv',
         'results.json',
-        'unflattened.xml'
+        'unflattened.xml',
+        'validation_errors_full.jsonl'
     ]),
     ('basic_iati_ruleset_errors.xml', False, {}, [
         'basic_iati_ruleset_errors.xml',
-        'results.json'
+        'results.json',
+        'validation_errors_full.jsonl'
     ]),
     ('bad.xml', True, {}, ['bad.xml']),
 ])
@@ -220,6 +241,121 @@ def test_cove_iati_cli_delete_option():
             call_command('iati_cli', file_path, output_dir=output_dir)
 
 
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_cove_iati_cli_batch(tmpdir, jobs):
+    for file_name in ('basic_iati_ruleset_errors.xml', 'basic_iati_unordered_valid.csv', 'bad.xml'):
+        tmpdir.join(file_name).write_binary(open(os.path.join('cove_iati', 'fixtures', file_name), 'rb').read())
+    output_dir = os.path.join('media', str(uuid.uuid4()))
+
+    with pytest.raises(SystemExit):
+        call_command('iati_cli', str(tmpdir), batch=True, output_dir=output_dir, openag=True, jobs=jobs)
+    assert sorted(os.listdir(output_dir)) == [
+        'bad', 'basic_iati_ruleset_errors', 'basic_iati_unordered_valid', 'summary.csv', 'summary.jsonl']
+
+    with open(os.path.join(output_dir, 'summary.jsonl')) as fp:
+        report = {os.path.basename(row['file']): row for row in map(json.loads, fp)}
+    assert report['bad.xml']['status'] == 'error'
+    assert report['bad.xml']['message'].startswith('Not well formed XML')
+    assert report['basic_iati_ruleset_errors.xml']['status'] == 'ok'
+    assert report['basic_iati_ruleset_errors.xml']['ruleset_errors'] > 0
+    assert report['basic_iati_ruleset_errors.xml']['ruleset_errors_openag'] > 0
+    assert report['basic_iati_unordered_valid.csv']['status'] == 'ok'
+
+    with open(os.path.join(output_dir, 'basic_iati_ruleset_errors', 'results.json')) as fp:
+        results = json.load(fp)
+    assert len(results['validation_errors']) == report['basic_iati_ruleset_errors.xml']['validation_errors']
+    assert len(results['ruleset_errors']) == report['basic_iati_ruleset_errors.xml']['ruleset_errors']
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+@pytest.mark.parametrize('unix_socket', [False, True])
+def test_serve_api(tmpdir, unix_socket):
+    socket_path = str(tmpdir.join('cove.sock')) if unix_socket else None
+    server = make_server(ValidationAPI('cove_iati', 'iati_cli', allow_local_paths=True), socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def request(method, url, body=None, **kwargs):
+        if unix_socket:
+            connection = UnixHTTPConnection(socket_path)
+        else:
+            connection = http.client.HTTPConnection(*server.server_address)
+        connection.request(method, url, body, **kwargs)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read().decode('utf-8'))
+        connection.close()
+        return result
+
+    try:
+        assert request('GET', '/') == (200, {'app': 'cove_iati', 'command': 'iati_cli', 'options': ['openag', 'orgids']})
+
+        file_path = os.path.join('cove_iati', 'fixtures', 'basic_iati_ruleset_errors.xml')
+        output_dir = str(tmpdir.join('expected'))
+        os.mkdir(output_dir)
+        expected = json.loads(json.dumps(iati_json_output(output_dir, file_path, openag=True)))
+
+        with open(file_path, 'rb') as fp:
+            status, results = request('POST', '/validate?name=data.xml&openag=true', fp.read())
+        assert status == 200
+        assert results == expected
+        assert request('POST', '/validate?path={}&openag=1'.format(file_path)) == (200, expected)
+
+        output_dir = str(tmpdir.join('output'))
+        with open(os.path.join('cove_iati', 'fixtures', 'basic_iati_unordered_valid.csv'), 'rb') as fp:
+            status, results = request('POST', '/validate?name=data.csv&output_dir={}'.format(output_dir), fp.read())
+        assert status == 200
+        assert 'unflattened.xml' in os.listdir(output_dir)
+
+        status, results = request('POST', '/validate?name=bad.xml', b'<bad')
+        assert status == 400
+        assert results['error'].startswith('Not well formed XML')
+        assert request('POST', '/validate?name=data.xml&unknown=1', b'')[0] == 400
+        assert request('POST', '/validate', b'')[0] == 400
+        assert request('GET', '/validate')[0] == 404
+        # Chunked, without a Content-Length
+        assert request('POST', '/validate?name=data.xml', iter([b'<iati-activities/>']), encode_chunked=True)[0] == 411
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_serve_api_local_paths(tmpdir):
+    api = ValidationAPI('cove_iati', 'iati_cli')
+    file_path = os.path.join('cove_iati', 'fixtures', 'basic_iati_ruleset_errors.xml')
+    with pytest.raises(CommandError):
+        api.validate({'path': file_path}, None)
+    with pytest.raises(CommandError):
+        api.validate({'name': 'data.xml', 'output_dir': str(tmpdir)}, None)
+    assert os.listdir(str(tmpdir)) == []
+    assert api.get_file_options({})['cache_schema'] is False
+
+    with pytest.raises(CommandError) as excinfo:
+        call_command('serve_api', allow_local_paths=True, host='0.0.0.0')
+    assert 'localhost' in str(excinfo.value)
+
+
+def test_iati_cli_startup_imports():
+    '''iati-cli --help doesn't import the libraries checking the data'''
+    code = ("import sys, django; django.setup(); "
+            "from django.core.management import load_command_class; "
+            "load_command_class('cove_iati', 'iati_cli').create_parser('iati-cli', 'iati_cli').format_help(); "
+            "print(' '.join(sys.modules))")
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+    modules = subprocess.check_output([sys.executable, '-c', code], env=env).decode('utf-8').split()
+    for module in ('cove_iati.lib.api', 'cove.lib.common', 'flattentool', 'openpyxl', 'lxml', 'requests', 'raven'):
+        assert module not in modules
+
+
 def test_cove_iati_cli_output():
     exp_validation = [{'description': "'activity-date', attribute 'iso-date' is not a valid value of "
                                       "the atomic type 'xs:date'.",
@@ -474,16 +610,78 @@ def test_cove_iati_cli_openag_output():
         assert expected['rule'] == actual['rule']
 
 
+def test_get_ruleset():
+    rules = get_ruleset(STANDARD_RULESET)
+    assert len(rules) == 23
+    assert get_ruleset(STANDARD_RULESET) is rules
+
+    rules = {rule.name: rule for rule in get_ruleset(OPENAG_RULESET)}
+    assert len(rules) == 8
+    rule = rules['tag/@vocabulary must be present with a code for "maintained by the reporting organisation"']
+    assert rule.feature.name == 'tag element is expected and must contain specific attributes'
+    assert [kwargs for func, kwargs in rule.steps] == [
+        {'xpath_expression': 'tag'},
+        {'attribute': 'vocabulary'},
+        {'attribute': 'vocabulary', 'any_value': '1 or 98 or 99'}
+    ]
+
+
+def test_rule_check_step_error(caplog):
+    def failing_step(context):
+        raise KeyError('a')
+
+    def passing_step(context):
+        pass
+
+    activity = lxml.etree.fromstring(
+        '<iati-activities><iati-activity><iati-identifier>a</iati-identifier></iati-activity></iati-activities>')[0]
+    rule = Rule(Feature('feature'), 'a.b', [(passing_step, {}), (failing_step, {})])
+    assert rule.check(activity) == []
+    assert 'Could not check the rule "a/b" on the activity a (line 1)' in caplog.text
+
+
+def test_run_ruleset_step_errors():
+    # The empty iati-identifier breaks the identifier rule, the other rules of its activity still report
+    tree = lxml.etree.ElementTree(lxml.etree.fromstring('''<iati-activities version="2.03">
+      <iati-activity>
+        <iati-identifier/>
+        <reporting-org ref="AA/1"/>
+        <activity-date type="2" iso-date="2100-01-01"/>
+      </iati-activity>
+      <iati-activity>
+        <iati-identifier>AA/2</iati-identifier>
+      </iati-activity>
+    </iati-activities>'''))
+    errors = run_ruleset(STANDARD_RULESET, tree)
+
+    rules = {(error['path'].split('/')[2], error['rule']) for error in errors}
+    assert ('iati-activity[1]', 'reporting-org/@ref should match the regex [^\\:\\&\\|\\?]+') in rules
+    assert ('iati-activity[1]', "activity-date[@type='2']/@iso-date must be today or in the past") in rules
+    assert ('iati-activity[2]', 'identifier/text() should match the regex [^\\:\\&\\|\\?]+') in rules
+    assert ('iati-activity[1]', 'identifier/text() should match the regex [^\\:\\&\\|\\?]+') not in rules
+
+
+def test_run_ruleset_default_namespace():
+    activity = '<iati-activity{}><iati-identifier>AA/1</iati-identifier></iati-activity>'
+    # Activities in a namespace aren't IATI activities
+    tree = lxml.etree.ElementTree(lxml.etree.fromstring(
+        '<iati-activities xmlns="urn:example">{}</iati-activities>'.format(activity.format(''))))
+    assert run_ruleset(STANDARD_RULESET, tree) == []
+
+    # XPath has no default namespace: the rules can't be checked, like with behave
+    tree = lxml.etree.ElementTree(lxml.etree.fromstring(
+        '<iati-activities xmlns="urn:example">{}</iati-activities>'.format(activity.format(' xmlns=""'))))
+    assert run_ruleset(STANDARD_RULESET, tree) == []
+
+
 def test_ruleset_error_exceptions_handling(validated_data):
     return_on_error = [{'message': 'There was a problem running ruleset checks', 'exception': True}]
 
     file_path = os.path.join('cove_iati', 'fixtures', 'basic_iati_unordered_valid.xml')
     with open(file_path) as fp:
         valid_data_tree = etree.parse(fp)
-    upload_dir = os.path.join('media', str(uuid.uuid4()))
     ruleset_errors = iati.get_iati_ruleset_errors(
         valid_data_tree,
-        os.path.join(upload_dir, 'ruleset'),
         ignore_errors=False,
         return_on_error=return_on_error
     )
@@ -493,20 +691,16 @@ def test_ruleset_error_exceptions_handling(validated_data):
     with open(file_path) as fp:
         invalid_data_tree = etree.parse(fp)
     invalid_data_tree = etree.fromstring(INVALID_DATA)
-    upload_dir = os.path.join('media', str(uuid.uuid4()))
     ruleset_errors = iati.get_iati_ruleset_errors(
         invalid_data_tree,  # Causes an exception in ruleset checks
-        os.path.join(upload_dir, 'ruleset'),
         ignore_errors=True,  # Exception ignored
         return_on_error=return_on_error
     )
     assert ruleset_errors == return_on_error
 
     with pytest.raises(AttributeError):
-        upload_dir = os.path.join('media', str(uuid.uuid4()))
         ruleset_errors = iati.get_iati_ruleset_errors(
             invalid_data_tree,  # Causes an exception in ruleset checks
-            os.path.join(upload_dir, 'ruleset'),
             ignore_errors=False,  # Exception not ignored
             return_on_error=return_on_error
         )
@@ -524,6 +718,128 @@ def test_common_checks_context_iati_ruleset():
     assert len(context['ruleset_errors']) == 17
 
 
+def test_schema_iati_xml_schema_cached():
+    schema = SchemaIATI().get_activity_xml_schema()
+    assert SchemaIATI().get_activity_xml_schema() is schema
+    assert SchemaIATI().get_organization_xml_schema() is not schema
+
+    with open(os.path.join('cove_iati', 'fixtures', 'basic_iati_unordered_valid.xml'), 'rb') as fp:
+        assert schema.validate(etree.parse(fp))
+    with open(os.path.join('cove_iati', 'fixtures', 'basic_iati_ruleset_errors.xml'), 'rb') as fp:
+        assert not schema.validate(etree.parse(fp))
+
+
+def test_common_checks_context_iati_ruleset_run_once(monkeypatch, tmpdir):
+    run_ruleset = iati.run_ruleset
+    runs = []
+
+    def counted_run_ruleset(name, lxml_etree):
+        runs.append(name)
+        return run_ruleset(name, lxml_etree)
+
+    monkeypatch.setattr(iati, 'run_ruleset', counted_run_ruleset)
+    file_path = os.path.join('cove_iati', 'fixtures', 'basic_iati_ruleset_errors.xml')
+    context = iati.common_checks_context_iati({}, str(tmpdir), file_path, 'xml', openag=True)
+
+    assert sorted(runs) == sorted([STANDARD_RULESET, OPENAG_RULESET])
+    assert context['ruleset_errors_count'] == 17
+    ruleset_errors_by_rule, ruleset_errors_by_activity = context['ruleset_errors']
+    assert sum(len(errors) for rules in ruleset_errors_by_rule.values() for errors in rules.values()) == 17
+    assert sum(len(errors) for rulesets in ruleset_errors_by_activity.values()
+               for errors in rulesets.values()) == 17
+    assert context['ruleset_errors_openag']
+
+
+@pytest.mark.parametrize(('error_path', 'cell_path'), [
+    ('iati-activity/0/sector/0/@code', 'iati-activity/0/sector/0/@code'),
+    ('iati-activity/sector/@code', 'iati-activity/0/sector/0/@code'),
+    ('iati-activity/0/sector/@code', 'iati-activity/0/sector/0/@code'),
+    ('iati-activity/sector/1/@code', 'iati-activity/0/sector/1/@code'),
+    ('iati-activity/1/sector/@code', 'iati-activity/1/sector/0/@code'),
+    ('iati-activity/sector/2/@code', None),
+    ('iati-activity/sector/0/0/@code', None),
+    ('iati-activity/title', None),
+])
+def test_find_cell_path(tmpdir, error_path, cell_path):
+    cell_source_map = {
+        'iati-activity/0/sector/0/@code': [['Sheet1', 'A', 2, 'sector/0/@code']],
+        'iati-activity/0/sector/1/@code': [['Sheet1', 'B', 2, 'sector/1/@code']],
+        'iati-activity/1/sector/0/@code': [['Sheet1', 'A', 3, 'sector/0/@code']],
+    }
+    cell_path_index = iati.get_cell_path_index(cell_source_map)
+    assert iati.find_cell_path(error_path, cell_source_map, cell_path_index) == cell_path
+
+    tmpdir.join('cell_source_map.json').write(json.dumps(cell_source_map))
+    cell_source_map = get_source_maps(str(tmpdir))[0]
+    cell_path_index = iati.get_cell_path_index(cell_source_map)
+    assert iati.find_cell_path(error_path, cell_source_map, cell_path_index) == cell_path
+
+
+def test_iter_activity_documents():
+    file_path = os.path.join('cove_iati', 'fixtures', 'basic_iati_unordered_valid.xml')
+    documents = [(document.tag, [activity.tag for activity in document], index, multiple)
+                 for document, index, multiple in iati.iter_activity_documents(file_path)]
+    assert documents == [
+        ('iati-activities', ['iati-activity'], 0, True),
+        ('iati-activities', ['iati-activity'], 1, True),
+    ]
+
+    file_path = os.path.join('cove_iati', 'fixtures', 'example.xml')
+    assert [(index, multiple) for document, index, multiple in iati.iter_activity_documents(file_path)] == [
+        (0, False)]
+
+
+def test_activity_error_path():
+    assert iati.activity_error_path('/iati-activities/iati-activity/sector', 2) == (
+        '/iati-activities/iati-activity[3]/sector')
+    assert iati.activity_error_path('/iati-activities/iati-activity', 0) == '/iati-activities/iati-activity[1]'
+    assert iati.activity_error_path('/iati-activities/iati-activity/sector & /iati-activities/iati-activity/'
+                                    'transaction/sector', 0) == (
+        '/iati-activities/iati-activity[1]/sector & /iati-activities/iati-activity[1]/transaction/sector')
+    assert iati.activity_error_path('/iati-activities/@xmlns', 0) == '/iati-activities/@xmlns'
+    assert iati.activity_error_path('/iati-activities/iati-activity-x', 0) == '/iati-activities/iati-activity-x'
+
+
+@pytest.mark.parametrize('file_name', [
+    'basic_iati_ruleset_errors.xml',
+    'basic_iati_unordered_valid.xml',
+    'example.xml',
+    'iati_openag_tag.xml',
+])
+@pytest.mark.parametrize('api', [False, True])
+def test_common_checks_context_iati_stream(settings, tmpdir, file_name, api):
+    file_path = os.path.join('cove_iati', 'fixtures', file_name)
+    settings.STREAM_XML_THRESHOLD = 0
+    context = iati.common_checks_context_iati({}, str(tmpdir.mkdir('all')), file_path, 'xml', api=api, openag=True)
+    settings.STREAM_XML_THRESHOLD = 1
+    context_stream = iati.common_checks_context_iati({}, str(tmpdir.mkdir('stream')), file_path, 'xml', api=api,
+                                                     openag=True)
+
+    assert context_stream == context
+
+
+def test_common_checks_context_iati_stream_bad_xml(settings, tmpdir):
+    settings.STREAM_XML_THRESHOLD = 1
+    file_path = os.path.join('cove_iati', 'fixtures', 'bad.xml')
+    with pytest.raises(CoveInputDataError):
+        iati.common_checks_context_iati({}, str(tmpdir), file_path, 'xml')
+
+
+@pytest.mark.django_db
+def test_validation_errors_download(client):
+    data = SuppliedData.objects.create()
+    data.original_file.save('test.xml', ContentFile('<iati-activities/>'))
+    url = reverse('validation_errors_download', args=(data.pk,))
+    assert client.get(url).status_code == 404
+
+    with open(os.path.join(data.upload_dir(), 'validation_errors_full.jsonl'), 'w') as fp:
+        fp.write('{"error": {"message": "a"}, "value": {"path": "a"}}\n')
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp['Content-Disposition'] == 'attachment; filename="validation_errors.jsonl"'
+    assert b''.join(resp.streaming_content) == b'{"error": {"message": "a"}, "value": {"path": "a"}}\n'
+
+
 def test_post_api(client):
     file_path = os.path.join('cove_iati', 'fixtures', 'example.xml')
     resp = client.post('/api_test', {'file': open(file_path, 'rb'), 'name': 'example.xml'})
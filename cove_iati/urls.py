@@ -4,10 +4,13 @@ from cove.urls import urlpatterns, handler500  # noqa: F401
 from django.conf.urls.static import static
 from django.conf import settings
 
+import cove.views
 import cove_iati.views
 
 urlpatterns = [
     url(r'^$', cove_iati.views.data_input_iati, name='index'),
+    url(r'^data/(.+)/status$', cove.views.job_status, name='job_status'),
+    url(r'^data/(.+)/validation_errors$', cove.views.validation_errors_download, name='validation_errors_download'),
     url(r'^data/(.+)$', cove_iati.views.explore_iati, name='explore'),
     url(r'^api_test', cove_iati.views.api_test, name='api_test'),
 ] + urlpatterns
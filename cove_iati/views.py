@@ -14,7 +14,7 @@ from cove.lib.converters import convert_spreadsheet, convert_json
 from cove.lib.exceptions import cove_web_input_error
 from cove.input.models import SuppliedData
 from cove.input.views import data_input
-from cove.views import explore_data_context
+from cove.views import explore_data_context, explore_data_job
 from .lib.iati import common_checks_context_iati, get_file_type
 from .lib.api import iati_json_output
 from .lib.schema import SchemaIATI
@@ -69,7 +69,17 @@ def explore_iati(request, pk):
     if error:
         return error
 
+    options = {'flatten': request.POST.get('flatten')}
+    context, response = explore_data_job(request, db_data, context, explore_iati_context, options)
+    if response:
+        return response
+
+    return render(request, 'cove_iati/explore.html', context)
+
+
+def explore_iati_context(db_data, context, options):
     file_type = context['file_type']
+    db_data.set_job_stage('convert')
     if file_type != 'xml':
         schema_iati = SchemaIATI()
         context.update(convert_spreadsheet(db_data.upload_dir(), db_data.upload_url(), db_data.original_file.file.name,
@@ -81,15 +91,10 @@ def explore_iati(request, pk):
     else:
         data_file = db_data.original_file.file.name
         context.update(convert_json(db_data.upload_dir(), db_data.upload_url(), db_data.original_file.file.name,
-                       request=request, flatten=request.POST.get('flatten'), xml=True))
+                       flatten=options.get('flatten'), xml=True))
 
-    context = common_checks_context_iati(context, db_data.upload_dir(), data_file, file_type)
-    context['first_render'] = not db_data.rendered
-
-    if not db_data.rendered:
-        db_data.rendered = True
-
-    return render(request, 'cove_iati/explore.html', context)
+    db_data.set_job_stage('validate')
+    return common_checks_context_iati(context, db_data.upload_dir(), data_file, file_type)
 
 
 @require_POST
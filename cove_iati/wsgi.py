@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cove_iati.settings")
 
 application = get_wsgi_application()
+
+# Compile the IATI schemas when the application is loaded rather than on the first request
+from cove_iati.lib.schema import warm_up  # noqa: E402
+warm_up()
@@ -1,10 +1,15 @@
 import json
 import os
 
+from django.conf import settings
+
 from .schema import SchemaOCDS
 from .ocds import common_checks_ocds
 from cove.lib.common import get_spreadsheet_meta_data
 from cove.lib.converters import convert_spreadsheet, convert_json
+from cove.lib.error_store import FULL_ERRORS_FILE_NAME
+from cove.lib.source_map import SOURCE_MAPS_FILE_NAME
+from cove.lib.stream import load_json
 from cove.lib.tools import get_file_type
 
 
@@ -13,10 +18,18 @@ class APIException(Exception):
 
 
 def context_api_transform(context):
+    '''Return the API results from the context of the checks.
+
+    ``validation_errors`` only lists the sample errors of each group: the
+    number of errors of each group is in ``validation_error_counts``, and
+    when there are more errors than samples ``validation_errors_truncated`` is
+    set and ``validation_errors_full`` names the file listing all of them.
+    '''
     validation_errors = context.get('validation_errors')
     context['validation_errors'] = []
-
-    context.pop('validation_errors_count')
+    context['validation_error_counts'] = []
+    context['validation_errors_truncated'] = False
+    context['validation_errors_full'] = FULL_ERRORS_FILE_NAME if context.get('validation_errors_count') else None
 
     extensions = context.get('extensions')
     context['extensions'] = {}
@@ -33,6 +46,15 @@ def context_api_transform(context):
     if validation_errors:
         for error_group in validation_errors:
             error = json.loads(error_group[0])
+            count = error.get('count', len(error_group[1]))
+            context['validation_error_counts'].append({
+                'type': error['message_type'],
+                'field': error['path_no_number'],
+                'description': error['message'],
+                'count': count,
+            })
+            if count > len(error_group[1]):
+                context['validation_errors_truncated'] = True
             for path_value in error_group[1]:
                 context['validation_errors'].append({
                     'type': error['message_type'],
@@ -70,7 +92,8 @@ def context_api_transform(context):
     return context
 
 
-def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=False, file_type=None, json_data=None):
+def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=False, file_type=None, json_data=None,
+                     validation_workers=None):
     context = {}
     if not file_type:
         file_type = get_file_type(file)
@@ -78,11 +101,10 @@ def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=Fal
 
     if file_type == 'json':
         if not json_data:
-            with open(file, encoding='utf-8') as fp:
-                try:
-                    json_data = json.load(fp)
-                except ValueError:
-                    raise APIException('The file looks like invalid json')
+            try:
+                json_data = load_json(file, ('releases', 'records'), settings.STREAM_JSON_THRESHOLD, parse_float=float)
+            except ValueError:
+                raise APIException('The file looks like invalid json')
 
         schema_ocds = SchemaOCDS(schema_version, json_data, cache_schema=cache_schema)
 
@@ -90,7 +112,7 @@ def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=Fal
             msg = '\033[1;31mThe schema version in your data is not valid. Accepted values: {}\033[1;m'
             raise APIException(msg.format(str(list(schema_ocds.version_choices.keys()))))
         if schema_ocds.extensions:
-            schema_ocds.create_extended_release_schema_file(output_dir, "")
+            schema_ocds.create_extended_release_schema_file(output_dir, '', link=False)
 
         url = schema_ocds.extended_schema_file or schema_ocds.release_schema_url
 
@@ -108,7 +130,7 @@ def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=Fal
             msg = '\033[1;31mThe schema version in your data is not valid. Accepted values: {}\033[1;m'
             raise APIException(msg.format(str(list(schema_ocds.version_choices.keys()))))
         if schema_ocds.extensions:
-            schema_ocds.create_extended_release_schema_file(output_dir, '')
+            schema_ocds.create_extended_release_schema_file(output_dir, '', link=False)
 
         url = schema_ocds.extended_schema_file or schema_ocds.release_schema_url
         pkg_url = schema_ocds.release_pkg_schema_url
@@ -117,11 +139,12 @@ def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=Fal
             output_dir, '', file, file_type, schema_url=url, pkg_schema_url=pkg_url, cache=False)
         )
 
-        with open(context['converted_path'], encoding='utf-8') as fp:
-            json_data = json.load(fp)
+        json_data = load_json(context['converted_path'], ('releases', 'records'), settings.STREAM_JSON_THRESHOLD,
+                              parse_float=float)
 
     context = context_api_transform(
-        common_checks_ocds(context, output_dir, json_data, schema_ocds, api=True, cache=False)
+        common_checks_ocds(context, output_dir, json_data, schema_ocds, api=True, cache=False,
+                           validation_workers=validation_workers)
     )
 
     if file_type == 'xlsx':
@@ -129,5 +152,6 @@ def ocds_json_output(output_dir, file, schema_version, convert, cache_schema=Fal
         # TODO: can we do this by no writing the files in the first place?
         os.remove(os.path.join(output_dir, 'heading_source_map.json'))
         os.remove(os.path.join(output_dir, 'cell_source_map.json'))
+        os.remove(os.path.join(output_dir, SOURCE_MAPS_FILE_NAME))
 
     return context
@@ -3,7 +3,8 @@ import json
 import collections
 
 import cove.lib.tools as tools
-from cove.lib.common import common_checks_context, get_additional_codelist_values
+from cove.lib.common import common_checks_context, CodelistValuesVisitor
+from cove.lib.visitor import DataVisitor, ItemsVisitor, walk_data
 
 from django.utils.html import mark_safe, escape, conditional_escape, format_html
 
@@ -16,71 +17,86 @@ validation_error_lookup = {
 }
 
 
-@tools.ignore_errors
-def get_releases_aggregates(json_data):
-    release_count = 0
-    unique_ocids = set()
-    tags = collections.Counter()
-    unique_lang = set()
-    unique_initation_type = set()
-    unique_release_ids = set()
-    duplicate_release_ids = set()
-
-    ##for matching with contracts
-    unique_award_id = set()
-
-    planning_ocids = set()
-    tender_ocids = set()
-    awardid_ocids = set()
-    award_ocids = set()
-    contractid_ocids = set()
-    contract_ocids = set()
-    implementation_contractid_ocids = set()
-    implementation_ocids = set()
-
-    release_dates = []
-    tender_dates = []
-    award_dates = []
-    contract_dates = []
-
-    unique_buyers_identifier = dict()
-    unique_buyers_name_no_id = set()
-    unique_suppliers_identifier = dict()
-    unique_suppliers_name_no_id = set()
-    unique_procuring_identifier = dict()
-    unique_procuring_name_no_id = set()
-    unique_tenderers_identifier = dict()
-    unique_tenderers_name_no_id = set()
-
-    unique_organisation_schemes = set()
-    organisation_identifier_address = set()
-    organisation_name_no_id_address = set()
-    organisation_identifier_contact_point = set()
-    organisation_name_no_id_contact_point = set()
-
-    release_tender_item_ids = set()
-    release_award_item_ids = set()
-    release_contract_item_ids = set()
-    item_identifier_schemes = set()
-
-    unique_currency = set()
-
-    planning_doctype = collections.Counter()
-    planning_doc_count = 0
-    tender_doctype = collections.Counter()
-    tender_doc_count = 0
-    tender_milestones_doctype = collections.Counter()
-    tender_milestones_doc_count = 0
-    award_doctype = collections.Counter()
-    award_doc_count = 0
-    contract_doctype = collections.Counter()
-    contract_doc_count = 0
-    implementation_doctype = collections.Counter()
-    implementation_doc_count = 0
-    implementation_milestones_doctype = collections.Counter()
-    implementation_milestones_doc_count = 0
-
-    def process_org(org, unique_id, unique_name):
+class ReleasesAggregatesVisitor(DataVisitor):
+    '''Aggregates of the releases of a release package, and the currencies used anywhere in the data'''
+    def __init__(self):
+        self.release_count = 0
+        self.unique_ocids = set()
+        self.tags = collections.Counter()
+        self.unique_lang = set()
+        self.unique_initation_type = set()
+        self.unique_release_ids = set()
+        self.duplicate_release_ids = set()
+
+        ##for matching with contracts
+        self.unique_award_id = set()
+        # contracts not matching any award seen so far
+        self.contracts_without_awards = []
+
+        self.planning_ocids = set()
+        self.tender_ocids = set()
+        self.awardid_ocids = set()
+        self.award_ocids = set()
+        self.contractid_ocids = set()
+        self.contract_ocids = set()
+        self.implementation_contractid_ocids = set()
+        self.implementation_ocids = set()
+
+        self.release_dates = []
+        self.tender_dates = []
+        self.award_dates = []
+        self.contract_dates = []
+
+        self.unique_buyers_identifier = dict()
+        self.unique_buyers_name_no_id = set()
+        self.unique_suppliers_identifier = dict()
+        self.unique_suppliers_name_no_id = set()
+        self.unique_procuring_identifier = dict()
+        self.unique_procuring_name_no_id = set()
+        self.unique_tenderers_identifier = dict()
+        self.unique_tenderers_name_no_id = set()
+
+        self.unique_organisation_schemes = set()
+        self.organisation_identifier_address = set()
+        self.organisation_name_no_id_address = set()
+        self.organisation_identifier_contact_point = set()
+        self.organisation_name_no_id_contact_point = set()
+
+        self.release_tender_item_ids = set()
+        self.release_award_item_ids = set()
+        self.release_contract_item_ids = set()
+        self.item_identifier_schemes = set()
+
+        self.unique_currency = set()
+
+        self.planning_doctype = collections.Counter()
+        self.planning_doc_count = 0
+        self.tender_doctype = collections.Counter()
+        self.tender_doc_count = 0
+        self.tender_milestones_doctype = collections.Counter()
+        self.tender_milestones_doc_count = 0
+        self.award_doctype = collections.Counter()
+        self.award_doc_count = 0
+        self.contract_doctype = collections.Counter()
+        self.contract_doc_count = 0
+        self.implementation_doctype = collections.Counter()
+        self.implementation_doc_count = 0
+        self.implementation_milestones_doctype = collections.Counter()
+        self.implementation_milestones_doc_count = 0
+
+    def visit(self, path, value):
+        if path and path[-1] == 'currency':
+            self.unique_currency.add(value)
+        if not path:
+            releases = tools.get_no_exception(value, 'releases', [])
+            if not isinstance(releases, list):
+                for release in releases:
+                    self.visit_release(release)
+        elif len(path) == 2 and path[0] == 'releases' and isinstance(path[1], int):
+            self.visit_release(value)
+        return isinstance(value, (dict, list))
+
+    def process_org(self, org, unique_id, unique_name):
         identifier = org.get('identifier')
         org_id = None
         if identifier:
@@ -89,89 +105,100 @@ def get_releases_aggregates(json_data):
                 unique_id[org_id] = org.get('name', '') or ''
                 scheme = identifier.get('scheme')
                 if scheme:
-                    unique_organisation_schemes.add(scheme)
+                    self.unique_organisation_schemes.add(scheme)
                 if org.get('address'):
-                    organisation_identifier_address.add(org_id)
+                    self.organisation_identifier_address.add(org_id)
                 if org.get('contactPoint'):
-                    organisation_identifier_contact_point.add(org_id)
+                    self.organisation_identifier_contact_point.add(org_id)
         if not org_id:
             name = org.get('name')
             if name:
                 unique_name.add(name)
             if org.get('address'):
-                organisation_name_no_id_address.add(name)
+                self.organisation_name_no_id_address.add(name)
             if org.get('contactPoint'):
-                organisation_name_no_id_contact_point.add(name)
+                self.organisation_name_no_id_contact_point.add(name)
 
-    def get_item_scheme(item):
+    def get_item_scheme(self, item):
         classification = item.get('classification')
         if classification:
             scheme = classification.get('scheme')
             if scheme:
-                item_identifier_schemes.add(scheme)
+                self.item_identifier_schemes.add(scheme)
 
-    releases = tools.get_no_exception(json_data, 'releases', [])
-    for release in releases:
+    def visit_release(self, release):
+        self.add_release(release)
+
+        # Awards of later releases can still match these contracts, they are
+        # checked again in finish()
+        contracts = release.get('contracts', [])
+        for contract in contracts:
+            award_id = contract.get('awardID')
+            if award_id not in self.unique_award_id:
+                self.contracts_without_awards.append(contract)
+
+    def add_release(self, release):
         # ### Release Section ###
-        release_count = release_count + 1
+        self.release_count = self.release_count + 1
         ocid = release.get('ocid')
         release_id = release.get('id')
         if not ocid:
-            continue
+            return
         if release_id:
-            if release_id in unique_release_ids:
-                duplicate_release_ids.add(release_id)
-            unique_release_ids.add(release_id)
+            if release_id in self.unique_release_ids:
+                self.duplicate_release_ids.add(release_id)
+            self.unique_release_ids.add(release_id)
 
-        unique_ocids.add(release['ocid'])
+        self.unique_ocids.add(release['ocid'])
         if 'tag' in release:
-            tags.update(tools.to_list(release['tag']))
+            self.tags.update(tools.to_list(release['tag']))
         initiation_type = release.get('initiationType')
         if initiation_type:
-            unique_initation_type.add(initiation_type)
+            self.unique_initation_type.add(initiation_type)
 
         release_date = release.get('date', '')
         if release_date:
-            release_dates.append(str(release_date))
+            self.release_dates.append(str(release_date))
 
         if 'language' in release:
-            unique_lang.add(release['language'])
+            self.unique_lang.add(release['language'])
         buyer = release.get('buyer')
         if buyer:
-            process_org(buyer, unique_buyers_identifier, unique_buyers_name_no_id)
+            self.process_org(buyer, self.unique_buyers_identifier, self.unique_buyers_name_no_id)
 
         # ### Planning Section ###
         planning = tools.get_no_exception(release, 'planning', {})
         if planning and isinstance(planning, dict):
-            planning_ocids.add(ocid)
-            planning_doc_count += tools.update_docs(planning, planning_doctype)
+            self.planning_ocids.add(ocid)
+            self.planning_doc_count += tools.update_docs(planning, self.planning_doctype)
 
         # ### Tender Section ###
         tender = tools.get_no_exception(release, 'tender', {})
         if tender and isinstance(tender, dict):
-            tender_ocids.add(ocid)
-            tender_doc_count += tools.update_docs(tender, tender_doctype)
+            self.tender_ocids.add(ocid)
+            self.tender_doc_count += tools.update_docs(tender, self.tender_doctype)
             tender_period = tender.get('tenderPeriod')
             if tender_period:
                 start_date = tender_period.get('startDate', '')
                 if start_date:
-                    tender_dates.append(str(start_date))
+                    self.tender_dates.append(str(start_date))
             procuring_entity = tender.get('procuringEntity')
             if procuring_entity:
-                process_org(procuring_entity, unique_procuring_identifier, unique_procuring_name_no_id)
+                self.process_org(procuring_entity, self.unique_procuring_identifier,
+                                 self.unique_procuring_name_no_id)
             tenderers = tender.get('tenderers', [])
             for tenderer in tenderers:
-                process_org(tenderer, unique_tenderers_identifier, unique_tenderers_name_no_id)
+                self.process_org(tenderer, self.unique_tenderers_identifier, self.unique_tenderers_name_no_id)
             tender_items = tender.get('items', [])
             for item in tender_items:
                 item_id = item.get('id')
                 if item_id and release_id:
-                    release_tender_item_ids.add((ocid, release_id, item_id))
-                get_item_scheme(item)
+                    self.release_tender_item_ids.add((ocid, release_id, item_id))
+                self.get_item_scheme(item)
             milestones = tender.get('milestones')
             if milestones:
                 for milestone in milestones:
-                    tender_milestones_doc_count += tools.update_docs(milestone, tender_milestones_doctype)
+                    self.tender_milestones_doc_count += tools.update_docs(milestone, self.tender_milestones_doctype)
 
         # ### Award Section ###
         awards = tools.get_no_exception(release, 'awards', [])
@@ -179,207 +206,207 @@ def get_releases_aggregates(json_data):
             if not isinstance(award, dict):
                 continue
             award_id = award.get('id')
-            award_ocids.add(ocid)
+            self.award_ocids.add(ocid)
             if award_id:
-                unique_award_id.add(award_id)
-                awardid_ocids.add((award_id, ocid))
+                self.unique_award_id.add(award_id)
+                self.awardid_ocids.add((award_id, ocid))
             award_date = award.get('date', '')
             if award_date:
-                award_dates.append(str(award_date))
+                self.award_dates.append(str(award_date))
             award_items = award.get('items', [])
             for item in award_items:
                 item_id = item.get('id')
                 if item_id and release_id and award_id:
-                    release_award_item_ids.add((ocid, release_id, award_id, item_id))
-                get_item_scheme(item)
+                    self.release_award_item_ids.add((ocid, release_id, award_id, item_id))
+                self.get_item_scheme(item)
             suppliers = award.get('suppliers', [])
             for supplier in suppliers:
-                process_org(supplier, unique_suppliers_identifier, unique_suppliers_name_no_id)
-            award_doc_count += tools.update_docs(award, award_doctype)
+                self.process_org(supplier, self.unique_suppliers_identifier, self.unique_suppliers_name_no_id)
+            self.award_doc_count += tools.update_docs(award, self.award_doctype)
 
         # ### Contract section
         contracts = tools.get_no_exception(release, 'contracts', [])
         for contract in contracts:
             contract_id = contract.get('id')
-            contract_ocids.add(ocid)
+            self.contract_ocids.add(ocid)
             if contract_id:
-                contractid_ocids.add((contract_id, ocid))
+                self.contractid_ocids.add((contract_id, ocid))
             period = contract.get('period')
             if period:
                 start_date = period.get('startDate', '')
                 if start_date:
-                    contract_dates.append(start_date)
+                    self.contract_dates.append(start_date)
             contract_items = contract.get('items', [])
             for item in contract_items:
                 item_id = item.get('id')
                 if item_id and release_id and contract_id:
-                    release_contract_item_ids.add((ocid, release_id, contract_id, item_id))
-                get_item_scheme(item)
-            contract_doc_count += tools.update_docs(contract, contract_doctype)
+                    self.release_contract_item_ids.add((ocid, release_id, contract_id, item_id))
+                self.get_item_scheme(item)
+            self.contract_doc_count += tools.update_docs(contract, self.contract_doctype)
             implementation = contract.get('implementation')
             if implementation:
-                implementation_ocids.add(ocid)
+                self.implementation_ocids.add(ocid)
                 if contract_id:
-                    implementation_contractid_ocids.add((contract_id, ocid))
-                implementation_doc_count += tools.update_docs(implementation, implementation_doctype)
+                    self.implementation_contractid_ocids.add((contract_id, ocid))
+                self.implementation_doc_count += tools.update_docs(implementation, self.implementation_doctype)
                 implementation_milestones = implementation.get('milestones', [])
                 for milestone in implementation_milestones:
-                    implementation_milestones_doc_count += tools.update_docs(milestone, implementation_milestones_doctype)
-
-    contracts_without_awards = []
-    for release in releases:
-        contracts = release.get('contracts', [])
-        for contract in contracts:
-            award_id = contract.get('awardID')
-            if award_id not in unique_award_id:
-                contracts_without_awards.append(contract)
-
-    unique_buyers_count = len(unique_buyers_identifier) + len(unique_buyers_name_no_id)
-    unique_buyers = [name + ' (' + str(id) + ')' for id, name in unique_buyers_identifier.items()] + list(unique_buyers_name_no_id)
-
-    unique_suppliers_count = len(unique_suppliers_identifier) + len(unique_suppliers_name_no_id)
-    unique_suppliers = [name + ' (' + str(id) + ')' for id, name in unique_suppliers_identifier.items()] + list(unique_suppliers_name_no_id)
-
-    unique_procuring_count = len(unique_procuring_identifier) + len(unique_procuring_name_no_id)
-    unique_procuring = [name + ' (' + str(id) + ')' for id, name in unique_procuring_identifier.items()] + list(unique_procuring_name_no_id)
-
-    unique_tenderers_count = len(unique_tenderers_identifier) + len(unique_tenderers_name_no_id)
-    unique_tenderers = [name + ' (' + str(id) + ')' for id, name in unique_tenderers_identifier.items()] + list(unique_tenderers_name_no_id)
-
-    unique_org_identifier_count = len(set(unique_buyers_identifier) |
-                                      set(unique_suppliers_identifier) |
-                                      set(unique_procuring_identifier) |
-                                      set(unique_tenderers_identifier))
-    unique_org_name_count = len(unique_buyers_name_no_id |
-                                unique_suppliers_name_no_id |
-                                unique_procuring_name_no_id |
-                                unique_tenderers_name_no_id)
-    unique_org_count = unique_org_identifier_count + unique_org_name_count
-
-    def get_currencies(object):
-        if isinstance(object, dict):
-            for key, value in object.items():
-                if key == 'currency':
-                    unique_currency.add(value)
-                get_currencies(value)
-        if isinstance(object, list):
-            for item in object:
-                get_currencies(item)
-    get_currencies(json_data)
-
-    return dict(
-        release_count=release_count,
-        unique_ocids=sorted(unique_ocids, key=lambda x: str(x)),
-        unique_initation_type=sorted(unique_initation_type, key=lambda x: str(x)),
-        duplicate_release_ids=sorted(duplicate_release_ids, key=lambda x: str(x)),
-        tags=dict(tags),
-        unique_lang=sorted(unique_lang, key=lambda x: str(x)),
-        unique_award_id=sorted(unique_award_id, key=lambda x: str(x)),
-
-        planning_count=len(planning_ocids),
-        tender_count=len(tender_ocids),
-        award_count=len(awardid_ocids),
-        processes_award_count=len(award_ocids),
-        contract_count=len(contractid_ocids),
-        processes_contract_count=len(contract_ocids),
-        implementation_count=len(implementation_contractid_ocids),
-        processes_implementation_count=len(implementation_ocids),
-
-        min_release_date=min(release_dates) if release_dates else '',
-        max_release_date=max(release_dates) if release_dates else '',
-        min_tender_date=min(tender_dates) if tender_dates else '',
-        max_tender_date=max(tender_dates) if tender_dates else '',
-        min_award_date=min(award_dates) if award_dates else '',
-        max_award_date=max(award_dates) if award_dates else '',
-        min_contract_date=min(contract_dates) if contract_dates else '',
-        max_contract_date=max(contract_dates) if contract_dates else '',
-
-        unique_buyers_identifier=unique_buyers_identifier,
-        unique_buyers_name_no_id=sorted(unique_buyers_name_no_id, key=lambda x: str(x)),
-        unique_suppliers_identifier=unique_suppliers_identifier,
-        unique_suppliers_name_no_id=sorted(unique_suppliers_name_no_id, key=lambda x: str(x)),
-        unique_procuring_identifier=unique_procuring_identifier,
-        unique_procuring_name_no_id=sorted(unique_procuring_name_no_id, key=lambda x: str(x)),
-        unique_tenderers_identifier=unique_tenderers_identifier,
-        unique_tenderers_name_no_id=sorted(unique_tenderers_name_no_id, key=lambda x: str(x)),
-
-        unique_buyers=sorted(set(unique_buyers)),
-        unique_suppliers=sorted(set(unique_suppliers)),
-        unique_procuring=sorted(set(unique_procuring)),
-        unique_tenderers=sorted(set(unique_tenderers)),
-
-        unique_buyers_count=unique_buyers_count,
-        unique_suppliers_count=unique_suppliers_count,
-        unique_procuring_count=unique_procuring_count,
-        unique_tenderers_count=unique_tenderers_count,
-
-        unique_org_identifier_count=unique_org_identifier_count,
-        unique_org_name_count=unique_org_name_count,
-        unique_org_count=unique_org_count,
-
-        unique_organisation_schemes=sorted(unique_organisation_schemes, key=lambda x: str(x)),
-
-        organisations_with_address=len(organisation_identifier_address) + len(organisation_name_no_id_address),
-        organisations_with_contact_point=len(organisation_identifier_contact_point) + len(organisation_name_no_id_contact_point),
-
-        total_item_count=len(release_tender_item_ids) + len(release_award_item_ids) + len(release_contract_item_ids),
-        tender_item_count=len(release_tender_item_ids),
-        award_item_count=len(release_award_item_ids),
-        contract_item_count=len(release_contract_item_ids),
-
-        item_identifier_schemes=sorted(item_identifier_schemes, key=lambda x: str(x)),
-        unique_currency=sorted(unique_currency, key=lambda x: str(x)),
-
-        planning_doc_count=planning_doc_count,
-        tender_doc_count=tender_doc_count,
-        tender_milestones_doc_count=tender_milestones_doc_count,
-        award_doc_count=award_doc_count,
-        contract_doc_count=contract_doc_count,
-        implementation_doc_count=implementation_doc_count,
-        implementation_milestones_doc_count=implementation_milestones_doc_count,
-
-        planning_doctype=dict(planning_doctype),
-        tender_doctype=dict(tender_doctype),
-        tender_milestones_doctype=dict(tender_milestones_doctype),
-        award_doctype=dict(award_doctype),
-        contract_doctype=dict(contract_doctype),
-        implementation_doctype=dict(implementation_doctype),
-        implementation_milestones_doctype=dict(implementation_milestones_doctype),
-
-        contracts_without_awards=contracts_without_awards,
-    )
-
-
-def _lookup_schema(schema, path, ref_info=None):
-    if len(path) == 0:
-        return schema, ref_info
-    if hasattr(schema, '__reference__'):
-        ref_info = {
-            'path': path,
-            'reference': schema.__reference__,
-        }
-    path_item, *child_path = path
-    if 'items' in schema:
-        return _lookup_schema(schema['items'], path, ref_info)
-    elif 'properties' in schema:
-        if path_item in schema['properties']:
-            return _lookup_schema(schema['properties'][path_item], child_path, ref_info)
-        else:
-            return None, None
-
-
-def lookup_schema(schema, path):
-    return _lookup_schema(schema, path.split('/'))
-
-
-def common_checks_ocds(context, upload_dir, json_data, schema_obj, api=False, cache=True):
+                    self.implementation_milestones_doc_count += tools.update_docs(
+                        milestone, self.implementation_milestones_doctype)
+
+    def finish(self):
+        contracts_without_awards = [contract for contract in self.contracts_without_awards
+                                    if contract.get('awardID') not in self.unique_award_id]
+
+        unique_buyers_identifier = self.unique_buyers_identifier
+        unique_buyers_name_no_id = self.unique_buyers_name_no_id
+        unique_suppliers_identifier = self.unique_suppliers_identifier
+        unique_suppliers_name_no_id = self.unique_suppliers_name_no_id
+        unique_procuring_identifier = self.unique_procuring_identifier
+        unique_procuring_name_no_id = self.unique_procuring_name_no_id
+        unique_tenderers_identifier = self.unique_tenderers_identifier
+        unique_tenderers_name_no_id = self.unique_tenderers_name_no_id
+
+        unique_buyers_count = len(unique_buyers_identifier) + len(unique_buyers_name_no_id)
+        unique_buyers = [name + ' (' + str(id) + ')' for id, name in unique_buyers_identifier.items()] + list(unique_buyers_name_no_id)
+
+        unique_suppliers_count = len(unique_suppliers_identifier) + len(unique_suppliers_name_no_id)
+        unique_suppliers = [name + ' (' + str(id) + ')' for id, name in unique_suppliers_identifier.items()] + list(unique_suppliers_name_no_id)
+
+        unique_procuring_count = len(unique_procuring_identifier) + len(unique_procuring_name_no_id)
+        unique_procuring = [name + ' (' + str(id) + ')' for id, name in unique_procuring_identifier.items()] + list(unique_procuring_name_no_id)
+
+        unique_tenderers_count = len(unique_tenderers_identifier) + len(unique_tenderers_name_no_id)
+        unique_tenderers = [name + ' (' + str(id) + ')' for id, name in unique_tenderers_identifier.items()] + list(unique_tenderers_name_no_id)
+
+        unique_org_identifier_count = len(set(unique_buyers_identifier) |
+                                          set(unique_suppliers_identifier) |
+                                          set(unique_procuring_identifier) |
+                                          set(unique_tenderers_identifier))
+        unique_org_name_count = len(unique_buyers_name_no_id |
+                                    unique_suppliers_name_no_id |
+                                    unique_procuring_name_no_id |
+                                    unique_tenderers_name_no_id)
+        unique_org_count = unique_org_identifier_count + unique_org_name_count
+
+        release_dates = self.release_dates
+        tender_dates = self.tender_dates
+        award_dates = self.award_dates
+        contract_dates = self.contract_dates
+
+        return dict(
+            release_count=self.release_count,
+            unique_ocids=sorted(self.unique_ocids, key=lambda x: str(x)),
+            unique_initation_type=sorted(self.unique_initation_type, key=lambda x: str(x)),
+            duplicate_release_ids=sorted(self.duplicate_release_ids, key=lambda x: str(x)),
+            tags=dict(self.tags),
+            unique_lang=sorted(self.unique_lang, key=lambda x: str(x)),
+            unique_award_id=sorted(self.unique_award_id, key=lambda x: str(x)),
+
+            planning_count=len(self.planning_ocids),
+            tender_count=len(self.tender_ocids),
+            award_count=len(self.awardid_ocids),
+            processes_award_count=len(self.award_ocids),
+            contract_count=len(self.contractid_ocids),
+            processes_contract_count=len(self.contract_ocids),
+            implementation_count=len(self.implementation_contractid_ocids),
+            processes_implementation_count=len(self.implementation_ocids),
+
+            min_release_date=min(release_dates) if release_dates else '',
+            max_release_date=max(release_dates) if release_dates else '',
+            min_tender_date=min(tender_dates) if tender_dates else '',
+            max_tender_date=max(tender_dates) if tender_dates else '',
+            min_award_date=min(award_dates) if award_dates else '',
+            max_award_date=max(award_dates) if award_dates else '',
+            min_contract_date=min(contract_dates) if contract_dates else '',
+            max_contract_date=max(contract_dates) if contract_dates else '',
+
+            unique_buyers_identifier=unique_buyers_identifier,
+            unique_buyers_name_no_id=sorted(unique_buyers_name_no_id, key=lambda x: str(x)),
+            unique_suppliers_identifier=unique_suppliers_identifier,
+            unique_suppliers_name_no_id=sorted(unique_suppliers_name_no_id, key=lambda x: str(x)),
+            unique_procuring_identifier=unique_procuring_identifier,
+            unique_procuring_name_no_id=sorted(unique_procuring_name_no_id, key=lambda x: str(x)),
+            unique_tenderers_identifier=unique_tenderers_identifier,
+            unique_tenderers_name_no_id=sorted(unique_tenderers_name_no_id, key=lambda x: str(x)),
+
+            unique_buyers=sorted(set(unique_buyers)),
+            unique_suppliers=sorted(set(unique_suppliers)),
+            unique_procuring=sorted(set(unique_procuring)),
+            unique_tenderers=sorted(set(unique_tenderers)),
+
+            unique_buyers_count=unique_buyers_count,
+            unique_suppliers_count=unique_suppliers_count,
+            unique_procuring_count=unique_procuring_count,
+            unique_tenderers_count=unique_tenderers_count,
+
+            unique_org_identifier_count=unique_org_identifier_count,
+            unique_org_name_count=unique_org_name_count,
+            unique_org_count=unique_org_count,
+
+            unique_organisation_schemes=sorted(self.unique_organisation_schemes, key=lambda x: str(x)),
+
+            organisations_with_address=(len(self.organisation_identifier_address) +
+                                        len(self.organisation_name_no_id_address)),
+            organisations_with_contact_point=(len(self.organisation_identifier_contact_point) +
+                                              len(self.organisation_name_no_id_contact_point)),
+
+            total_item_count=(len(self.release_tender_item_ids) + len(self.release_award_item_ids) +
+                              len(self.release_contract_item_ids)),
+            tender_item_count=len(self.release_tender_item_ids),
+            award_item_count=len(self.release_award_item_ids),
+            contract_item_count=len(self.release_contract_item_ids),
+
+            item_identifier_schemes=sorted(self.item_identifier_schemes, key=lambda x: str(x)),
+            unique_currency=sorted(self.unique_currency, key=lambda x: str(x)),
+
+            planning_doc_count=self.planning_doc_count,
+            tender_doc_count=self.tender_doc_count,
+            tender_milestones_doc_count=self.tender_milestones_doc_count,
+            award_doc_count=self.award_doc_count,
+            contract_doc_count=self.contract_doc_count,
+            implementation_doc_count=self.implementation_doc_count,
+            implementation_milestones_doc_count=self.implementation_milestones_doc_count,
+
+            planning_doctype=dict(self.planning_doctype),
+            tender_doctype=dict(self.tender_doctype),
+            tender_milestones_doctype=dict(self.tender_milestones_doctype),
+            award_doctype=dict(self.award_doctype),
+            contract_doctype=dict(self.contract_doctype),
+            implementation_doctype=dict(self.implementation_doctype),
+            implementation_milestones_doctype=dict(self.implementation_milestones_doctype),
+
+            contracts_without_awards=contracts_without_awards,
+        )
+
+
+def get_releases_aggregates(json_data, ignore_errors=False):
+    visitor = ReleasesAggregatesVisitor()
+    walk_data(json_data, [visitor])
+    return visitor.result(ignore_errors=ignore_errors)
+
+
+def common_checks_ocds(context, upload_dir, json_data, schema_obj, api=False, cache=True, validation_workers=None):
     schema_name = schema_obj.release_pkg_schema_name
     if 'records' in json_data:
         schema_name = schema_obj.record_pkg_schema_name
+
+    # Run the data-side checks in the same traversal as the common ones
+    bad_prefixes = BadOCDSPrefixesVisitor()
+    if schema_name == 'record-package-schema.json':
+        aggregates = RecordsAggregatesVisitor()
+        visitors = [aggregates, bad_prefixes]
+    else:
+        aggregates = ReleasesAggregatesVisitor()
+        codelist_values = CodelistValuesVisitor(schema_obj)
+        visitors = [aggregates, codelist_values, bad_prefixes]
+
     common_checks = common_checks_context(upload_dir, json_data, schema_obj, schema_name, context,
-                                          fields_regex=True, api=api, cache=cache)
+                                          fields_regex=True, api=api, cache=cache, visitors=visitors,
+                                          validation_workers=validation_workers)
     validation_errors = common_checks['context']['validation_errors']
 
+    schema_index = schema_obj.get_release_pkg_schema_index()
     new_validation_errors = []
     for (json_key, values) in validation_errors:
         error = json.loads(json_key)
@@ -392,7 +419,7 @@ def common_checks_ocds(context, upload_dir, json_data, schema_obj, api=False, ca
             else:
                 error['message_safe'] = conditional_escape(error['message'])
 
-        schema_block, ref_info = lookup_schema(schema_obj.get_release_pkg_schema_obj(deref=True), error['path_no_number'])
+        schema_block, ref_info = schema_index.lookup(error['path_no_number'])
         if schema_block and error['message_type'] != 'required':
             if 'description' in schema_block:
                 error['schema_title'] = escape(schema_block.get('title', ''))
@@ -420,80 +447,112 @@ def common_checks_ocds(context, upload_dir, json_data, schema_obj, api=False, ca
     context.update(common_checks['context'])
 
     if schema_name == 'record-package-schema.json':
-        context['records_aggregates'] = get_records_aggregates(json_data, ignore_errors=bool(validation_errors))
+        context['records_aggregates'] = aggregates.result(ignore_errors=bool(validation_errors))
         context['schema_url'] = schema_obj.record_pkg_schema_url
     else:
-        additional_codelist_values = get_additional_codelist_values(schema_obj, json_data)
+        additional_codelist_values = codelist_values.result()
         closed_codelist_values = {key: value for key, value in additional_codelist_values.items() if not value['isopen']}
         open_codelist_values = {key: value for key, value in additional_codelist_values.items() if value['isopen']}
 
         context.update({
-            'releases_aggregates': get_releases_aggregates(json_data, ignore_errors=bool(validation_errors)),
+            'releases_aggregates': aggregates.result(ignore_errors=bool(validation_errors)),
             'additional_closed_codelist_values': closed_codelist_values,
             'additional_open_codelist_values': open_codelist_values
         })
 
-    context = add_conformance_rule_errors(context, json_data, schema_obj)
+    context = add_conformance_rule_errors(context, json_data, schema_obj, bad_prefixes.result())
     return context
 
 
-@tools.ignore_errors
-def get_records_aggregates(json_data):
-    # Unique ocids
-    unique_ocids = set()
+class RecordsAggregatesVisitor(ItemsVisitor):
+    '''Aggregates of the records of a record package'''
+    items_key = 'records'
 
-    if 'records' in json_data:
-        for record in json_data['records']:
-            # Gather all the ocids
-            if 'ocid' in record:
-                unique_ocids.add(record['ocid'])
+    def __init__(self):
+        self.count = 0
+        self.unique_ocids = set()
 
-    # Number of records
-    count = len(json_data['records']) if 'records' in json_data else 0
+    def visit_item(self, num, record):
+        # Number of records
+        self.count += 1
+        # Gather all the ocids
+        if 'ocid' in record:
+            self.unique_ocids.add(record['ocid'])
 
-    return {
-        'count': count,
-        'unique_ocids': unique_ocids,
-    }
+    def finish(self):
+        return {
+            'count': self.count,
+            'unique_ocids': self.unique_ocids,
+        }
 
 
-def get_bad_ocds_prefixes(json_data):
-    '''Yield tuples with ('ocid', 'path/to/ocid') for ocids with malformed prefixes'''
+def get_records_aggregates(json_data, ignore_errors=False):
+    visitor = RecordsAggregatesVisitor()
+    walk_data(json_data, [visitor])
+    return visitor.result(ignore_errors=ignore_errors)
+
+
+class BadOCDSPrefixesVisitor(ItemsVisitor):
+    '''Find ocids with malformed prefixes in the releases, or else in the records'''
     prefix_regex = re.compile(r'^ocds-[a-zA-Z0-9]{6}-')
-    releases = json_data.get('releases', [])
-    records = json_data.get('records', [])
-    bad_prefixes = []
 
-    if releases and isinstance(releases, list):
-        for n_rel, release in enumerate(releases):
+    def __init__(self):
+        self.bad_prefixes = []
+
+    def visit(self, path, value):
+        if not path:
+            releases = value.get('releases', [])
+            records = value.get('records', [])
+            if releases and isinstance(releases, list):
+                self.items_key = 'releases'
+            elif records and isinstance(records, list):
+                self.items_key = 'records'
+            return bool(self.items_key)
+        return super().visit(path, value)
+
+    def visit_item(self, num, item):
+        prefix_regex = self.prefix_regex
+        bad_prefixes = self.bad_prefixes
+
+        if self.items_key == 'releases':
+            release = item
             if not isinstance(release, dict):
-                continue
+                return
             ocid = release.get('ocid', '')
             if ocid and isinstance(ocid, str) and not prefix_regex.match(ocid):
-                bad_prefixes.append((ocid, 'releases/%s/ocid' % n_rel))
+                bad_prefixes.append((ocid, 'releases/%s/ocid' % num))
+            return
 
-    elif records and isinstance(records, list):
-        for n_rec, record in enumerate(records):
-            if not isinstance(record, dict):
-                continue
-            for n_rel, release in enumerate(record.get('releases', {})):
-                ocid = release.get('ocid', '')
-                if ocid and not prefix_regex.match(ocid):
-                    bad_prefixes.append((ocid, 'records/%s/releases/%s/ocid' % (n_rec, n_rel)))
+        record = item
+        if not isinstance(record, dict):
+            return
+        for n_rel, release in enumerate(record.get('releases', {})):
+            ocid = release.get('ocid', '')
+            if ocid and not prefix_regex.match(ocid):
+                bad_prefixes.append((ocid, 'records/%s/releases/%s/ocid' % (num, n_rel)))
 
-            compiled_release = record.get('compiledRelease', {})
-            if compiled_release:
-                ocid = compiled_release.get('ocid', '')
-                if ocid and not prefix_regex.match(ocid):
-                    bad_prefixes.append((ocid, 'records/%s/compiledRelease/ocid' % n_rec))
-                    bad_prefixes.append((ocid, 'records/%s/compiledRelease/ocid' % n_rec))
+        compiled_release = record.get('compiledRelease', {})
+        if compiled_release:
+            ocid = compiled_release.get('ocid', '')
+            if ocid and not prefix_regex.match(ocid):
+                bad_prefixes.append((ocid, 'records/%s/compiledRelease/ocid' % num))
+                bad_prefixes.append((ocid, 'records/%s/compiledRelease/ocid' % num))
 
-    return bad_prefixes
+    def finish(self):
+        return self.bad_prefixes
+
+
+def get_bad_ocds_prefixes(json_data):
+    '''Yield tuples with ('ocid', 'path/to/ocid') for ocids with malformed prefixes'''
+    visitor = BadOCDSPrefixesVisitor()
+    walk_data(json_data, [visitor])
+    return visitor.result()
 
 
-def add_conformance_rule_errors(context, json_data, schema_obj):
+def add_conformance_rule_errors(context, json_data, schema_obj, ocds_prefixes_bad_format=None):
     '''Return context dict augmented with conformance errors if any'''
-    ocds_prefixes_bad_format = get_bad_ocds_prefixes(json_data)
+    if ocds_prefixes_bad_format is None:
+        ocds_prefixes_bad_format = get_bad_ocds_prefixes(json_data)
 
     if ocds_prefixes_bad_format:
         ocid_schema_description = schema_obj.get_release_schema_obj()['properties']['ocid']['description']
@@ -1,21 +1,81 @@
 import os
 import json
+import hashlib
+import logging
+import tempfile
 from copy import deepcopy
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import json_merge_patch
+import jsonref
 import requests
 from cached_property import cached_property
 from django.conf import settings
 from django.utils import translation
 
 
-from cove.lib.common import SchemaJsonMixin, schema_dict_fields_generator, get_schema_codelist_paths, load_core_codelists, load_codelist
-from cove.lib.tools import cached_get_request
+from cove.lib.common import SchemaJsonMixin, _deref_schema, get_schema_codelist_paths, load_core_codelists, load_codelist
+from cove.lib.registry import schema_registry
 
 
 config = settings.COVE_CONFIG
+logger = logging.getLogger(__name__)
+
+# Maximum number of extension files downloaded at the same time
+FETCH_WORKERS = 8
+
+
+def _submit_all(executor, function, args):
+    '''Call ``function`` on each of ``args`` in ``executor``, return an OrderedDict of arg -> future'''
+    futures = OrderedDict()
+    for arg in args:
+        if arg not in futures:
+            futures[arg] = executor.submit(function, arg)
+    return futures
+
+
+def _get_extension_release_schema_url(extensions_descriptor_url):
+    i = extensions_descriptor_url.rfind('/')
+    return '{}/{}'.format(extensions_descriptor_url[:i], 'release-schema.json')
+
+
+def _store_extended_schema(schema_str, schema_hash):
+    '''Write an extended release schema to EXTENDED_SCHEMA_DIR unless it is already there, return its path'''
+    path = os.path.join(settings.EXTENDED_SCHEMA_DIR, '{}.json'.format(schema_hash))
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(settings.EXTENDED_SCHEMA_DIR, exist_ok=True)
+    # Other processes may be writing the same schema, they must only see a complete file
+    fd, tmp_path = tempfile.mkstemp(dir=settings.EXTENDED_SCHEMA_DIR, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(schema_str)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def warm_up(versions=None):
+    '''Load the schemas and codelists of ``versions`` (the default version by default) in the schema registry.
+
+    Call it before forking worker processes, so that they all start with them.
+    '''
+    for version in versions or [SchemaOCDS.default_version]:
+        try:
+            schema_ocds = SchemaOCDS(select_version=version, cache_schema=True)
+            schema_ocds.get_release_pkg_schema_index()
+            schema_ocds.get_record_pkg_schema_index()
+            schema_ocds.process_codelists()
+        except Exception:
+            # The schemas are loaded again when needed
+            logger.exception('Could not load the OCDS %s schemas', version)
 
 
 class SchemaOCDS(SchemaJsonMixin):
@@ -53,6 +113,8 @@ class SchemaOCDS(SchemaJsonMixin):
         self.extensions = {}
         self.invalid_extension = {}
         self.extended = False
+        self.extended_schema_str = None
+        self.extended_schema_hash = None
         self.extended_schema_file = None
         self.extended_schema_url = None
         self.codelists = config['schema_codelists']['1.1']
@@ -96,11 +158,23 @@ class SchemaOCDS(SchemaJsonMixin):
 
         self.extended_codelists = deepcopy(self.core_codelists)
         self.extended_codelist_urls = {}
-        # we do not want to cache if the requests failed.
         if not self.core_codelists:
-            load_core_codelists.cache_clear()
             return
 
+        codelist_urls = []
+        for extension, extension_detail in self.extensions.items():
+            if isinstance(extension_detail, dict) and extension_detail.get("codelists"):
+                base_url = "/".join(extension.split('/')[:-1]) + "/codelists/"
+                codelist_urls.extend(base_url + codelist for codelist in extension_detail["codelists"])
+        if not codelist_urls:
+            return
+
+        # Download all the codelists at once, then apply them in order
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(codelist_urls))) as executor:
+            codelist_futures = _submit_all(executor, load_codelist, codelist_urls)
+            self._apply_extension_codelists(codelist_futures)
+
+    def _apply_extension_codelists(self, codelist_futures):
         for extension, extension_detail in self.extensions.items():
             if not isinstance(extension_detail, dict):
                 continue
@@ -113,7 +187,7 @@ class SchemaOCDS(SchemaJsonMixin):
 
             for codelist in codelist_list:
                 try:
-                    codelist_map = load_codelist(base_url + codelist)
+                    codelist_map = codelist_futures[base_url + codelist].result()
                 except UnicodeDecodeError as e:
                     extension_detail['failed_codelists'][codelist] = "Unicode Error, codelists need to be in UTF-8"
                 except Exception as e:
@@ -147,42 +221,91 @@ class SchemaOCDS(SchemaJsonMixin):
                 except KeyError:
                     self.extended_codelist_urls[codelist] = [base_url + codelist]
 
+    @property
+    def cache_key(self):
+        return (self.release_schema_url, self.release_pkg_schema_url, self.record_pkg_schema_url,
+                tuple(self.extensions))
+
+    def get_cache_key(self, extended=False):
+        if extended:
+            # Objects built from the extended schema are shared by all the lists of
+            # extensions that give the same schema
+            return ('extended', self.schema_host, self.release_pkg_schema_url, self.record_pkg_schema_url,
+                    self.extended_schema_hash)
+        return super().get_cache_key(extended)
+
+    def _extend_release_schema(self):
+        release_schema_obj = deepcopy(self._release_schema_obj)
+        self.apply_extensions(release_schema_obj)
+        schema_str = json.dumps(release_schema_obj, indent=4)
+        schema_hash = hashlib.sha256(schema_str.encode('utf-8')).hexdigest()
+        return (release_schema_obj, schema_str, schema_hash, deepcopy(self.extensions), dict(self.invalid_extension),
+                self.extended)
+
+    def _get_extended_obj(self, name, build):
+        '''Return an object built from the extended schema, from the schema registry.
+
+        Record dereferencing errors in self.json_deref_error like deref_schema does.
+        '''
+        try:
+            return schema_registry.get_object((name,) + self.get_cache_key(extended=True), build)
+        except jsonref.JsonRefError as e:
+            self.json_deref_error = e.message
+            return {}
+
     def get_release_schema_obj(self, deref=False):
         release_schema_obj = self._release_schema_obj
-        if self.extended_schema_file:
-            with open(self.extended_schema_file) as fp:
-                release_schema_obj = json.load(fp)
-        elif self.extensions:
-            release_schema_obj = deepcopy(self._release_schema_obj)
-            self.apply_extensions(release_schema_obj)
+        if self.extensions:
+            # Extension descriptions are in the language of the request
+            key = ('extended_release_schema', translation.get_language()) + self.cache_key
+            (release_schema_obj, self.extended_schema_str, self.extended_schema_hash, extensions, invalid_extension,
+             self.extended) = schema_registry.get_object(key, self._extend_release_schema)
+            # Failed codelists get added to the extension details later on
+            self.extensions = deepcopy(extensions)
+            self.invalid_extension = dict(invalid_extension)
         if deref:
             if self.extended:
-                extended_release_schema_str = json.dumps(release_schema_obj)
-                release_schema_obj = self.deref_schema(extended_release_schema_str)
+                release_schema_obj = self._get_extended_obj('extended_release_schema_deref', lambda: _deref_schema.__wrapped__(
+                    self.extended_schema_str, self.schema_host))
             else:
                 release_schema_obj = self.deref_schema(self.release_schema_str)
         return release_schema_obj
 
-    def get_release_pkg_schema_obj(self, deref=False, use_extensions=True):
+    def _deref_extended_release_pkg_schema(self):
+        deref_release_schema_obj = self.get_release_schema_obj(deref=True)
         package_schema_obj = deepcopy(self._release_pkg_schema_obj)
+        package_schema_obj['properties']['releases']['items'] = {}
+        package_schema_obj = _deref_schema.__wrapped__(json.dumps(package_schema_obj), self.schema_host)
+        package_schema_obj['properties']['releases']['items'].update(deref_release_schema_obj)
+        return package_schema_obj
+
+    def get_release_pkg_schema_obj(self, deref=False, use_extensions=True):
         if deref:
             if self.extended and use_extensions:
-                deref_release_schema_obj = self.get_release_schema_obj(deref=True)
-                package_schema_obj['properties']['releases']['items'] = {}
-                release_pkg_schema_str = json.dumps(package_schema_obj)
-                package_schema_obj = self.deref_schema(release_pkg_schema_str)
-                package_schema_obj['properties']['releases']['items'].update(deref_release_schema_obj)
+                return self._get_extended_obj('extended_release_pkg_schema_deref',
+                                              self._deref_extended_release_pkg_schema)
             else:
                 return self.deref_schema(self.release_pkg_schema_str)
-        return package_schema_obj
+        return self._release_pkg_schema_obj
 
     def apply_extensions(self, schema_obj):
         if not self.extensions:
             return
+        # Download the descriptors and release schema patches of all the extensions at once,
+        # then apply them in the order they are declared
+        urls = []
+        for extensions_descriptor_url in self.extensions:
+            urls.append(extensions_descriptor_url)
+            urls.append(_get_extension_release_schema_url(extensions_descriptor_url))
+        with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(urls))) as executor:
+            futures = _submit_all(executor, schema_registry.get, urls)
+            self._apply_extensions(schema_obj, futures)
+
+    def _apply_extensions(self, schema_obj, futures):
         for extensions_descriptor_url in self.extensions.keys():
 
             try:
-                response = requests.get(extensions_descriptor_url)
+                response = futures[extensions_descriptor_url].result()
                 if not response.ok:
                     # extension descriptor is required to proceed
                     self.invalid_extension[extensions_descriptor_url] = '{}: {}'.format(
@@ -192,14 +315,10 @@ class SchemaOCDS(SchemaJsonMixin):
                 self.invalid_extension[extensions_descriptor_url] = 'fetching failed'
                 continue
 
-            i = extensions_descriptor_url.rfind('/')
-            url = '{}/{}'.format(extensions_descriptor_url[:i], 'release-schema.json')
+            url = _get_extension_release_schema_url(extensions_descriptor_url)
 
             try:
-                if self.cache_schema:
-                    extension = cached_get_request(url)
-                else:
-                    extension = requests.get(url)
+                extension = futures[url].result()
             except requests.exceptions.RequestException:
                 continue
 
@@ -219,10 +338,6 @@ class SchemaOCDS(SchemaJsonMixin):
 
             schema_obj = json_merge_patch.merge(schema_obj, extension_data)
             try:
-                if self.cache_schema:
-                    response = cached_get_request(extensions_descriptor_url)
-                else:
-                    response = requests.get(extensions_descriptor_url)
                 extensions_descriptor = response.json()
 
             except ValueError:  # would be json.JSONDecodeError for Python 3.5+
@@ -249,11 +364,17 @@ class SchemaOCDS(SchemaJsonMixin):
             self.extensions[extensions_descriptor_url] = extension_description
             self.extended = True
 
-    def create_extended_release_schema_file(self, upload_dir, upload_url):
+    def create_extended_release_schema_file(self, upload_dir, upload_url, link=True):
+        '''Make the extended release schema available as extended_release_schema.json in ``upload_dir``.
+
+        With EXTENDED_SCHEMA_DIR set and ``link``, the file in ``upload_dir`` is
+        a link to the copy of the schema shared by all the uploads, which is the
+        one used for validation.
+        '''
         filepath = os.path.join(upload_dir, 'extended_release_schema.json')
 
         # Always replace any existing extended schema file
-        if os.path.exists(filepath):
+        if os.path.lexists(filepath):
             os.remove(filepath)
             self.extended_schema_file = None
             self.extended_schema_url = None
@@ -261,45 +382,58 @@ class SchemaOCDS(SchemaJsonMixin):
         if not self.extensions:
             return
 
-        release_schema_obj = self.get_release_schema_obj()
+        self.get_release_schema_obj()
         if not self.extended:
             return
 
-        with open(filepath, 'w') as fp:
-            release_schema_str = json.dumps(release_schema_obj, indent=4)
-            fp.write(release_schema_str)
-
         self.extended_schema_file = filepath
         self.extended_schema_url = urljoin(upload_url, 'extended_release_schema.json')
+        if settings.EXTENDED_SCHEMA_DIR:
+            self.extended_schema_file = _store_extended_schema(self.extended_schema_str, self.extended_schema_hash)
+            if link:
+                try:
+                    os.symlink(os.path.relpath(self.extended_schema_file, upload_dir), filepath)
+                    return
+                except OSError:
+                    pass
+
+        with open(filepath, 'w') as fp:
+            fp.write(self.extended_schema_str)
 
     @cached_property
     def record_pkg_schema_str(self):
-        uri_scheme = urlparse(self.record_pkg_schema_url).scheme
-        if uri_scheme == 'http' or uri_scheme == 'https':
-            if self.cache_schema:
-                response = cached_get_request(self.record_pkg_schema_url)
-            else:
-                response = requests.get(self.record_pkg_schema_url)
-            return response.text
-        else:
-            with open(self.record_pkg_schema_url) as fp:
-                return fp.read()
+        return self.get_schema_str(self.record_pkg_schema_url)
 
     @property
     def _record_pkg_schema_obj(self):
-        return json.loads(self.record_pkg_schema_str)
+        schema_str = self.record_pkg_schema_str
+        return schema_registry.get_object(('json', schema_str), lambda: json.loads(schema_str))
+
+    def _deref_extended_record_pkg_schema(self):
+        deref_release_schema_obj = self.get_release_schema_obj(deref=True)
+        deref_package_schema = _deref_schema.__wrapped__(self.record_pkg_schema_str, self.schema_host)
+        deref_package_schema['properties']['records']['items'][
+            'properties']['compiledRelease'] = deref_release_schema_obj
+        deref_package_schema['properties']['records']['items'][
+            'properties']['releases']['oneOf'][1] = deref_release_schema_obj
+        return deref_package_schema
 
     def get_record_pkg_schema_obj(self, deref=False):
         if deref:
-            deref_package_schema = self.deref_schema(self.record_pkg_schema_str)
             if self.extended:
-                deref_release_schema_obj = self.get_release_schema_obj(deref=True)
-                deref_package_schema['properties']['records']['items'][
-                    'properties']['compiledRelease'] = deref_release_schema_obj
-                deref_package_schema['properties']['records']['items'][
-                    'properties']['releases']['oneOf'][1] = deref_release_schema_obj
-            return deref_package_schema
-        return deepcopy(self._record_pkg_schema_obj)
+                return self._get_extended_obj('extended_record_pkg_schema_deref',
+                                              self._deref_extended_record_pkg_schema)
+            return self.deref_schema(self.record_pkg_schema_str)
+        return self._record_pkg_schema_obj
+
+    def get_release_pkg_schema_index(self, use_extensions=True):
+        return self.get_schema_index('release_pkg_schema_index',
+                                     self.get_release_pkg_schema_obj(deref=True, use_extensions=use_extensions),
+                                     extended=bool(self.extended and use_extensions))
+
+    def get_record_pkg_schema_index(self):
+        return self.get_schema_index('record_pkg_schema_index', self.get_record_pkg_schema_obj(deref=True),
+                                     extended=self.extended)
 
     def get_record_pkg_schema_fields(self):
-        return set(schema_dict_fields_generator(self.get_record_pkg_schema_obj(deref=True)))
+        return set(self.get_record_pkg_schema_index().fields)
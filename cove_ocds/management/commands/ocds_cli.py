@@ -6,36 +6,75 @@ from django.conf import settings
 from django.core.management.base import CommandError
 
 from cove.management.commands.base_command import CoveBaseCommand, SetEncoder
-from cove_ocds.lib.api import APIException, ocds_json_output
+
+
+# The libraries checking the data are imported when used, so that e.g. --help is fast
+
+
+def process_file(output_dir, file, options):
+    '''Return the results of a file of a batch'''
+    from cove_ocds.lib.api import ocds_json_output
+
+    return ocds_json_output(output_dir, file, options['schema_version'], options['convert'],
+                            cache_schema=options.get('cache_schema', True),
+                            validation_workers=options['validation_workers'])
 
 
 class Command(CoveBaseCommand):
     help = 'Run Command Line version of Cove OCDS'
+    file_options = ('schema_version', 'convert', 'validation_workers')
+    process_file = staticmethod(process_file)
 
     def add_arguments(self, parser):
         parser.add_argument('--schema-version', '-s', default='',
                             help='Version of the schema to validate the data')
         parser.add_argument('--convert', '-c', action='store_true',
                             help='Convert data from nested (json) to flat format (spreadsheet) or vice versa')
+        parser.add_argument('--validation-workers', '-w', type=int, default=None,
+                            help='Number of processes validating the data against the schema, '
+                                 'defaults to the VALIDATION_WORKERS setting')
         super(Command, self).add_arguments(parser)
 
-    def handle(self, file, *args, **options):
-        super(Command, self).handle(file, *args, **options)
-
+    def get_file_options(self, options):
         schema_version = options.get('schema_version')
-        convert = options.get('convert')
         version_choices = settings.COVE_CONFIG['schema_version_choices']
 
         if schema_version and schema_version not in version_choices:
             raise CommandError('Value for schema version option is not valid. Accepted values: {}'.format(
                 str(list(version_choices.keys()))
             ))
+        return super(Command, self).get_file_options(options)
+
+    def handle(self, file, *args, **options):
+        file_options = self.get_file_options(options)
+        schema_version = file_options['schema_version']
+        convert = file_options['convert']
+        validation_workers = file_options['validation_workers']
+
+        if options.get('batch'):
+            self.handle_batch(file, **options)
+            return
+
+        super(Command, self).handle(file, *args, **options)
+
+        from cove_ocds.lib.api import APIException, ocds_json_output
 
         try:
-            result = ocds_json_output(self.output_dir, file, schema_version, convert, cache_schema=True)
+            result = ocds_json_output(self.output_dir, file, schema_version, convert, cache_schema=True,
+                                      validation_workers=validation_workers)
         except APIException as e:
             self.stdout.write(str(e))
             sys.exit(1)
 
         with open(os.path.join(self.output_dir, "results.json"), 'w+') as result_file:
             json.dump(result, result_file, indent=2, sort_keys=True, cls=SetEncoder)
+
+    def warm_up(self, file_options=None):
+        from cove_ocds.lib.schema import warm_up
+
+        if file_options is None:
+            warm_up(list(settings.COVE_CONFIG['schema_version_choices']))
+        elif file_options['schema_version']:
+            warm_up([file_options['schema_version']])
+        else:
+            warm_up()
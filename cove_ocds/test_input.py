@@ -1,5 +1,11 @@
+import gzip
+import io
 import os
+import zipfile
+
 import pytest
+from django.conf import settings
+
 import cove.input.views as v
 from cove.input.models import SuppliedData
 
@@ -86,3 +92,53 @@ def test_directory_for_empty_filename(rf):
     supplied_datas = SuppliedData.objects.all()
     assert len(supplied_datas) == 1
     assert os.path.isdir(supplied_datas[0].upload_dir())
+
+
+def zip_content(*names):
+    fp = io.BytesIO()
+    with zipfile.ZipFile(fp, 'w') as archive:
+        for name in names:
+            archive.writestr(name, '{"grants": []}')
+    return fp.getvalue()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('content,headers,file_name', [
+    (b'{"grants": []}', {}, 'file'),
+    (gzip.compress(b'{"grants": []}'), {'content-type': 'application/gzip'}, 'file'),
+    (gzip.compress(b'{"grants": []}'), {'content-disposition': 'attachment; filename="grants.json.gz"'}, 'file.json'),
+    (zip_content('data/grants.json'), {'content-type': 'application/zip'}, 'grants.json'),
+], ids=['plain', 'gzip', 'gzip_name', 'zip'])
+def test_download(rf, httpserver, content, headers, file_name):
+    httpserver.serve_content(content, headers=headers)
+    resp = v.data_input(fake_cove_middleware(rf.post('/', {
+        'source_url': httpserver.url
+    })))
+    assert resp.status_code == 302
+    data = SuppliedData.objects.get()
+    assert os.path.basename(data.original_file.name) == file_name
+    assert data.original_file.read() == b'{"grants": []}'
+    assert data.content_hash == '39271f93a1c222e389624d8eb3b249d8d90e71bd047f52f87b20560fbbc5b209'
+    assert data.downloaded_size == data.download_size == len(content)
+    assert os.listdir(data.upload_dir()) == [file_name]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('content,headers,message', [
+    (b'{"grants": []}' * 100, {}, b'The file is bigger than the maximum size of 1.0\xc2\xa0KB.'),
+    (gzip.compress(b'{"grants": []}' * 100), {'content-type': 'application/gzip'}, b'maximum size'),
+    (b'{"grants": []}', {'content-type': 'application/gzip'}, b'The file is not a valid gzip file.'),
+    (zip_content('a.json', 'b.json'), {'content-type': 'application/zip'},
+     b'A zip file must contain a single file, this one contains 2.'),
+], ids=['too_big', 'gzip_too_big', 'bad_gzip', 'zip_several_files'])
+def test_download_error(rf, httpserver, monkeypatch, content, headers, message):
+    monkeypatch.setattr(settings, 'DOWNLOAD_MAX_SIZE', 1024)
+    httpserver.serve_content(content, headers=headers)
+    resp = v.data_input(fake_cove_middleware(rf.post('/', {
+        'source_url': httpserver.url
+    })))
+    assert resp.status_code == 200
+    assert message in resp.content
+    data = SuppliedData.objects.get()
+    assert not data.original_file
+    assert not os.path.exists(data.upload_dir()) or os.listdir(data.upload_dir()) == []
@@ -1,24 +1,34 @@
+import csv
 import json
 import os
 import io
+import subprocess
+import sys
 import time
 import uuid
 from collections import OrderedDict
 from unittest.mock import patch
 
 import pytest
+import requests
 from django.conf import settings
 from django.core.files.base import ContentFile
-from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadedfile import SimpleUploadedFile, UploadedFile
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.utils import translation
 
 import cove.lib.common as cove_common
 from .lib.api import APIException, context_api_transform, ocds_json_output
 from .lib.ocds import get_releases_aggregates, get_bad_ocds_prefixes
 from .lib.schema import SchemaOCDS
+from cove.input import jobs, result_cache
 from cove.input.models import SuppliedData
 from cove.lib.converters import convert_json, convert_spreadsheet
+from cove.lib.error_store import ErrorStore
+from cove.lib.registry import schema_registry
+from cove.lib.stream import StreamedList
 from cove.lib.tools import cached_get_request
 
 
@@ -265,6 +275,53 @@ def test_get_schema_validation_errors():
         assert len(error_list) > 0
 
 
+def test_get_schema_validation_errors_parallel(monkeypatch):
+    schema_obj = SchemaOCDS()
+    schema_obj.schema_host = os.path.join('cove_ocds', 'fixtures/')
+    schema_obj.release_pkg_schema_name = 'release_package_schema_ref_release_schema_deprecated_fields.json'
+    schema_obj.release_pkg_schema_url = os.path.join(schema_obj.schema_host, schema_obj.release_pkg_schema_name)
+    # Resolve references to the release schema with the local fixture
+    schema_obj.extended = True
+    schema_obj.extended_schema_file = os.path.join(schema_obj.schema_host, 'release_schema_deprecated_fields.json')
+
+    with open(os.path.join('cove_ocds', 'fixtures', 'badfile_all_validation_errors.json')) as fp:
+        data = json.load(fp)
+    data['releases'] = data['releases'] * 3 + [{'id': 1}, 'not a release']
+    del data['publisher']
+    cell_src_map = {'releases/{}/id'.format(num): [['releases', 'A', num + 2, 'id']]
+                    for num in range(len(data['releases']))}
+    heading_src_map = {'releases/date': [['releases', 'Release Date']]}
+
+    serial = cove_common.get_schema_validation_errors(data, schema_obj, schema_obj.release_pkg_schema_name,
+                                                      cell_src_map, heading_src_map, workers=0)
+    validator_keys = []
+    get_items_validator_key = cove_common._get_items_validator_key
+
+    def recording_get_items_validator_key(*args):
+        validator_keys.append(get_items_validator_key(*args))
+        return validator_keys[-1]
+    monkeypatch.setattr(cove_common, '_get_items_validator_key', recording_get_items_validator_key)
+    submitted_args = []
+    submit_items_validation = cove_common._submit_items_validation
+
+    def recording_submit_items_validation(executor, args):
+        submitted_args.append(args)
+        return submit_items_validation(executor, args)
+    monkeypatch.setattr(cove_common, '_submit_items_validation', recording_submit_items_validation)
+    parallel = cove_common.get_schema_validation_errors(data, schema_obj, schema_obj.release_pkg_schema_name,
+                                                        cell_src_map, heading_src_map, workers=2)
+    assert len(serial) > 1
+    assert list(parallel.items()) == list(serial.items())
+    # Once for all the chunks
+    assert len(validator_keys) == 1
+    # The chunks only carry the path of the package schema, removed afterwards
+    assert len(submitted_args) > 1
+    schema_files = {args[0] for args in submitted_args}
+    assert len(schema_files) == 1
+    assert not any(isinstance(arg, dict) and 'properties' in arg for args in submitted_args for arg in args)
+    assert not os.path.exists(schema_files.pop())
+
+
 def test_get_json_data_generic_paths():
     with open(os.path.join('cove_ocds', 'fixtures', 'tenders_releases_2_releases_with_deprecated_fields.json')) as fp:
         json_data_w_deprecations = json.load(fp)
@@ -285,7 +342,7 @@ def test_get_json_data_deprecated_fields():
     schema_obj.schema_host = os.path.join('cove_ocds', 'fixtures/')
     schema_obj.release_pkg_schema_name = 'release_package_schema_ref_release_schema_deprecated_fields.json'
     schema_obj.release_pkg_schema_url = os.path.join(schema_obj.schema_host, schema_obj.release_pkg_schema_name)
-    json_data_paths = cove_common.get_json_data_generic_paths(json_data_w_deprecations)
+    json_data_paths = cove_common.get_json_data_paths_index(json_data_w_deprecations, schema_obj)
     deprecated_data_fields = cove_common.get_json_data_deprecated_fields(json_data_paths, schema_obj)
     expected_result = OrderedDict([
         ('initiationType', {"paths": ('releases/0', 'releases/1'),
@@ -299,6 +356,27 @@ def test_get_json_data_deprecated_fields():
         assert expected_result[field_name]["explanation"] == deprecated_data_fields[field_name]["explanation"]
 
 
+def test_get_json_data_paths_index():
+    schema_obj = SchemaOCDS()
+    schema_obj.schema_host = os.path.join('cove_ocds', 'fixtures/')
+    schema_obj.release_pkg_schema_name = 'release_package_schema_ref_release_schema_deprecated_fields.json'
+    schema_obj.release_pkg_schema_url = os.path.join(schema_obj.schema_host, schema_obj.release_pkg_schema_name)
+    json_data = {'releases': [
+        {'initiationType': 'tender', 'buyer': {'additionalIdentifiers': [{'id': 'a'}, {'scheme': 'b'}]}},
+        {'tender': {'id': '1'}},
+    ]}
+    json_data_paths = cove_common.get_json_data_paths_index(json_data, schema_obj)
+
+    assert ('releases', 'initiationType') in json_data_paths
+    assert ('releases', 'tender', 'hasEnquiries') not in json_data_paths
+    assert json_data_paths.field_paths(('releases', 'initiationType')) == [('releases', 0, 'initiationType')]
+    assert json_data_paths.items_without_id(('releases', 'buyer', 'additionalIdentifiers')) == [
+        ('releases', 0, 'buyer', 'additionalIdentifiers', 1)
+    ]
+    # Paths the schema index has no interest in are not recorded
+    assert ('releases', 'tender') not in json_data_paths
+
+
 def test_get_schema_deprecated_paths():
     schema_obj = SchemaOCDS()
     schema_obj.schema_host = os.path.join('cove_ocds', 'fixtures/')
@@ -318,6 +396,23 @@ def test_get_schema_deprecated_paths():
         assert path in deprecated_paths
 
 
+def test_schema_index():
+    schema_obj = SchemaOCDS()
+    schema_obj.schema_host = os.path.join('cove_ocds', 'fixtures/')
+    schema_obj.release_pkg_schema_name = 'release_package_schema_ref_release_schema_deprecated_fields.json'
+    schema_obj.release_pkg_schema_url = os.path.join(schema_obj.schema_host, schema_obj.release_pkg_schema_name)
+    schema_index = schema_obj.get_release_pkg_schema_index()
+
+    assert schema_obj.get_release_pkg_schema_index() is schema_index
+    assert '/releases/tender/items/quantity' in schema_index.fields
+    assert schema_index.deprecated_paths == cove_common._get_schema_deprecated_paths(schema_obj)
+
+    schema_block, ref_info = schema_index.lookup('releases/tender')
+    assert 'properties' in schema_block
+    assert schema_index.lookup('releases/tender')[0] is schema_block
+    assert schema_index.lookup('releases/unknown') == (None, None)
+
+
 @pytest.mark.django_db
 @pytest.mark.parametrize('json_data', [
     # A selection of JSON strings we expect to give a 200 status code, even
@@ -370,6 +465,160 @@ def test_explore_page(client, json_data):
     assert resp.status_code == 200
 
 
+class RecordingExecutor():
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, fn, *args):
+        self.jobs.append((fn, args))
+
+
+@pytest.mark.django_db
+def test_explore_page_job(client, monkeypatch):
+    monkeypatch.setattr(settings, 'JOB_WORKERS', 1)
+    executor = RecordingExecutor()
+    monkeypatch.setattr(jobs, 'get_executor', lambda: executor)
+
+    data = SuppliedData.objects.create()
+    data.original_file.save('test.json', ContentFile('[]'))
+    data.current_app = 'cove_ocds'
+    resp = client.get(data.get_absolute_url())
+    assert resp.status_code == 202
+    assert resp.templates[0].name == 'processing.html'
+    assert len(executor.jobs) == 1
+
+    # Polling doesn't queue the job again
+    resp = client.get(data.get_absolute_url())
+    assert resp.status_code == 202
+    assert len(executor.jobs) == 1
+    # Neither do options posted while it is active, which the page says
+    resp = client.post(data.get_absolute_url(), {'version': '1.0'})
+    assert resp.status_code == 409
+    assert resp.context['job_options_ignored']
+    assert len(executor.jobs) == 1
+    status = client.get(reverse('job_status', args=(data.pk,))).json()
+    assert status['state'] == 'queued'
+
+    fn, args = executor.jobs[0]
+    fn(*args)
+    status = client.get(reverse('job_status', args=(data.pk,))).json()
+    assert status['state'] == 'done'
+    assert status['finished']
+
+    for i in range(2):
+        resp = client.get(data.get_absolute_url())
+        assert resp.status_code == 200
+        assert b'OCDS JSON should have an object as the top level' in resp.content
+    assert len(executor.jobs) == 1
+
+    # Posting new options queues a new job
+    resp = client.post(data.get_absolute_url(), {'version': '1.0'})
+    assert resp.status_code == 302
+    assert len(executor.jobs) == 2
+    assert executor.jobs[1][1][3] == {'version': '1.0', 'flatten': None}
+    assert executor.jobs[1][1][4] == 'en'
+
+
+@pytest.mark.django_db
+def test_run_job_language():
+    data = SuppliedData.objects.create()
+    data.original_file.save('test.json', ContentFile('[]'))
+    languages = []
+
+    def func(db_data, context, options):
+        languages.append(translation.get_language())
+        return {}
+
+    jobs.run_job(data.pk, func, {}, {}, 'es')
+    assert languages == ['es']
+    data.refresh_from_db()
+    assert data.job_state == 'done'
+
+
+@pytest.mark.django_db
+def test_upload_content_hash(client):
+    resp = client.post(reverse('index'), {
+        'original_file': SimpleUploadedFile('test.json', b'{"releases": []}'),
+        'csrfmiddlewaretoken': 'token',
+    })
+    assert resp.status_code == 302
+    data = SuppliedData.objects.get(form_name='upload_form')
+    assert data.content_hash == 'bbbea12b796d1db82cf1defa061dfd0b8edb0905f253d678e3b73be30fedc7e0'
+    assert data.get_content_hash() == data.content_hash
+
+
+def explore_result_cache(db_data, context, options):
+    os.makedirs(os.path.join(db_data.upload_dir(), 'flattened'), exist_ok=True)
+    with open(os.path.join(db_data.upload_dir(), 'flattened', 'main.csv'), 'w') as fp:
+        fp.write(db_data.original_file.read().decode('utf-8'))
+    context['converted_url'] = db_data.upload_url() + '/flattened'
+    context['releases'] = StreamedList(db_data.original_file.path, 'releases', 0)
+    context['options'] = options
+    db_data.schema_version = '1.1'
+    db_data.save()
+    return context
+
+
+@pytest.mark.django_db
+def test_result_cache(monkeypatch, tmpdir):
+    monkeypatch.setattr(settings, 'RESULT_CACHE_DIR', str(tmpdir))
+    calls = []
+
+    def explore(db_data, context, options):
+        calls.append(db_data.pk)
+        return explore_result_cache(db_data, context, options)
+
+    def run(content, options=None, file_name='test.json'):
+        data = SuppliedData.objects.create(current_app='cove_ocds')
+        data.original_file.save(file_name, ContentFile(content))
+        return data, result_cache.run_cached(explore, data, {'data_uuid': data.pk, 'file_type': 'json'}, options or {})
+
+    data, context = run('{"releases": []}')
+    assert calls == [data.pk]
+    assert len(tmpdir.listdir()) == 1
+
+    other_data, other_context = run('{"releases": []}', file_name='other.json')
+    assert calls == [data.pk]
+    assert other_context['data_uuid'] == other_data.pk
+    assert other_context['converted_url'] == other_data.upload_url() + '/flattened'
+    assert other_context['releases'].file_name == other_data.original_file.path
+    with open(os.path.join(other_data.upload_dir(), 'flattened', 'main.csv')) as fp:
+        assert fp.read() == '{"releases": []}'
+    other_data.refresh_from_db()
+    assert other_data.schema_version == '1.1'
+    assert other_data.content_hash == data.content_hash
+
+    version_data, _ = run('{"releases": []}', {'version': '1.0'})
+    assert calls == [data.pk, version_data.pk]
+    content_data, _ = run('{"releases": [{}]}')
+    assert calls == [data.pk, version_data.pk, content_data.pk]
+    assert len(tmpdir.listdir()) == 3
+    with translation.override('es'):
+        language_data, _ = run('{"releases": []}')
+    assert calls == [data.pk, version_data.pk, content_data.pk, language_data.pk]
+    assert len(tmpdir.listdir()) == 4
+
+    # Data that has been shown is checked again
+    data.rendered = True
+    result_cache.run_cached(explore, data, {'file_type': 'json'}, {})
+    assert calls[-1] == data.pk
+
+
+@pytest.mark.django_db
+def test_validation_errors_download(client):
+    data = SuppliedData.objects.create()
+    data.original_file.save('test.json', ContentFile('{}'))
+    url = reverse('validation_errors_download', args=(data.pk,))
+    assert client.get(url).status_code == 404
+
+    with open(os.path.join(data.upload_dir(), 'validation_errors_full.jsonl'), 'w') as fp:
+        fp.write('{"error": {"message": "a"}, "value": {"path": "a"}}\n')
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp['Content-Disposition'] == 'attachment; filename="validation_errors.jsonl"'
+    assert b''.join(resp.streaming_content) == b'{"error": {"message": "a"}, "value": {"path": "a"}}\n'
+
+
 @pytest.mark.django_db
 def test_explore_page_convert(client):
     data = SuppliedData.objects.create()
@@ -658,6 +907,37 @@ def test_schema_ocds_extensions(release_data, extensions, invalid_extension, ext
         assert not release_schema_obj['definitions']['Award']['properties'].get('agreedMetrics')
 
 
+def fake_extension_get(url):
+    '''Return the response for a file of the extension named after its directory'''
+    # The first extension is the slowest to download
+    if url.startswith('http://example.com/a/'):
+        time.sleep(0.2)
+    response = requests.Response()
+    response.url = url
+    response.status_code = 200
+    name = url.split('/')[-2]
+    if url.endswith('extension.json'):
+        response._content = json.dumps({'name': name}).encode('utf-8')
+    else:
+        response._content = json.dumps({'definitions': {'Tender': {'title': name}},
+                                        'properties': {name: {}}}).encode('utf-8')
+    return response
+
+
+def test_schema_ocds_apply_extensions_order(monkeypatch):
+    extensions = ['http://example.com/{}/extension.json'.format(name) for name in ('a', 'b', 'c')]
+    monkeypatch.setattr(schema_registry, 'get', fake_extension_get)
+    schema = SchemaOCDS(release_data={'version': '1.1', 'extensions': extensions})
+    schema_obj = {'definitions': {'Tender': {'title': 'Tender'}}, 'properties': {}}
+    schema.apply_extensions(schema_obj)
+
+    # Patches are applied in the order the extensions are declared
+    assert schema_obj == {'definitions': {'Tender': {'title': 'c'}}, 'properties': {'a': {}, 'b': {}, 'c': {}}}
+    assert list(schema.extensions) == extensions
+    assert [extension['name'] for extension in schema.extensions.values()] == ['a', 'b', 'c']
+    assert schema.extended
+
+
 @pytest.mark.django_db
 def test_schema_ocds_extended_release_schema_file():
     data = SuppliedData.objects.create()
@@ -674,7 +954,9 @@ def test_schema_ocds_extended_release_schema_file():
     assert not schema.extended_schema_url
 
     schema.create_extended_release_schema_file(data.upload_dir(), data.upload_url())
-    assert schema.extended_schema_file == os.path.join(data.upload_dir(), 'extended_release_schema.json')
+    assert os.path.dirname(schema.extended_schema_file) == settings.EXTENDED_SCHEMA_DIR
+    assert os.path.samefile(schema.extended_schema_file,
+                            os.path.join(data.upload_dir(), 'extended_release_schema.json'))
     assert schema.extended_schema_url == os.path.join(data.upload_url(), 'extended_release_schema.json')
 
     json_data = json.loads('{"version": "1.1", "extensions": [], "releases": [{"ocid": "xx"}]}')
@@ -686,6 +968,33 @@ def test_schema_ocds_extended_release_schema_file():
     assert not schema.extended_schema_url
 
 
+def test_schema_ocds_extended_schema_store(monkeypatch, tmpdir):
+    monkeypatch.setattr(settings, 'EXTENDED_SCHEMA_DIR', str(tmpdir.join('store')))
+    monkeypatch.setattr(schema_registry, 'get', fake_extension_get)
+    monkeypatch.setattr(SchemaOCDS, '_release_schema_obj', {'definitions': {}, 'properties': {}})
+
+    # Different extensions with the same patches give the same schema, stored once
+    schemas = []
+    for num, host in enumerate(('http://example.com', 'http://example.org')):
+        schema = SchemaOCDS(release_data={'version': '1.1', 'extensions': [host + '/b/extension.json']})
+        upload_dir = tmpdir.mkdir('upload{}'.format(num))
+        schema.create_extended_release_schema_file(str(upload_dir), '/media/upload{}/'.format(num))
+        assert schema.extended_schema_url == '/media/upload{}/extended_release_schema.json'.format(num)
+        assert upload_dir.join('extended_release_schema.json').islink()
+        assert json.loads(upload_dir.join('extended_release_schema.json').read()) == {
+            'definitions': {'Tender': {'title': 'b'}}, 'properties': {'b': {}}}
+        schemas.append(schema)
+    assert schemas[0].extended_schema_file == schemas[1].extended_schema_file
+    assert tmpdir.join('store').listdir() == [schemas[0].extended_schema_file]
+    assert schemas[0].get_release_schema_obj(deref=True) is schemas[1].get_release_schema_obj(deref=True)
+
+    # Without links, the upload directory gets its own copy
+    output_dir = tmpdir.mkdir('output')
+    schemas[0].create_extended_release_schema_file(str(output_dir), '', link=False)
+    assert not output_dir.join('extended_release_schema.json').islink()
+    assert output_dir.join('extended_release_schema.json').read() == tmpdir.join('store').listdir()[0].read()
+
+
 @pytest.mark.django_db
 def test_schema_after_version_change(client):
     data = SuppliedData.objects.create()
@@ -698,7 +1007,7 @@ def test_schema_after_version_change(client):
     with open(os.path.join(data.upload_dir(), 'extended_release_schema.json')) as extended_release_fp:
         assert "mainProcurementCategory" in json.load(extended_release_fp)['definitions']['Tender']['properties']
 
-    with open(os.path.join(data.upload_dir(), 'validation_errors-3.json')) as validation_errors_fp:
+    with open(os.path.join(data.upload_dir(), 'validation_errors-4.json')) as validation_errors_fp:
         assert "'version' is missing but required" in validation_errors_fp.read()
 
     # test link is still there.
@@ -709,7 +1018,7 @@ def test_schema_after_version_change(client):
     with open(os.path.join(data.upload_dir(), 'extended_release_schema.json')) as extended_release_fp:
         assert "mainProcurementCategory" in json.load(extended_release_fp)['definitions']['Tender']['properties']
 
-    with open(os.path.join(data.upload_dir(), 'validation_errors-3.json')) as validation_errors_fp:
+    with open(os.path.join(data.upload_dir(), 'validation_errors-4.json')) as validation_errors_fp:
         assert "'version' is missing but required" in validation_errors_fp.read()
 
     resp = client.post(data.get_absolute_url(), {'version': '1.0'})
@@ -718,7 +1027,7 @@ def test_schema_after_version_change(client):
     with open(os.path.join(data.upload_dir(), 'extended_release_schema.json')) as extended_release_fp:
         assert "mainProcurementCategory" not in json.load(extended_release_fp)['definitions']['Tender']['properties']
 
-    with open(os.path.join(data.upload_dir(), 'validation_errors-3.json')) as validation_errors_fp:
+    with open(os.path.join(data.upload_dir(), 'validation_errors-4.json')) as validation_errors_fp:
         assert "'version' is missing but required" not in validation_errors_fp.read()
 
 
@@ -738,7 +1047,7 @@ def test_schema_after_version_change_record(client):
     with open(os.path.join(data.upload_dir(), 'extended_release_schema.json')) as extended_release_fp:
         assert "mainProcurementCategory" in json.load(extended_release_fp)['definitions']['Tender']['properties']
 
-    with open(os.path.join(data.upload_dir(), 'validation_errors-3.json')) as validation_errors_fp:
+    with open(os.path.join(data.upload_dir(), 'validation_errors-4.json')) as validation_errors_fp:
         assert "'version' is missing but required" in validation_errors_fp.read()
 
     # test link is still there.
@@ -749,7 +1058,7 @@ def test_schema_after_version_change_record(client):
     with open(os.path.join(data.upload_dir(), 'extended_release_schema.json')) as extended_release_fp:
         assert "mainProcurementCategory" in json.load(extended_release_fp)['definitions']['Tender']['properties']
 
-    with open(os.path.join(data.upload_dir(), 'validation_errors-3.json')) as validation_errors_fp:
+    with open(os.path.join(data.upload_dir(), 'validation_errors-4.json')) as validation_errors_fp:
         assert "'version' is missing but required" in validation_errors_fp.read()
 
     resp = client.post(data.get_absolute_url(), {'version': '1.0'})
@@ -758,7 +1067,7 @@ def test_schema_after_version_change_record(client):
     with open(os.path.join(data.upload_dir(), 'extended_release_schema.json')) as extended_release_fp:
         assert "mainProcurementCategory" not in json.load(extended_release_fp)['definitions']['Tender']['properties']
 
-    with open(os.path.join(data.upload_dir(), 'validation_errors-3.json')) as validation_errors_fp:
+    with open(os.path.join(data.upload_dir(), 'validation_errors-4.json')) as validation_errors_fp:
         assert "'version' is missing but required" not in validation_errors_fp.read()
 
 
@@ -769,7 +1078,7 @@ def test_schema_after_version_change_record(client):
 def test_corner_cases_for_deprecated_data_fields(json_data):
     data = json.loads(json_data)
     schema = SchemaOCDS(release_data=data)
-    json_data_paths = cove_common.get_json_data_generic_paths(data)
+    json_data_paths = cove_common.get_json_data_paths_index(data, schema)
     deprecated_fields = cove_common.get_json_data_deprecated_fields(json_data_paths, schema)
 
     assert deprecated_fields['additionalIdentifiers']['explanation'][0] == '1.1'
@@ -818,11 +1127,38 @@ def test_context_api_transform_validation_additional_fields():
 
     assert transform_context['extensions'] == expected_context['extensions']
     assert transform_context['deprecated_fields'] == expected_context['deprecated_fields']
-    assert 'validation_errors_count' not in transform_context.keys()
+    assert transform_context['validation_errors_count'] == 3
+    assert [group['count'] for group in transform_context['validation_error_counts']] == [1, 1, 1]
+    assert not transform_context['validation_errors_truncated']
+    assert transform_context['validation_errors_full'] == 'validation_errors_full.jsonl'
     assert 'additional_fields_count' not in transform_context.keys()
     assert 'data_only' not in transform_context.keys()
 
 
+def test_context_api_transform_validation_errors_truncated():
+    error_store = ErrorStore(max_samples=100)
+    for i in range(150):
+        error_store.add('{"message": "a", "message_type": "date-time", "path_no_number": "date"}',
+                        {'path': 'releases/{}/date'.format(i), 'value': 'x'})
+    error_store.add('{"message": "b", "message_type": "required", "path_no_number": "id"}', {'path': 'releases/0'})
+    context = {
+        'validation_errors': error_store.context_errors(),
+        'validation_errors_count': error_store.total,
+        'data_only': [],
+        'additional_fields_count': 0,
+    }
+    transform_context = context_api_transform(context)
+
+    assert len(transform_context['validation_errors']) == 101
+    assert transform_context['validation_errors_count'] == 151
+    assert transform_context['validation_error_counts'] == [
+        {'type': 'date-time', 'field': 'date', 'description': 'a', 'count': 150},
+        {'type': 'required', 'field': 'id', 'description': 'b', 'count': 1},
+    ]
+    assert transform_context['validation_errors_truncated']
+    assert transform_context['validation_errors_full'] == 'validation_errors_full.jsonl'
+
+
 def test_context_api_transform_extensions():
     '''Expected result for extensions after trasform:
 
@@ -1003,9 +1339,44 @@ def test_cove_ocds_cli_schema_version_override(file_name, version_option):
     assert version_in_data == '1.1'
 
 
+def test_cove_ocds_cli_batch(tmpdir):
+    for name in ('tenders_releases_2_releases.json', 'tenders_releases_2_releases_not_json.json',
+                 'badfile_all_validation_errors.json'):
+        tmpdir.join(name).write(open(os.path.join('cove_ocds', 'fixtures', name)).read())
+    output_dir = os.path.join('media', str(uuid.uuid4()))
+
+    with pytest.raises(SystemExit):
+        call_command('ocds_cli', str(tmpdir), batch=True, schema_version='1.1', output_dir=output_dir, jobs=2)
+
+    with open(os.path.join(output_dir, 'summary.csv')) as fp:
+        summary = {os.path.basename(row['file']): row for row in csv.DictReader(fp)}
+    assert summary['tenders_releases_2_releases.json']['status'] == 'ok'
+    assert summary['badfile_all_validation_errors.json']['status'] == 'ok'
+    assert int(summary['badfile_all_validation_errors.json']['validation_errors']) > 0
+    assert summary['tenders_releases_2_releases_not_json.json']['status'] == 'error'
+
+    with open(os.path.join(output_dir, 'badfile_all_validation_errors', 'results.json')) as fp:
+        results = json.load(fp)
+    assert results['version_used'] == '1.1'
+    assert results['validation_errors']
+
+
+def test_ocds_cli_startup_imports():
+    '''ocds-cli --help doesn't import the libraries checking the data'''
+    code = ("import sys, django; django.setup(); "
+            "from django.core.management import load_command_class; "
+            "load_command_class('cove_ocds', 'ocds_cli').create_parser('ocds-cli', 'ocds_cli').format_help(); "
+            "print(' '.join(sys.modules))")
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+    modules = subprocess.check_output([sys.executable, '-c', code], env=env).decode('utf-8').split()
+    for module in ('cove_ocds.lib.api', 'cove.lib.common', 'flattentool', 'openpyxl', 'jsonschema', 'requests', 'raven'):
+        assert module not in modules
+
+
 def test_cove_ocds_cli_schema_cache():
     #clear url cache
     cached_get_request.cache_clear()
+    schema_registry.clear()
 
     test_dir = str(uuid.uuid4())
     file_name = os.path.join('cove_ocds', 'fixtures', 'tenders_releases_1_release_with_invalid_extensions.json')
@@ -1085,7 +1456,7 @@ def test_get_json_data_missing_ids():
         'releases/1/tender/tenderers/2/id',
         'releases/1/tender/tenderers/4/id'
     ]
-    user_data_paths = cove_common.get_json_data_generic_paths(user_data)
+    user_data_paths = cove_common.get_json_data_paths_index(user_data, schema_obj)
     missin_ids_paths = cove_common.get_json_data_missing_ids(user_data_paths, schema_obj)
 
     assert missin_ids_paths == results
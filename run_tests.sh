@@ -1,4 +1,5 @@
 DJANGO_SETTINGS_MODULE=cove.settings py.test cove --cov --cov-report= $@
 DJANGO_SETTINGS_MODULE=cove_360.settings py.test cove_360 --cov-append --cov --cov-report= $@
 DJANGO_SETTINGS_MODULE=cove_ocds.settings py.test cove_ocds --cov-append --cov --cov-report= $@
+DJANGO_SETTINGS_MODULE=cove.settings py.test benchmarks --cov-append --cov --cov-report= $@
 DJANGO_SETTINGS_MODULE=cove_iati.settings py.test cove_iati --cov-append --cov $@